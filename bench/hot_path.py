@@ -0,0 +1,201 @@
+"""
+../bench/hot_path.py
+Microbenchmarks of the code that runs on every update, with the time and the
+memory allocated per call.
+
+Each benchmark is timed with timeit (garbage collection off), calibrated to
+at least 0.2 s per repeat; the minimum over the repeats is the reported time
+and the spread shows how stable it was. Memory is traced separately with
+tracemalloc: the peak bytes a single call allocates on top of what was
+already allocated, and the bytes and blocks still held per call after many
+calls and a garbage collection, which catches caches that grow and leaks.
+
+Given a previous report with --baseline, benchmarks slower than the baseline
+by more than --tolerance are listed and the exit status is 1.
+
+Usage: python -m bench.hot_path [--repeat 7] [--filter formatter] [--output report.json]
+       [--baseline previous.json] [--tolerance 0.2]
+"""
+
+import argparse
+import gc
+import json
+import statistics
+import sys
+import timeit
+import tracemalloc
+from typing import Callable
+
+from bot.conversation_flow import ConversationFlow
+from bot.handlers.conversation_flow_handlers import QuestionHandler, StateHandler
+from bot.services.dynamodb_constants import DynamoDBFormatter
+from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.metrics import BotMetrics
+from clients.fake_telethon_client import FakeTelegramClient
+from clients.in_memory_dynamodb_client import InMemoryDynamoDBClient
+from config.state_machine.state_machine_config import create_state_machine_config
+
+MIN_REPEAT_SECONDS = 0.2
+RETAINED_CALLS = 1_000
+
+
+def build_benchmarks() -> dict[str, Callable[[], object]]:
+    """Builds the benchmarked calls, sharing one configured machine and event."""
+    config = create_state_machine_config()
+    ConversationFlow.config(config)
+    telegram = FakeTelegramClient()
+    event = telegram.new_message(7, "نص السؤال")
+    storage = DynamoDBCrudManager(InMemoryDynamoDBClient(), "HotPath")
+    conversation = ConversationFlow("7", storage, event)
+    machine = ConversationFlow._MACHINE  # pylint: disable=protected-access
+    question_handler: QuestionHandler = conversation.question_handler
+    state = next(iter(config.inline_buttons))
+    buttons = config.inline_buttons[state]
+    question_data = {name: f"قيمة {name}" for name in config.db_attribute_labels}
+    user_inputs = {name: f"قيمة {name}" for name in config.messages}
+    sender = event.message.sender
+    bot_metrics = BotMetrics()
+
+    def add_and_remove_conversation():
+        machine.add_conversation(conversation, config.initial_state)
+        machine.remove_conversation(conversation)
+
+    def key_builders():
+        DynamoDBFormatter.prefix_user_pk("1234567")
+        DynamoDBFormatter.prefix_user_sk("1234567")
+        DynamoDBFormatter.prefix_question_sk("01HZX3W8QK6S9M2C4B7N5P0R1T")
+        DynamoDBFormatter.prefix_dest_chat_gsi2_pk("-1001234567890")
+        DynamoDBFormatter.prefix_dest_message_gsi2_sk("4242")
+        DynamoDBFormatter.prefix_question_status_gsi1_pk("🟡")
+        DynamoDBFormatter.prefix_question_answer_sk("01HZX3W8QK6S9M2C4B7N5P0R1V")
+        DynamoDBFormatter.prefix_answer_dest_msg_id_gsi1_pk("4243")
+
+    def track_handler():
+        with bot_metrics.track_handler("text"):
+            pass
+
+    return {
+        "conversation_flow_init": lambda: ConversationFlow("7", storage, event),
+        "add_remove_conversation": add_and_remove_conversation,
+        "strings_to_inline_buttons": lambda: StateHandler.strings_to_inline_buttons(
+            buttons, rtl=True
+        ),
+        "get_state_prompt": lambda: conversation.state_handler.get_state_prompt(state),
+        "format_question_message": lambda: (
+            question_handler._format_question_message(  # pylint: disable=protected-access
+                question_data
+            )
+        ),
+        "dynamodb_formatter_keys": key_builders,
+        "metrics_track_handler": track_handler,
+        "metrics_observe_transition": lambda: bot_metrics.observe_transition(
+            "ask", "menu", 0.004
+        ),
+        "build_question_data": lambda: (
+            QuestionHandler._build_question_data(  # pylint: disable=protected-access
+                event.message, user_inputs, sender
+            )
+        ),
+    }
+
+
+def measure_time(function: Callable[[], object], repeat: int) -> dict:
+    """Times the call, returning ns per call."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    while timer.timeit(number) < MIN_REPEAT_SECONDS:
+        number *= 2
+    per_call = [total / number * 1e9 for total in timer.repeat(repeat, number)]
+    best = min(per_call)
+    return {
+        "ns_per_call": round(best, 1),
+        "median_ns_per_call": round(statistics.median(per_call), 1),
+        "spread": round((max(per_call) - best) / best, 3),
+        "calls_per_repeat": number,
+    }
+
+
+def measure_memory(function: Callable[[], object]) -> dict:
+    """Traces the transient and retained memory of the call."""
+    function()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+
+        first = tracemalloc.take_snapshot()
+        results = [function() for _ in range(RETAINED_CALLS)]
+        del results
+        gc.collect()
+        second = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    differences = second.compare_to(first, "filename")
+    return {
+        "peak_bytes_per_call": peak - before,
+        "retained_bytes_per_call": round(
+            sum(stat.size_diff for stat in differences) / RETAINED_CALLS, 2
+        ),
+        "retained_blocks_per_call": round(
+            sum(stat.count_diff for stat in differences) / RETAINED_CALLS, 3
+        ),
+    }
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Lists the benchmarks slower than the baseline by more than the tolerance."""
+    slower = []
+    for name, result in report["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            continue
+        ratio = result["ns_per_call"] / previous["ns_per_call"]
+        if ratio > 1 + tolerance:
+            slower.append(
+                f"{name}: {previous['ns_per_call']} -> {result['ns_per_call']} ns "
+                f"({ratio - 1:+.0%})"
+            )
+    return slower
+
+
+def main(args: argparse.Namespace) -> int:
+    """Runs the benchmarks and writes the report."""
+    benchmarks = {
+        name: function
+        for name, function in build_benchmarks().items()
+        if args.filter is None or args.filter in name
+    }
+    report = {
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "benchmarks": {
+            name: {**measure_time(function, args.repeat), **measure_memory(function)}
+            for name, function in benchmarks.items()
+        },
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            slower = regressions(report, json.load(file), args.tolerance)
+        for line in slower:
+            print(f"Regression: {line}", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="a previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,351 @@
+"""
+../bench/load_test.py
+End-to-end load test of TelegramBot and its real handlers, with the fake
+Telegram client and the in-memory DynamoDB table standing in for the services.
+
+Simulated users walk the configured conversation graph concurrently: each one
+sends /start, presses the buttons of its current state (or types a text where
+the state expects one) until it has submitted its questions, and then gets
+every question answered by a reply in the destination chat. A user waits for
+the bot's response before its next step, like a person would.
+
+The JSON report holds the event rate, the handler latency percentiles per
+kind of event and the DB and Telegram calls per event, so that runs can be
+compared between commits.
+
+Usage: python -m bench.load_test [--users 200] [--questions 1] [--output report.json]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import Counter, defaultdict
+
+from bot.bot import TelegramBot
+from bot.conversation_flow import ConversationFlow
+from bot.handlers.callback_handler import initialize_callback_handler
+from bot.handlers.message_handlers import initialize_text_messege_handler
+from bot.handlers.start_handler import initialize_start_handler
+from bot.services.consumed_capacity import ConsumedCapacityTracker
+from bot.services.dynamodb_constants import (
+    DynamoDBAttributes,
+    DynamoDBFormatter,
+    DynamoDBKeySchema,
+    DynamoDBKeySchemaPrefix,
+)
+from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.send_scheduler import send_scheduler
+from bot.services.tracing import JsonlSink, tracer
+from bot.services.write_behind_buffer import WriteBehindBuffer
+from bot.state_machine import AUTO_TRIGGER_PREFIX, ConversationFlowStateMachine
+from clients.fake_telethon_client import (
+    FakeNewMessageEvent,
+    FakeTelegramClient,
+    FakeTelethonClient,
+)
+from clients.in_memory_dynamodb_client import InMemoryDynamoDBClient
+from config.state_machine.state_machine_config import create_state_machine_config
+
+TABLE_NAME = "LoadTest"
+USER_ID_BASE = 1_000_000
+ANSWERER_ID_BASE = 2_000_000
+UNLIMITED_RATE = 1e9
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """Returns the count, mean, p50, p95, p99 and max of durations in ms."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(quantile: float) -> float:
+        return round(
+            ordered[min(len(ordered) - 1, int(len(ordered) * quantile))] * 1e3, 3
+        )
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1e3, 3),
+        "p50": at(0.50),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": round(ordered[-1] * 1e3, 3),
+    }
+
+
+def flatten(buttons) -> list[str]:
+    """Flattens a state's button strings, given as a list or a list of rows."""
+    return [
+        button
+        for row in buttons
+        for button in (row if isinstance(row, list) else [row])
+    ]
+
+
+def git_commit() -> str | None:
+    """Returns the checked out commit, to label the report."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadTest:
+    """Runs the simulated users against a TelegramBot and collects the report."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.db_client = InMemoryDynamoDBClient(
+            latency=args.db_latency_ms / 1e3,
+            throttle_rate=args.db_throttle_rate,
+            seed=args.seed,
+        )
+        self.telegram = FakeTelegramClient(
+            latency=args.telegram_latency_ms / 1e3,
+            flood_wait_rate=args.flood_wait_rate,
+            flood_wait_seconds=args.flood_wait_seconds,
+            seed=args.seed,
+        )
+        self.config = create_state_machine_config()
+        self.machine = ConversationFlowStateMachine(self.config)
+        self.capacity_tracker = ConsumedCapacityTracker()
+        self.table = None
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.counts: Counter[str] = Counter()
+
+    async def run(self) -> dict:
+        """Starts the bot, runs all users and stops the bot."""
+        ConversationFlow.config(self.config)
+        storage = WriteBehindBuffer(
+            DynamoDBCrudManager(self.db_client, TABLE_NAME, self.capacity_tracker)
+        )
+        self.table = await self.db_client.Table(TABLE_NAME)
+        if not self.args.telegram_limits:
+            send_scheduler.set_limits(*[UNLIMITED_RATE] * 6)
+        if self.args.trace_file:
+            tracer.configure(
+                JsonlSink(self.args.trace_file),
+                sample_rate=self.args.trace_sample_rate,
+            )
+        bot = TelegramBot(
+            bot_client=FakeTelethonClient(self.telegram),
+            user_client=FakeTelethonClient(),
+            handlers=[
+                initialize_start_handler(ConversationFlow, storage),
+                initialize_callback_handler(ConversationFlow, storage),
+                initialize_text_messege_handler(ConversationFlow, storage),
+            ],
+            write_behind_buffer=storage,
+            capacity_tracker=self.capacity_tracker,
+        )
+        bot_task = asyncio.create_task(bot.start())
+        await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(self.run_user(index) for index in range(self.args.users))
+        )
+        duration = time.perf_counter() - started
+
+        scheduler_metrics = send_scheduler.metrics()
+        await self.telegram.disconnect()
+        await bot_task
+        await bot.cleanup()
+        tracer.close()
+        return self.report(duration, storage, scheduler_metrics)
+
+    async def run_user(self, index: int):
+        """Walks one user through the conversation until its questions are answered."""
+        user_id = USER_ID_BASE + index
+        pk = DynamoDBFormatter.prefix_user_pk(str(user_id))
+        await asyncio.sleep(self.random.uniform(0, self.args.ramp_up))
+        await self.send("start", user_id, self.telegram.new_message(user_id, "/start"))
+
+        asked = 0
+        for step in range(self.args.max_steps):
+            if asked >= self.args.questions:
+                return
+            state = self.user_state(pk)
+            triggers = [
+                trigger
+                for trigger in self.machine.get_triggers(state)
+                if trigger != self.config.initial_trigger
+            ]
+            questions_before = len(self.questions(pk))
+            if any(trigger.startswith(AUTO_TRIGGER_PREFIX) for trigger in triggers):
+                text = f"{state} {user_id} {step}"
+                await self.send(
+                    "text", user_id, self.telegram.new_message(user_id, text)
+                )
+            else:
+                buttons = [
+                    button
+                    for button in flatten(self.config.inline_buttons.get(state, []))
+                    if button in triggers
+                ]
+                if not buttons:
+                    self.counts["stuck_users"] += 1
+                    return
+                data = self.random.choice(buttons)
+                await self.send(
+                    "callback", user_id, self.telegram.callback_query(user_id, data)
+                )
+            for question in self.questions(pk)[questions_before:]:
+                asked += 1
+                self.counts["questions"] += 1
+                await self.answer(user_id, index, question)
+        self.counts["unfinished_users"] += 1
+
+    async def answer(self, user_id: int, index: int, question: dict):
+        """Replies to the question in the destination chat and waits for its delivery."""
+        dest_chat_id = int(question[DynamoDBKeySchema.GSI2_PK.value].split("#", 1)[1])
+        dest_message_id = int(
+            question[DynamoDBKeySchema.GSI2_SK.value].split("#", 1)[1]
+        )
+        answerer_id = ANSWERER_ID_BASE + index % self.args.answerers
+        event = self.telegram.reply(
+            answerer_id, f"answer to {user_id}", dest_chat_id, dest_message_id
+        )
+        if await self.send("reply", user_id, event):
+            self.counts["answers"] += 1
+
+    async def send(self, kind: str, chat_id: int, event: FakeNewMessageEvent) -> bool:
+        """Dispatches an event and waits for the bot's next message to the chat."""
+        expected = self.telegram.completed_calls[chat_id] + 1
+        start = time.perf_counter()
+        await self.telegram.dispatch(event)
+        self.latencies[kind].append(time.perf_counter() - start)
+        self.counts["events"] += 1
+        responded = await self.telegram.wait_for_calls(
+            chat_id, expected, self.args.response_timeout
+        )
+        if not responded:
+            self.counts["response_timeouts"] += 1
+        if self.args.think_time:
+            await asyncio.sleep(self.random.expovariate(1 / self.args.think_time))
+        return responded
+
+    def user_state(self, pk: str) -> str:
+        """Reads the user's state from the table."""
+        for item in self.table.peek(pk):  # type: ignore
+            if item[DynamoDBKeySchema.SK.value].startswith(
+                DynamoDBKeySchemaPrefix.USER_SK.value
+            ):
+                return item.get(
+                    DynamoDBAttributes.USER_STATE.value, self.config.initial_state
+                )
+        return self.config.initial_state
+
+    def questions(self, pk: str) -> list[dict]:
+        """Reads the user's questions sent to a destination chat, oldest first."""
+        return [
+            item
+            for item in self.table.peek(pk)  # type: ignore
+            if item[DynamoDBKeySchema.SK.value].startswith(
+                DynamoDBKeySchemaPrefix.QUESTION_SK.value
+            )
+            and DynamoDBKeySchema.GSI2_SK.value in item
+        ]
+
+    def report(
+        self, duration: float, storage: WriteBehindBuffer, scheduler_metrics: dict
+    ) -> dict:
+        """Builds the JSON report."""
+        events = self.counts["events"] or 1
+        db_calls = self.table.calls  # type: ignore
+        telegram_calls = Counter(call.method for call in self.telegram.calls)
+        capacity = self.capacity_tracker.summary()
+        return {
+            "commit": git_commit(),
+            "parameters": vars(self.args),
+            "duration_s": round(duration, 3),
+            "events": self.counts["events"],
+            "events_per_s": round(self.counts["events"] / duration, 1),
+            "questions": self.counts["questions"],
+            "answers": self.counts["answers"],
+            "response_timeouts": self.counts["response_timeouts"],
+            "stuck_users": self.counts["stuck_users"],
+            "unfinished_users": self.counts["unfinished_users"],
+            "handler_errors": self.telegram.handler_errors,
+            "handler_latency_ms": {
+                "all": percentiles(
+                    [value for values in self.latencies.values() for value in values]
+                ),
+                **{
+                    kind: percentiles(values)
+                    for kind, values in sorted(self.latencies.items())
+                },
+            },
+            "db_calls_per_event": {
+                "total": round(sum(db_calls.values()) / events, 3),
+                **{
+                    name: round(count / events, 3)
+                    for name, count in sorted(db_calls.items())
+                },
+            },
+            "db_throttled": sum(self.table.throttled.values()),  # type: ignore
+            "db_capacity_units_per_event": {
+                "read": round(capacity["read_units"] / events, 3),
+                "write": round(capacity["write_units"] / events, 3),
+                "by_handler": capacity["by_handler"],
+                "by_index": capacity["by_index"],
+            },
+            "telegram_calls_per_event": {
+                "total": round(sum(telegram_calls.values()) / events, 3),
+                **{
+                    name: round(count / events, 3)
+                    for name, count in sorted(telegram_calls.items())
+                },
+            },
+            "telegram_flood_waits": self.telegram.flood_waits,
+            "write_behind": {
+                "buffered_writes": storage.buffered_writes,
+                "flushed_writes": storage.flushed_writes,
+            },
+            "send_scheduler": scheduler_metrics,
+        }
+
+
+def main(args: argparse.Namespace):
+    """Runs the load test and writes the report."""
+    report = asyncio.run(LoadTest(args).run())
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=1, help="questions per user")
+    parser.add_argument("--max-steps", type=int, default=50, help="steps per user")
+    parser.add_argument("--answerers", type=int, default=10)
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="seconds")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds")
+    parser.add_argument("--response-timeout", type=float, default=5.0, help="seconds")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0)
+    parser.add_argument("--db-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=50.0)
+    parser.add_argument("--flood-wait-rate", type=float, default=0.0)
+    parser.add_argument("--flood-wait-seconds", type=int, default=1)
+    parser.add_argument(
+        "--telegram-limits",
+        action="store_true",
+        help="keep the send scheduler's Telegram rate limits",
+    )
+    parser.add_argument("--trace-file", help="write traces of the events to this file")
+    parser.add_argument("--trace-sample-rate", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report to this file")
+    main(parser.parse_args())
@@ -0,0 +1,178 @@
+"""
+../bench/startup.py
+Cold start benchmark: the time from spawning the bot's process to its first
+handled update, phase by phase.
+
+Every run is a fresh interpreter that imports `main` like production, loads
+the state machine config through its snapshot, enters the DynamoDB client
+(boto3 is imported in a thread, as DynamoDBClient does) and starts the bot
+with the fake Telegram client and the in-memory table, then sends /start and
+waits for it to be handled. Runs alternate between a cold config snapshot
+(deleted first) and a warm one. The phases are seconds from the spawn, so
+`interpreter` is Python's own startup; the fakes' imports fall in `dynamodb`.
+
+With --imports, the import time of `main` (from `python -X importtime`) is
+also summed per top-level package.
+
+Usage: python -m bench.startup [--runs 10] [--imports] [--output report.json]
+"""
+
+# pylint: disable=wrong-import-position
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+
+PHASES = ("interpreter", "imports", "config", "dynamodb", "connected", "first_update")
+
+
+async def child(args: argparse.Namespace) -> dict:
+    """Starts the bot once and returns its startup phases."""
+    # pylint: disable=import-outside-toplevel
+    main = importlib.import_module("main")
+    from bot.config_snapshot import ConfigSnapshot
+    from bot.conversation_flow import ConversationFlow
+    from bot.services.metrics import BotMetrics
+    from bot.services.startup import StartupTimer
+    from clients.dynamodb_client import aioboto3, conditions
+    from config.state_machine.state_machine_config import create_state_machine_config
+    from utils.import_utils import preload_modules
+
+    startup = StartupTimer(args.spawned, bot_metrics=BotMetrics())
+    startup.phases["interpreter"] = STARTED - args.spawned
+    startup.mark("imports")
+    ConversationFlow.config_from_snapshot(
+        ConfigSnapshot(args.snapshot), create_state_machine_config
+    )
+    startup.mark("config")
+
+    await asyncio.to_thread(preload_modules, aioboto3, conditions)
+    from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+    from clients.fake_telethon_client import FakeTelegramClient, FakeTelethonClient
+    from clients.in_memory_dynamodb_client import InMemoryDynamoDBClient
+
+    telegram = FakeTelegramClient()
+    storage = DynamoDBCrudManager(InMemoryDynamoDBClient(), "Startup")
+    startup.mark("dynamodb")
+
+    bot_task = asyncio.create_task(
+        main._run_bot(  # pylint: disable=protected-access
+            bot_client_param=FakeTelethonClient(telegram),
+            user_client_param=FakeTelethonClient(),
+            dynamodb_crud_manager=storage,
+            conversation_flow=ConversationFlow,
+            startup=startup,
+        )
+    )
+    while "connected" not in startup.phases:
+        await asyncio.sleep(0)
+    await telegram.dispatch(telegram.new_message(7, "/start"))
+    await telegram.disconnect()
+    await bot_task
+    return startup.phases
+
+
+def run_child(snapshot: str) -> dict:
+    """Runs one cold start in a new process, adding the process' wall time."""
+    spawned = time.perf_counter()
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "bench.startup",
+            "--child",
+            "--snapshot",
+            snapshot,
+            "--spawned",
+            repr(spawned),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    phases = json.loads(result.stdout.splitlines()[-1])
+    phases["process_exit"] = time.perf_counter() - spawned
+    return phases
+
+
+def import_times(top: int) -> list[dict]:
+    """Sums the self import time of `main`'s modules per top-level package."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages: Counter[str] = Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        packages[name.strip().split(".")[0]] += int(self_us)
+    return [
+        {"package": package, "ms": round(us / 1e3, 1)}
+        for package, us in packages.most_common(top)
+    ]
+
+
+def summarize(runs: list[dict]) -> dict:
+    """Returns the median and the range of every phase, in ms."""
+    summary = {}
+    for phase in PHASES + ("process_exit",):
+        values = [run[phase] * 1e3 for run in runs if phase in run]
+        summary[phase] = {
+            "median": round(statistics.median(values), 1),
+            "min": round(min(values), 1),
+            "max": round(max(values), 1),
+        }
+    return summary
+
+
+def main(args: argparse.Namespace):
+    """Runs the cold starts and prints the report."""
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = os.path.join(directory, "state_machine_config.pickle")
+        runs: dict[str, list[dict]] = {"cold_snapshot": [], "warm_snapshot": []}
+        for _ in range(args.runs):
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+            runs["cold_snapshot"].append(run_child(snapshot))
+            runs["warm_snapshot"].append(run_child(snapshot))
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "phases_ms": {mode: summarize(results) for mode, results in runs.items()},
+    }
+    if args.imports:
+        report["imports_ms_by_package"] = import_times(args.top)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--imports", action="store_true")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--snapshot", help=argparse.SUPPRESS)
+    parser.add_argument("--spawned", type=float, help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    if parsed.child:
+        print(json.dumps(asyncio.run(child(parsed))))
+    else:
+        main(parsed)
@@ -0,0 +1,191 @@
+"""
+../bench/state_machine_engine.py
+Parity check and benchmark of the compiled state machine against `transitions`.
+
+Usage: python -m bench.state_machine_engine [--configs 200] [--events 20000]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from transitions.extensions.asyncio import HierarchicalAsyncMachine
+
+from bot.compiled_state_machine import CompiledStateMachine
+
+CALLBACKS = ["cb_a", "cb_b", "cb_c", "cb_d"]
+CONDITIONS = ["is_even", "is_odd"]
+MACHINE_KWARGS = {
+    "model": None,
+    "queued": "model",
+    "send_event": True,
+    "auto_transitions": False,
+    "prepare_event": "prepare_event",
+    "before_state_change": "before_state_change",
+    "after_state_change": "after_state_change",
+}
+
+
+class RecordingModel:
+    """A model recording every callback call and its view of the transition."""
+
+    def __init__(self):
+        self.calls = []
+
+    def _record(self, name, event):
+        transition = event.transition
+        self.calls.append(
+            (
+                name,
+                transition.source if transition else None,
+                transition.dest if transition else None,
+                event.state.name if event.state else None,
+                self.state,  # type: ignore  # pylint: disable=no-member
+            )
+        )
+
+    def __getattr__(self, name):
+        if name in CONDITIONS:
+            return lambda event: (len(self.calls) % 2 == 0) == (name == "is_even")
+        if name.startswith("cb_") or name.endswith("_event") or name.endswith("_change"):
+
+            async def callback(event):
+                self._record(name, event)
+
+            return callback
+        raise AttributeError(name)
+
+
+def random_config(rng: random.Random) -> dict:
+    """Builds a random hierarchical state machine configuration."""
+    states, names = [], []
+    for index in range(rng.randint(2, 6)):
+        name = f"s{index}"
+        if rng.random() < 0.4:
+            children = [f"c{child}" for child in range(rng.randint(1, 3))]
+            state = {"name": name, "children": children}
+            if rng.random() < 0.6:
+                state["initial"] = children[0]
+            if rng.random() < 0.5:
+                state["on_enter"] = rng.choice(CALLBACKS)
+            states.append(state)
+            names.extend(f"{name}_{child}" for child in children)
+        else:
+            states.append(name)
+        names.append(name)
+    transitions = []
+    for index in range(rng.randint(3, 15)):
+        transition = {
+            "trigger": rng.choice(["@next", "go", "back", f"t{index % 4}"]),
+            "source": rng.choice(names + ["*"]),
+            "dest": rng.choice(names + ["=", None]),
+        }
+        for key in ("before", "after", "prepare"):
+            if rng.random() < 0.5:
+                transition[key] = rng.sample(CALLBACKS, rng.randint(1, 2))
+        if rng.random() < 0.2:
+            transition["conditions"] = rng.choice(CONDITIONS)
+        if transition["dest"] is None and rng.random() < 0.5:
+            transition["dest"] = names[0]
+        transitions.append(transition)
+    return {"states": states, "transitions": transitions, "initial": names[0]}
+
+
+async def run_sequence(machine, initial: str, triggers: list[str]) -> list:
+    """Runs a trigger sequence on a fresh model and records every outcome."""
+    model = RecordingModel()
+    machine.add_model(model, initial=initial)
+    outcome = [model.state]
+    for trigger in triggers:
+        try:
+            result = await model.trigger(trigger)  # pylint: disable=no-member
+            outcome.append(("ok", result, model.state, sorted(set(machine.get_triggers(model.state)))))
+        except Exception as error:  # pylint: disable=broad-except
+            outcome.append(("error", type(error).__name__, model.state))
+    machine.remove_model(model)
+    outcome.append(model.calls)
+    return outcome
+
+
+async def check_parity(configs: int, seed: int) -> int:
+    """Compares both engines on random configurations, returning the mismatch count."""
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(configs):
+        config = random_config(rng)
+        kwargs = dict(MACHINE_KWARGS, states=config["states"], transitions=config["transitions"])
+        reference = HierarchicalAsyncMachine(**kwargs)
+        compiled = CompiledStateMachine(**kwargs)
+        triggers = [rng.choice(["@next", "go", "back", "t0", "t1", "t2", "t3"]) for _ in range(12)]
+        expected = await run_sequence(reference, config["initial"], triggers)
+        actual = await run_sequence(compiled, config["initial"], triggers)
+        if expected != actual:
+            mismatches += 1
+            print(json.dumps({"config": config, "triggers": triggers}, ensure_ascii=False))
+    return mismatches
+
+
+class NoopModel:
+    """A model whose callbacks do nothing."""
+
+    async def noop(self, event):  # pylint: disable=unused-argument
+        """Does nothing."""
+
+
+def chain_config(length: int) -> dict:
+    """Builds a linear conversation of `length` states, like the bot's prompt chains."""
+    states = [f"s{index}" for index in range(length)]
+    transitions = [
+        {"trigger": "@next", "source": states[index], "dest": states[index + 1], "after": "noop"}
+        for index in range(length - 1)
+    ] + [{"trigger": "start", "source": "*", "dest": states[0], "after": "noop"}]
+    return {"states": states, "transitions": transitions}
+
+
+async def benchmark(machine_cls, events: int, length: int) -> float:
+    """Measures per-event add_model, trigger and remove_model, in transitions per second."""
+    config = chain_config(length)
+    machine = machine_cls(
+        **dict(
+            MACHINE_KWARGS,
+            prepare_event="noop",
+            before_state_change="noop",
+            after_state_change="noop",
+            states=config["states"],
+            transitions=config["transitions"],
+        )
+    )
+    state = "s0"
+    started = time.perf_counter()
+    for _ in range(events):
+        model = NoopModel()
+        machine.add_model(model, initial=state)
+        await model.trigger("@next" if state != f"s{length - 1}" else "start")  # type: ignore  # pylint: disable=no-member
+        state = model.state  # type: ignore  # pylint: disable=no-member
+        machine.remove_model(model)
+    return events / (time.perf_counter() - started)
+
+
+async def main(configs: int, events: int, seed: int):
+    """Runs the parity check and the benchmark."""
+    mismatches = await check_parity(configs, seed)
+    results = {"parity_configs": configs, "parity_mismatches": mismatches}
+    for length in (10, 50):
+        results[f"transitions_per_sec_{length}_states"] = {
+            "transitions": round(await benchmark(HierarchicalAsyncMachine, events, length)),
+            "compiled": round(await benchmark(CompiledStateMachine, events, length)),
+        }
+    print(json.dumps(results, indent=2))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--configs", type=int, default=200)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.configs, args.events, args.seed))
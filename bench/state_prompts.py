@@ -0,0 +1,94 @@
+"""
+../bench/state_prompts.py
+Microbenchmark of the per-transition prompt callbacks, rebuilding the inline
+keyboard on every transition against reusing the prompts prebuilt in config().
+
+Usage: python -m bench.state_prompts [--states 20] [--transitions 20000]
+"""
+
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from telethon import Button, TelegramClient
+
+from bot.handlers.conversation_flow_handlers import StateHandler
+
+
+def synthetic_config(states: int) -> SimpleNamespace:
+    """Builds a config with a message and a 3x2 keyboard for every state."""
+    names = [f"state_{index}" for index in range(states)]
+    return SimpleNamespace(
+        messages={name: f"رسالة {name}" for name in names},
+        inline_buttons={
+            name: [[f"{name}_{row}_{column}" for column in range(2)] for row in range(3)]
+            for name in names
+        },
+        destinations={},
+    )
+
+
+def rebuild_prompt(state_handler: StateHandler, state: str):
+    """The former per-transition work: reverse the rows, build buttons and markup."""
+    strings = state_handler.get_state_inline_buttons(state)
+    strings = [row[::-1] if isinstance(row, list) else row for row in strings]
+    if isinstance(strings[0], list):
+        buttons = [[Button.inline(button, button) for button in row] for row in strings]
+    else:
+        buttons = [Button.inline(button) for button in strings]
+    message = state_handler.get_state_message(state)
+    # Telethon builds the markup from the buttons on every send or edit.
+    return message, TelegramClient.build_reply_markup(buttons)
+
+
+def prebuilt_prompt(state_handler: StateHandler, state: str):
+    """The current per-transition work: look up the prebuilt prompt."""
+    prompt = state_handler.get_state_prompt(state)
+    return prompt.message, TelegramClient.build_reply_markup(prompt.buttons)
+
+
+def measure(function, state_handler: StateHandler, states: list[str], transitions: int) -> float:
+    """Returns the mean microseconds per transition."""
+    start = time.perf_counter()
+    for index in range(transitions):
+        function(state_handler, states[index % len(states)])
+    return (time.perf_counter() - start) / transitions * 1e6
+
+
+def main(states: int, transitions: int):
+    """Runs the benchmark."""
+    config = synthetic_config(states)
+    state_names = list(config.messages)
+
+    start = time.perf_counter()
+    prompts = StateHandler.build_prompts(config)  # type: ignore
+    build_ms = (time.perf_counter() - start) * 1e3
+
+    rebuilding = StateHandler(config)  # type: ignore
+    prebuilt = StateHandler(config, prompts)  # type: ignore
+    before = measure(rebuild_prompt, rebuilding, state_names, transitions)
+    after = measure(prebuilt_prompt, prebuilt, state_names, transitions)
+    print(
+        json.dumps(
+            {
+                "states": states,
+                "transitions": transitions,
+                "build_prompts_ms": round(build_ms, 3),
+                "us_per_transition": {
+                    "rebuilt": round(before, 3),
+                    "prebuilt": round(after, 3),
+                },
+                "speedup": round(before / after, 1),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--states", type=int, default=20)
+    parser.add_argument("--transitions", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.states, args.transitions)
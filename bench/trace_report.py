@@ -0,0 +1,75 @@
+"""
+../bench/trace_report.py
+Summarizes a JSONL trace file written by the tracer: the slowest events with
+their critical path, and the time spent per kind of span.
+
+Every trace is one update. Its critical path is the chain of spans, from the
+handler down, that the update was waiting on until its last span ended.
+
+Usage: python -m bench.trace_report traces.jsonl [--slowest 10] [--name callback]
+"""
+
+import argparse
+import json
+from collections import defaultdict
+
+from bench.load_test import percentiles
+from bot.services.tracing import critical_path
+
+
+def load(path: str, name: str | None) -> list[dict]:
+    """Reads the traces of a file, optionally only those of one handler."""
+    with open(path, encoding="utf-8") as file:
+        traces = [json.loads(line) for line in file if line.strip()]
+    return [trace for trace in traces if name is None or trace["name"] == name]
+
+
+def describe(span: dict) -> str:
+    """Formats a span of a critical path."""
+    attributes = ", ".join(
+        f"{key}={value}" for key, value in span["attributes"].items()
+    )
+    error = f" !{span['error']}" if span["error"] else ""
+    return (
+        f"+{span['offset_ms']:.1f} ms {span['duration_ms']:.1f} ms "
+        f"{span['kind']}:{span['name']}"
+        + (f" ({attributes})" if attributes else "")
+        + error
+    )
+
+
+def main(args: argparse.Namespace):
+    """Prints the report."""
+    traces = load(args.path, args.name)
+    by_handler: dict[str, list[float]] = defaultdict(list)
+    by_kind: dict[str, list[float]] = defaultdict(list)
+    for trace in traces:
+        by_handler[trace["name"]].append(trace["total_ms"] / 1e3)
+        for span in trace["spans"]:
+            by_kind[f"{span['kind']}:{span['name']}"].append(span["duration_ms"] / 1e3)
+
+    print(f"{len(traces)} traces")
+    print("\nUntil the last span ended, per handler (ms):")
+    for name, values in sorted(by_handler.items()):
+        print(f"  {name}: {percentiles(values)}")
+    print("\nSpan durations (ms):")
+    for name, values in sorted(by_kind.items(), key=lambda item: -sum(item[1])):
+        print(f"  {name}: {percentiles(values)}")
+
+    slowest = sorted(traces, key=lambda trace: -trace["total_ms"])[: args.slowest]
+    print(f"\nSlowest {len(slowest)} traces:")
+    for trace in slowest:
+        print(
+            f"\n{trace['name']} {trace['trace_id']} handler {trace['duration_ms']:.1f} ms,"
+            f" total {trace['total_ms']:.1f} ms {trace['attributes']}"
+        )
+        for depth, span in critical_path(trace):
+            print(f"  {'  ' * depth}{describe(span)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path")
+    parser.add_argument("--slowest", type=int, default=10)
+    parser.add_argument("--name", help="only the traces of this handler")
+    main(parser.parse_args())
@@ -0,0 +1,308 @@
+"""
+../bench/user_leases.py
+Two bot replicas sharing one in-memory table through user leases, with every
+update delivered to both of them, as Telegram does for replicas of one bot.
+
+Each scenario checks that every update is handled by exactly one replica:
+  users      users walk the conversation, their updates racing on both replicas;
+  answers    each question is answered once in its destination chat, and the
+             asker gets the answer once and it is stored once;
+  handover   one replica closes, releasing its leases, and the other one takes
+             its users over at their next update;
+  crash      one replica stops without releasing its leases, and the other one
+             takes its users over once the leases expire; the stopped replica's
+             late writes to those users' items are then rejected.
+
+The replicas share the process' routing index and Telegram caches, which
+only saves them lookups. Exits with status 1 if any check fails.
+
+Usage: python -m bench.user_leases [--users 20] [--lease-seconds 0.6]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from collections import Counter
+
+from telethon import events
+
+from bot.conversation_flow import ConversationFlow
+from bot.handlers.callback_handler import initialize_callback_handler
+from bot.handlers.message_handlers import initialize_text_messege_handler
+from bot.handlers.start_handler import initialize_start_handler
+from bot.services.dynamodb_constants import (
+    DynamoDBAttributes,
+    DynamoDBFormatter,
+    DynamoDBGSI1QuestionStatusValues,
+    DynamoDBKeySchema,
+    DynamoDBKeySchemaPrefix,
+)
+from bot.services.dynamodb_crud_manager import (
+    ConditionalCheckFailedError,
+    DynamoDBCrudManager,
+)
+from bot.services.send_scheduler import send_scheduler
+from bot.services.user_leases import (
+    LeaseFencedStorage,
+    UserLeasedElsewhere,
+    UserLeases,
+)
+from clients.fake_telethon_client import FakeTelegramClient
+from clients.in_memory_dynamodb_client import InMemoryDynamoDBClient
+from config.state_machine.state_machine_config import create_state_machine_config
+
+TABLE_NAME = "UserLeases"
+USER_ID_BASE = 1_000_000
+ANSWERER_ID = 2_000_000
+DEST_CHAT_ID = -1_000_000
+UNLIMITED_RATE = 1e9
+
+
+class Replica:
+    """A bot replica: its handlers, on its own ConversationFlow class and leases."""
+
+    def __init__(self, name: str, storage: DynamoDBCrudManager, lease_seconds: float):
+        self.name = name
+        self.leases = UserLeases(
+            storage,
+            owner=name,
+            lease_seconds=lease_seconds,
+            renew_interval=lease_seconds / 4,
+            clock_skew=lease_seconds / 8,
+            retry_interval=0.0,
+        )
+        self.storage = LeaseFencedStorage(storage, self.leases)
+        # The leases are a class attribute, so each replica gets its own class.
+        self.conversation_flow = type(
+            f"ConversationFlow{name}", (ConversationFlow,), {}
+        )
+        self.conversation_flow.use_leases(self.leases)
+        self.router = FakeTelegramClient()
+        for factory in (
+            initialize_start_handler,
+            initialize_callback_handler,
+            initialize_text_messege_handler,
+        ):
+            handler = factory(self.conversation_flow, self.storage)
+            for builder in events.list(handler):
+                self.router.add_event_handler(self.tracked(handler), builder)
+        self.handled: Counter[int] = Counter()
+        self.running = True
+        self._skipped: set[int] = set()
+
+    def tracked(self, handler):
+        """Notes the updates the handler skips as leased elsewhere."""
+
+        async def handle(event):
+            try:
+                await handler(event)
+            except UserLeasedElsewhere:
+                self._skipped.add(id(event))
+                raise
+
+        return handle
+
+    async def dispatch(self, event) -> bool:
+        """Runs the update through the replica's handlers, unless it stopped.
+
+        Returns whether the replica handled the update.
+        """
+        if not self.running:
+            return False
+        await self.router.dispatch(event)
+        if id(event) in self._skipped:
+            self._skipped.discard(id(event))
+            return False
+        self.handled[event.chat_id] += 1
+        return True
+
+
+class LeaseBench:
+    """Runs the scenarios against two replicas and collects their checks."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.telegram = FakeTelegramClient()
+        self.db_client = InMemoryDynamoDBClient()
+        self.storage = DynamoDBCrudManager(self.db_client, TABLE_NAME)
+        self.config = create_state_machine_config()
+        self.replicas: list[Replica] = []
+        self.handlings: Counter[int] = Counter()
+        self.checks: dict[str, bool] = {}
+
+    async def run(self) -> dict:
+        """Runs every scenario in order."""
+        ConversationFlow.config(self.config)
+        send_scheduler.set_limits(*[UNLIMITED_RATE] * 6)
+        self.replicas = [
+            Replica(name, self.storage, self.args.lease_seconds) for name in "AB"
+        ]
+        for replica in self.replicas:
+            replica.leases.start()
+        first, second = self.replicas
+
+        users = self.new_users(0)
+        await asyncio.gather(*(self.walk(user_id) for user_id in users))
+        self.checks["users"] = set(self.handlings) == {1}
+        replicas_per_update = dict(self.handlings)
+
+        await self.answers(users)
+
+        handed_over = [user_id for user_id in users if first.leases.holds(str(user_id))]
+        await first.leases.close()
+        first.running = False
+        self.reset_counts()
+        await asyncio.gather(*(self.start(user_id) for user_id in handed_over))
+        self.checks["handover"] = bool(handed_over) and all(
+            second.handled[user_id] == 1 for user_id in handed_over
+        )
+
+        first.running = True
+        first.leases.start()
+        users = self.new_users(1)
+        await asyncio.gather(*(self.start(user_id) for user_id in users))
+        crashed = [user_id for user_id in users if first.leases.holds(str(user_id))]
+        # A crash: the replica stops renewing and handling without releasing.
+        await first.leases.stop()
+        first.running = False
+        self.reset_counts()
+        await asyncio.gather(*(self.start(user_id) for user_id in crashed))
+        unexpired = sum(second.handled[user_id] == 0 for user_id in crashed)
+        await asyncio.sleep(first.leases.lease_seconds + first.leases.clock_skew)
+        self.reset_counts()
+        await asyncio.gather(*(self.start(user_id) for user_id in crashed))
+        fenced = await asyncio.gather(
+            *(self.late_write(first, user_id) for user_id in crashed)
+        )
+        self.checks["crash"] = (
+            bool(crashed)
+            and unexpired == len(crashed)
+            and all(second.handled[user_id] == 1 for user_id in crashed)
+            and all(fenced)
+        )
+
+        for replica in self.replicas:
+            await replica.leases.close()
+        return {
+            "parameters": vars(self.args),
+            "replicas_per_update": replicas_per_update,
+            "checks": self.checks,
+        }
+
+    def new_users(self, scenario: int) -> list[int]:
+        """The user IDs of a scenario, unused by the others."""
+        base = USER_ID_BASE + scenario * self.args.users
+        return list(range(base, base + self.args.users))
+
+    async def walk(self, user_id: int):
+        """Sends /start and presses the first button of each state, twice."""
+        await self.start(user_id)
+        for _ in range(2):
+            buttons = self.telegram.calls_to(user_id)[-1].kwargs.get("buttons")
+            if not buttons:
+                return
+            data = buttons.rows[0].buttons[0].data
+            await self.dispatch(self.telegram.callback_query(user_id, data))
+
+    async def start(self, user_id: int):
+        """Sends /start to both replicas."""
+        await self.dispatch(self.telegram.new_message(user_id, "/start"))
+
+    async def dispatch(self, event):
+        """Hands the update to both replicas at once, counting those handling it."""
+        handled = await asyncio.gather(
+            *(replica.dispatch(event) for replica in self.replicas)
+        )
+        self.handlings[sum(handled)] += 1
+
+    async def answers(self, users: list[int]):
+        """Answers a question of each user and checks it is delivered once."""
+        for user_id in users:
+            question = await self.ask(user_id)
+            await self.dispatch(
+                self.telegram.reply(
+                    ANSWERER_ID,
+                    f"answer to {user_id}",
+                    DEST_CHAT_ID,
+                    int(question[DynamoDBKeySchema.GSI2_SK.value].split("#", 1)[1]),
+                )
+            )
+        table = await self.db_client.Table(TABLE_NAME)
+        delivered = Counter(
+            call.chat_id
+            for call in self.telegram.calls
+            if call.method == "send_message" and call.text.startswith("answer to")
+        )
+        stored = Counter(
+            item[DynamoDBKeySchema.PK.value]
+            for user_id in users
+            for item in table.peek(DynamoDBFormatter.prefix_user_pk(str(user_id)))
+            if item[DynamoDBKeySchema.SK.value].startswith(
+                DynamoDBKeySchemaPrefix.QUESTION_ANSWER_SK.value
+            )
+        )
+        self.checks["answers"] = all(
+            delivered[user_id] == 1
+            and stored[DynamoDBFormatter.prefix_user_pk(str(user_id))] == 1
+            for user_id in users
+        )
+
+    async def ask(self, user_id: int) -> dict:
+        """Stores a question of the user, as sent to the destination chat."""
+        message = await self.telegram.send_message(
+            DEST_CHAT_ID,
+            f"question of {user_id} {DynamoDBGSI1QuestionStatusValues.NON_ANSWERED.value}",
+        )
+        pk = DynamoDBFormatter.prefix_user_pk(str(user_id))
+        question = {
+            DynamoDBKeySchema.PK.value: pk,
+            DynamoDBKeySchema.SK.value: DynamoDBFormatter.prefix_question_sk(
+                str(user_id)
+            ),
+            DynamoDBKeySchema.GSI2_PK.value: DynamoDBFormatter.prefix_dest_chat_gsi2_pk(
+                str(DEST_CHAT_ID)
+            ),
+            DynamoDBKeySchema.GSI2_SK.value: DynamoDBFormatter.prefix_dest_message_gsi2_sk(
+                str(message.id)
+            ),
+            DynamoDBAttributes.USER_ID.value: user_id,
+            DynamoDBAttributes.QUESTION_ID.value: 1,
+        }
+        await self.storage.put_item(question)
+        return question
+
+    async def late_write(self, replica: Replica, user_id: int) -> bool:
+        """Writes the user's state from a replica that lost the lease.
+
+        Returns whether the write was rejected and left the state alone.
+        """
+        pk = DynamoDBFormatter.prefix_user_pk(str(user_id))
+        sk = DynamoDBFormatter.prefix_user_sk(str(user_id))
+        state = DynamoDBAttributes.USER_STATE.value
+        before = await self.storage.get_attribute(state, pk, sk)
+        try:
+            await replica.storage.update_attributes({state: "stale"}, pk, sk)
+        except ConditionalCheckFailedError:
+            return await self.storage.get_attribute(state, pk, sk) == before
+        return False
+
+    def reset_counts(self):
+        """Forgets the updates counted so far."""
+        for replica in self.replicas:
+            replica.handled.clear()
+
+
+def main(args: argparse.Namespace):
+    """Runs the scenarios and prints the report."""
+    report = asyncio.run(LeaseBench(args).run())
+    print(json.dumps(report, indent=2))
+    if not all(report["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--lease-seconds", type=float, default=0.6)
+    main(parser.parse_args())
@@ -0,0 +1,189 @@
+"""
+../bench/worker_pool.py
+Throughput of the bot handling updates in-process and in worker pools of
+increasing size, with the fake Telegram client standing in for Telegram.
+
+Simulated users send /start and then press one of the buttons of the bot's
+last message to them, or type a text where it sent none, waiting for the
+bot's response before each next step. With workers, each one keeps its users
+in its own in-memory table, built by `bench_storage`; answers in destination
+chats are left out, as they need the question's owner in the same table.
+
+The report holds the event rate and the handler latency per pool size. The
+rate can only grow with the workers on as many free CPU cores.
+
+Usage: python -m bench.worker_pool [--workers 0 1 2 4] [--users 200] [--output report.json]
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+
+from bench.load_test import git_commit, percentiles
+from bot.bot import TelegramBot
+from bot.config_snapshot import CompiledConfig
+from bot.conversation_flow import ConversationFlow
+from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.send_scheduler import send_scheduler
+from bot.services.worker_pool import WorkerPool
+from bot.services.write_behind_buffer import WriteBehindBuffer
+from clients.fake_telethon_client import FakeTelegramClient, FakeTelethonClient
+from clients.in_memory_dynamodb_client import InMemoryDynamoDBClient
+from config.state_machine.state_machine_config import create_state_machine_config
+from main import HANDLER_FACTORIES
+
+TABLE_NAME = "WorkerPool"
+USER_ID_BASE = 1_000_000
+UNLIMITED_RATE = 1e9
+
+
+@asynccontextmanager
+async def bench_storage(db_latency: float):
+    """The storage of a run or of one of its workers: an in-memory table."""
+    yield DynamoDBCrudManager(InMemoryDynamoDBClient(latency=db_latency), TABLE_NAME)
+
+
+def last_buttons(telegram: FakeTelegramClient, chat_id: int) -> list[bytes]:
+    """Returns the callback data of the buttons of the bot's last message."""
+    for call in reversed(telegram.calls_to(chat_id)):
+        if call.method not in ("send_message", "edit_message"):
+            continue
+        buttons = call.kwargs.get("buttons")
+        if not buttons:
+            return []
+        return [button.data for row in buttons.rows for button in row.buttons]
+    return []
+
+
+class WorkerPoolBench:
+    """Runs the simulated users against the bot with a given number of workers."""
+
+    def __init__(self, args: argparse.Namespace, workers: int):
+        self.args = args
+        self.workers = workers
+        self.random = random.Random(args.seed)
+        self.telegram = FakeTelegramClient(latency=args.telegram_latency_ms / 1e3)
+        self.latencies: list[float] = []
+        self.events = 0
+        self.timeouts = 0
+
+    async def run(self) -> dict:
+        """Starts the bot, runs all users and stops the bot."""
+        compiled = CompiledConfig(create_state_machine_config())
+        ConversationFlow.config_from_compiled(compiled)
+        send_scheduler.set_limits(*[UNLIMITED_RATE] * 6)
+        storage = functools.partial(bench_storage, self.args.db_latency_ms / 1e3)
+        pool = None
+        async with storage() as crud_manager:
+            if self.workers:
+                pool = WorkerPool(
+                    self.workers,
+                    compiled,
+                    storage_factory=storage,
+                    handler_factories=HANDLER_FACTORIES,
+                    client=self.telegram,
+                )
+                await pool.start()
+                buffer = None
+                handlers = [pool.handler]
+            else:
+                buffer = WriteBehindBuffer(crud_manager)
+                handlers = [
+                    factory(ConversationFlow, buffer) for factory in HANDLER_FACTORIES
+                ]
+            bot = TelegramBot(
+                bot_client=FakeTelethonClient(self.telegram),
+                user_client=FakeTelethonClient(),
+                handlers=handlers,
+                write_behind_buffer=buffer,
+            )
+            bot_task = asyncio.create_task(bot.start())
+            await asyncio.sleep(0)
+
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(
+                    self.run_user(USER_ID_BASE + index)
+                    for index in range(self.args.users)
+                )
+            )
+            duration = time.perf_counter() - started
+
+            await self.telegram.disconnect()
+            await bot_task
+            await bot.cleanup()
+            if pool is not None:
+                await pool.close()
+        return {
+            "workers": self.workers,
+            "duration_s": round(duration, 3),
+            "events": self.events,
+            "events_per_s": round(self.events / duration, 1),
+            "response_timeouts": self.timeouts,
+            "handler_errors": self.telegram.handler_errors
+            + (pool.failed if pool is not None else 0),
+            "handler_latency_ms": percentiles(self.latencies),
+        }
+
+    async def run_user(self, user_id: int):
+        """Walks one user through the buttons the bot sends it."""
+        await asyncio.sleep(self.random.uniform(0, self.args.ramp_up))
+        await self.send(user_id, self.telegram.new_message(user_id, "/start"))
+        for step in range(self.args.steps):
+            buttons = last_buttons(self.telegram, user_id)
+            if buttons:
+                event = self.telegram.callback_query(
+                    user_id, self.random.choice(buttons)
+                )
+            else:
+                event = self.telegram.new_message(user_id, f"text {user_id} {step}")
+            await self.send(user_id, event)
+
+    async def send(self, chat_id: int, event):
+        """Dispatches an event and waits for the bot's next message to the chat."""
+        expected = self.telegram.completed_calls[chat_id] + 1
+        start = time.perf_counter()
+        await self.telegram.dispatch(event)
+        self.latencies.append(time.perf_counter() - start)
+        self.events += 1
+        if not await self.telegram.wait_for_calls(
+            chat_id, expected, self.args.response_timeout
+        ):
+            self.timeouts += 1
+
+
+def main(args: argparse.Namespace):
+    """Runs the bench for every pool size and prints the report."""
+    report = {
+        "commit": git_commit(),
+        "cpus": os.cpu_count(),
+        "parameters": vars(args),
+        "runs": [
+            asyncio.run(WorkerPoolBench(args, workers).run())
+            for workers in args.workers
+        ],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--ramp-up", type=float, default=0.5)
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=5.0)
+    parser.add_argument("--response-timeout", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the report to this file")
+    main(parser.parse_args())
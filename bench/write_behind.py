@@ -0,0 +1,127 @@
+"""
+../bench/write_behind.py
+Checks that the write-behind buffer loses no write when DynamoDB throttles
+its flushes, with the in-memory table throttling a share of its calls.
+
+Simulated users each store a state and an input per step, flushing their
+item after every step like a handler does, and then wait for the buffer to
+write whatever failed. The table must hold every user's last state and all
+its inputs. The report holds the throttled calls, the failed flushes and
+the users whose item is wrong; the exit status is 1 if there are any.
+
+Usage: python -m bench.write_behind [--users 100] [--steps 10] [--throttle-rate 0.3]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+
+from bot.services.dynamodb_constants import DynamoDBAttributes, DynamoDBFormatter
+from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.write_behind_buffer import WriteBehindBuffer
+from clients.in_memory_dynamodb_client import InMemoryDynamoDBClient
+
+TABLE_NAME = "WriteBehind"
+
+
+class WriteBehindCheck:
+    """Writes the users' steps through the buffer and checks what was stored."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.db_client = InMemoryDynamoDBClient(
+            throttle_rate=args.throttle_rate, seed=args.seed
+        )
+        self.buffer = WriteBehindBuffer(
+            DynamoDBCrudManager(self.db_client, TABLE_NAME),
+            flush_interval=args.flush_interval,
+            max_retry_interval=args.flush_interval * 4,
+        )
+
+    async def run(self) -> dict:
+        """Runs all users, waits for the retries and reads the table back."""
+        await asyncio.gather(*(self.run_user(user) for user in range(self.args.users)))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.args.drain_timeout
+        while self.buffer.pending_keys and loop.time() < deadline:
+            await asyncio.sleep(self.args.flush_interval)
+        table = await self.db_client.Table(TABLE_NAME)
+        table.throttle_rate = 0.0
+        wrong = [
+            user
+            for user in range(self.args.users)
+            if await self.stored(user) != self.expected(user)
+        ]
+        await self.buffer.close()
+        return {
+            "parameters": vars(self.args),
+            "throttled_calls": sum(table.throttled.values()),
+            "failed_flushes": self.buffer.failed_flushes,
+            "still_pending": len(self.buffer.pending_keys),
+            "wrong_users": wrong,
+        }
+
+    async def run_user(self, user: int):
+        """Stores a state and an input per step, flushing after each one."""
+        pk, sk = self.key(user)
+        for step in range(self.args.steps):
+            await self.buffer.update_attributes(
+                {DynamoDBAttributes.USER_STATE.value: f"state {step}"}, pk, sk
+            )
+            await self.buffer.set_map_entry(
+                DynamoDBAttributes.USER_INPUTS.value, f"step {step}", str(step), pk, sk
+            )
+            try:
+                await self.buffer.flush(pk, sk)
+            except Exception:  # pylint: disable=broad-except
+                pass  # Retried by the buffer, as after a handler's failed flush.
+
+    async def stored(self, user: int) -> dict:
+        """The user's item as stored."""
+        item = await self.buffer.dynamodb_crud_manager.get_attributes(
+            *self.key(user),
+            names=[
+                DynamoDBAttributes.USER_STATE.value,
+                DynamoDBAttributes.USER_INPUTS.value,
+            ],
+            consistent=True,
+        )
+        return dict(item)
+
+    def expected(self, user: int) -> dict:  # pylint: disable=unused-argument
+        """The item every user must end up with."""
+        steps = range(self.args.steps)
+        return {
+            DynamoDBAttributes.USER_STATE.value: f"state {steps[-1]}",
+            DynamoDBAttributes.USER_INPUTS.value: {
+                f"step {step}": str(step) for step in steps
+            },
+        }
+
+    @staticmethod
+    def key(user: int) -> tuple[str, str]:
+        """The key of the user's item."""
+        return (
+            DynamoDBFormatter.prefix_user_pk(str(user)),
+            DynamoDBFormatter.prefix_user_sk(str(user)),
+        )
+
+
+def main(args: argparse.Namespace):
+    """Runs the check and prints the report."""
+    report = asyncio.run(WriteBehindCheck(args).run())
+    print(json.dumps(report, indent=2))
+    if report["wrong_users"] or report["still_pending"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--throttle-rate", type=float, default=0.3)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--drain-timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -1,9 +1,124 @@
 """../bot/bot.py"""
 
+import asyncio
 import logging
-from typing import Callable
+from typing import Any, Callable, Hashable
 
-from clients.telethon_client import TelethonClient
+from telethon import events
+from telethon.events.common import EventCommon
+
+from bot.services.consumed_capacity import ConsumedCapacityTracker, consumed_capacity
+from bot.services.metrics import MetricsServer, metrics
+from bot.services.send_scheduler import SendScheduler, send_scheduler
+from bot.services.startup import StartupTimer
+from bot.services.user_leases import UserLeases
+from bot.services.write_behind_buffer import WriteBehindBuffer
+from clients.telethon_client import TelegramConnection
+
+Job = tuple[Callable, EventCommon, asyncio.Future]
+
+
+class UserMailbox:
+    """An ordered queue of one user's updates, processed by its own task."""
+
+    def __init__(
+        self,
+        key: Hashable,
+        idle_timeout: float,
+        on_idle: Callable[["UserMailbox"], None],
+    ):
+        self.key = key
+        self._idle_timeout = idle_timeout
+        self._on_idle = on_idle
+        self._queue: asyncio.Queue[Job] = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, handler: Callable, event: EventCommon) -> asyncio.Future:
+        """Queues a handler call, returning a future for its outcome."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((handler, event, future))
+        return future
+
+    async def close(self):
+        """Stops processing and cancels the updates still queued."""
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def _run(self):
+        """Processes queued updates in order until the mailbox is idle."""
+        while True:
+            try:
+                handler, event, future = await asyncio.wait_for(
+                    self._queue.get(), timeout=self._idle_timeout
+                )
+            except asyncio.TimeoutError:
+                if self._queue.empty():
+                    self._on_idle(self)
+                    return
+                continue
+            if future.cancelled():
+                continue
+            try:
+                result = await handler(event)
+            except Exception as error:  # pylint: disable=broad-except
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+
+class UserDispatcher:
+    """Routes updates into per-user mailboxes so each user's updates run in order.
+
+    Updates from different users still run concurrently, and mailboxes that stay
+    idle for `idle_timeout` seconds are reaped.
+    """
+
+    def __init__(self, idle_timeout: float = 60.0):
+        self.idle_timeout = idle_timeout
+        self._mailboxes: dict[Hashable, UserMailbox] = {}
+
+    def __len__(self) -> int:
+        return len(self._mailboxes)
+
+    async def dispatch(self, handler: Callable, event: EventCommon) -> Any:
+        """Runs the handler for the event in the sender's mailbox."""
+        key = self._get_key(event)
+        if key is None:
+            return await handler(event)
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            mailbox = UserMailbox(key, self.idle_timeout, self._reap)
+            self._mailboxes[key] = mailbox
+        return await mailbox.put(handler, event)
+
+    def wrap(self, handler: Callable) -> Callable:
+        """Wraps a handler so its calls are routed through the dispatcher."""
+
+        async def dispatch_handler(event: EventCommon):
+            return await self.dispatch(handler, event)
+
+        return dispatch_handler
+
+    async def close(self):
+        """Closes all mailboxes."""
+        mailboxes = list(self._mailboxes.values())
+        self._mailboxes.clear()
+        await asyncio.gather(*(mailbox.close() for mailbox in mailboxes))
+
+    def _reap(self, mailbox: UserMailbox):
+        """Removes an idle mailbox."""
+        if self._mailboxes.get(mailbox.key) is mailbox:
+            del self._mailboxes[mailbox.key]
+
+    @staticmethod
+    def _get_key(event: EventCommon) -> Hashable | None:
+        """Gets the mailbox key of an event."""
+        return getattr(event, "sender_id", None)
 
 
 class TelegramBot:
@@ -11,36 +126,75 @@ class TelegramBot:
 
     def __init__(
         self,
-        bot_client: TelethonClient,
-        user_client: TelethonClient,
+        bot_client: TelegramConnection,
+        user_client: TelegramConnection,
         handlers: list[Callable],
+        dispatcher: UserDispatcher | None = None,
+        write_behind_buffer: WriteBehindBuffer | None = None,
+        scheduler: SendScheduler = send_scheduler,
+        metrics_server: MetricsServer | None = None,
+        capacity_tracker: ConsumedCapacityTracker = consumed_capacity,
+        startup: StartupTimer | None = None,
+        leases: UserLeases | None = None,
         logger=None,
     ):
         self.bot_client = bot_client
         self.user_client = user_client
         self.handlers = handlers
+        self.dispatcher = dispatcher or UserDispatcher()
+        self.write_behind_buffer = write_behind_buffer
+        self.scheduler = scheduler
+        self.metrics_server = metrics_server
+        self.capacity_tracker = capacity_tracker
+        self.startup = startup
+        self.leases = leases
         self.logger = logger or logging.getLogger(__name__)
 
     async def connect_to_telegram(self):
         """Connects to the Telegram server by starting the user and bot clients."""
         async with self.user_client, self.bot_client:
+            if self.startup is not None:
+                self.startup.mark("connected")
             self.logger.info("Bot started!")
             await self.bot_client.telethon_client.run_until_disconnected()
 
     def register_handlers(
         self,
     ):
-        """Registers event handlers for the bot."""
+        """Registers event handlers for the bot, routed through the dispatcher."""
         for handler in self.handlers:
-            self.bot_client.telethon_client.add_event_handler(handler)
+            dispatched = self.dispatcher.wrap(handler)
+            if self.startup is not None:
+                dispatched = self.startup.wrap(dispatched)
+            for event_builder in events.list(handler):
+                self.bot_client.telethon_client.add_event_handler(
+                    dispatched, event_builder
+                )
 
     async def start(self):
         """Starts the bot."""
         self.register_handlers()
+        metrics.add_source(self.scheduler.metric_snapshots)
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        self.capacity_tracker.start()
+        if self.leases is not None:
+            self.leases.start()
         await self.connect_to_telegram()
 
     async def cleanup(self):
         """Cleans up resources when the bot is done."""
+        await self.dispatcher.close()
+        if self.write_behind_buffer is not None:
+            await self.write_behind_buffer.close()
+        # Released once the users' writes are flushed, for the next replica.
+        if self.leases is not None:
+            await self.leases.close()
+        await self.scheduler.close()
+        metrics.remove_source(self.scheduler.metric_snapshots)
+        await self.capacity_tracker.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
         await self.user_client.cleanup()
         await self.bot_client.cleanup()
         self.logger.info("Bot cleanup completed.")
@@ -0,0 +1,519 @@
+"""../bot/compiled_state_machine.py"""
+
+import asyncio
+import inspect
+import logging
+from collections import deque
+from functools import partial
+from typing import Any, Callable, Iterable
+
+Callback = str | Callable
+
+SEPARATOR = "_"
+WILDCARD_ALL = "*"
+WILDCARD_SAME = "="
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MachineError(Exception):
+    """Raised when a known trigger cannot be processed from the model's current state."""
+
+
+def _listify(value: Any) -> list:
+    """Wraps a single value in a list, mapping None to an empty list."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+class CompiledState:
+    """A state of the compiled machine, with its nested path and callbacks."""
+
+    __slots__ = (
+        "name",
+        "full_name",
+        "path",
+        "parent",
+        "children",
+        "initial",
+        "on_enter",
+        "on_exit",
+        "triggers",
+        "routes",
+    )
+
+    def __init__(self, path: tuple[str, ...], parent: "CompiledState | None"):
+        self.name = path[-1]
+        self.full_name = SEPARATOR.join(path)
+        self.path = path
+        self.parent = parent
+        self.children: list[CompiledState] = []
+        self.initial: CompiledState | None = None
+        self.on_enter: tuple[Callback, ...] = ()
+        self.on_exit: tuple[Callback, ...] = ()
+        self.triggers: tuple[str, ...] = ()
+        self.routes: dict[str, tuple[tuple[CompiledState, tuple[Route, ...]], ...]] = {}
+
+    @property
+    def ancestors(self) -> list["CompiledState"]:
+        """The state followed by its parents, innermost first."""
+        chain = []
+        state: CompiledState | None = self
+        while state is not None:
+            chain.append(state)
+            state = state.parent
+        return chain
+
+    def __repr__(self) -> str:
+        return f"<CompiledState {self.full_name}>"
+
+
+class CompiledTransition:
+    """A transition as declared in the configuration, with its callbacks resolved to lists."""
+
+    __slots__ = (
+        "trigger",
+        "source",
+        "dest",
+        "prepare",
+        "conditions",
+        "before",
+        "after",
+    )
+
+    def __init__(
+        self,
+        trigger: str,
+        source: str,
+        dest: str | None,
+        prepare: tuple[Callback, ...] = (),
+        conditions: tuple[tuple[Callback, bool], ...] = (),
+        before: tuple[Callback, ...] = (),
+        after: tuple[Callback, ...] = (),
+    ):
+        self.trigger = trigger
+        self.source = source
+        self.dest = dest
+        self.prepare = prepare
+        self.conditions = conditions
+        self.before = before
+        self.after = after
+
+    def __repr__(self) -> str:
+        return f"<CompiledTransition {self.trigger}: {self.source} -> {self.dest}>"
+
+
+class Route:
+    """A transition resolved for one concrete source state, with its exit and enter states."""
+
+    __slots__ = ("transition", "exits", "enters", "final")
+
+    def __init__(
+        self,
+        transition: CompiledTransition,
+        exits: tuple[CompiledState, ...],
+        enters: tuple[CompiledState, ...],
+        final: CompiledState | None,
+    ):
+        self.transition = transition
+        self.exits = exits
+        self.enters = enters
+        self.final = final
+
+
+class CompiledEvent:
+    """A named trigger of the compiled machine."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class CompiledEventData:
+    """The data passed to every callback of a triggered event."""
+
+    __slots__ = (
+        "state",
+        "event",
+        "machine",
+        "model",
+        "args",
+        "kwargs",
+        "transition",
+        "error",
+        "result",
+        "source_name",
+        "source_path",
+    )
+
+    def __init__(self, machine: "CompiledStateMachine", model: Any, args: tuple, kwargs: dict):
+        self.state: CompiledState | None = None
+        self.event: CompiledEvent | None = None
+        self.machine = machine
+        self.model = model
+        self.args = args
+        self.kwargs = kwargs
+        self.transition: CompiledTransition | None = None
+        self.error: Exception | None = None
+        self.result: bool | None = None
+        self.source_name: str | None = None
+        self.source_path: list[str] | None = None
+
+
+class CompiledStateMachine:
+    """A hierarchical asynchronous state machine compiled into dense lookup tables.
+
+    It is a drop-in for the subset of `HierarchicalAsyncMachine` used by the bot:
+    nested states joined by `_`, `*` and `=` wildcards, transition and machine
+    callbacks, conditions, model queues and `on_exception`/`finalize_event`.
+    Every state is resolved once into a `trigger -> routes` table, so triggering
+    an event is a dictionary lookup and adding or removing a model only binds
+    its `state` and `trigger` attributes. A configuration outside that subset,
+    such as auto transitions or parallel states, raises ValueError.
+    """
+
+    def __init__(
+        self,
+        model: Any = None,
+        states: Iterable | None = None,
+        initial: str = "initial",
+        transitions: Iterable | None = None,
+        send_event: bool = False,
+        auto_transitions: bool = False,
+        ordered_transitions: bool = False,
+        ignore_invalid_triggers: bool | None = None,
+        before_state_change: Callback | list | None = None,
+        after_state_change: Callback | list | None = None,
+        queued: bool | str = False,
+        prepare_event: Callback | list | None = None,
+        finalize_event: Callback | list | None = None,
+        on_exception: Callback | list | None = None,
+        model_attribute: str = "state",
+    ):
+        if auto_transitions or ordered_transitions:
+            raise ValueError(
+                "Auto and ordered transitions are not supported by the compiled machine."
+            )
+        self.send_event = send_event
+        self.ignore_invalid_triggers = ignore_invalid_triggers
+        self.has_queue = queued
+        self.model_attribute = model_attribute
+        self.prepare_event = tuple(_listify(prepare_event))
+        self.before_state_change = tuple(_listify(before_state_change))
+        self.after_state_change = tuple(_listify(after_state_change))
+        self.finalize_event = tuple(_listify(finalize_event))
+        self.on_exception = tuple(_listify(on_exception))
+        self.models: list = []
+        self.states: dict[str, CompiledState] = {}
+        self.events: dict[str, CompiledEvent] = {}
+        self._transitions: dict[str, dict[str, list[CompiledTransition]]] = {}
+        self._queues: dict[int, deque] = {}
+
+        self._add_states(_listify(states), parent=None)
+        self.initial = initial
+        if initial not in self.states:
+            self._add_states([initial], parent=None)
+        for transition in _listify(transitions):
+            self._add_transition(transition)
+        self._compile()
+
+        for mod in _listify(model):
+            self.add_model(mod)
+
+    def add_model(self, model: Any, initial: str | None = None):
+        """Adds a model in the given state, entering the state's initial children."""
+        state = self.get_state(initial or self.initial)
+        while state.initial is not None:
+            state = state.initial
+        setattr(model, self.model_attribute, state.full_name)
+        if not hasattr(model, "trigger"):
+            model.trigger = partial(self.trigger_event, model)
+        if self.has_queue == "model":
+            self._queues[id(model)] = deque()
+        self.models.append(model)
+
+    def remove_model(self, model: Any):
+        """Removes a model and its queued events from the machine."""
+        self.models.remove(model)
+        self._queues.pop(id(model), None)
+
+    def get_state(self, name: str) -> CompiledState:
+        """Gets a state by its full name."""
+        try:
+            return self.states[name]
+        except KeyError as error:
+            raise ValueError(f"State '{name}' is not a registered state.") from error
+
+    def get_model_state(self, model: Any) -> CompiledState:
+        """Gets the current state of a model."""
+        return self.get_state(getattr(model, self.model_attribute))
+
+    def get_triggers(self, *states: str) -> list[str]:
+        """Gets the triggers valid from the given states, including their parents' triggers."""
+        triggers: list[str] = []
+        for name in states:
+            triggers.extend(
+                trigger
+                for trigger in self.get_state(name).triggers
+                if trigger not in triggers
+            )
+        return triggers
+
+    def has_trigger(self, trigger: str) -> bool:
+        """Whether the trigger is known to the machine."""
+        return trigger in self.events
+
+    async def trigger_event(self, model: Any, trigger: str, *args, **kwargs) -> bool:
+        """Triggers an event on a model, queueing it while another event is processed."""
+        event_data = CompiledEventData(self, model, args, kwargs)
+        func = partial(self._trigger_event, event_data, trigger)
+        if not self.has_queue:
+            return await func()
+
+        queue = self._queues.get(id(model))
+        if queue is None:
+            queue = self._queues[id(model)] = deque()
+        queue.append(func)
+        if len(queue) > 1:
+            # Another event of this model is being processed and will run this one.
+            return True
+        while queue:
+            try:
+                await queue[0]()
+            except Exception:
+                queue.clear()
+                raise
+            if queue:
+                queue.popleft()
+        return True
+
+    async def callbacks(self, funcs: tuple[Callback, ...], event_data: CompiledEventData):
+        """Runs a list of callbacks concurrently."""
+        if not funcs:
+            return
+        if len(funcs) == 1:
+            await self.callback(funcs[0], event_data)
+            return
+        await asyncio.gather(*(self.callback(func, event_data) for func in funcs))
+
+    async def callback(self, func: Callback, event_data: CompiledEventData):
+        """Runs a callback, resolving names against the model."""
+        result = self._call(func, event_data)
+        if inspect.isawaitable(result):
+            await result
+
+    def _call(self, func: Callback, event_data: CompiledEventData) -> Any:
+        """Calls a callback with the event data, or its arguments if events are not sent."""
+        if isinstance(func, str):
+            func = getattr(event_data.model, func)
+            if not callable(func):
+                return func
+        if self.send_event:
+            return func(event_data)
+        return func(*event_data.args, **event_data.kwargs)
+
+    async def _check_condition(
+        self, func: Callback, target: bool, event_data: CompiledEventData
+    ) -> bool:
+        """Evaluates a condition against its expected outcome."""
+        result = self._call(func, event_data)
+        if inspect.isawaitable(result):
+            result = await result
+        return bool(result) == target
+
+    async def _trigger_event(self, event_data: CompiledEventData, trigger: str) -> bool:
+        """Processes a trigger from the model's current state."""
+        model = event_data.model
+        try:
+            state = self.get_model_state(model)
+            groups = state.routes.get(trigger)
+            if groups is None:
+                event_data.result = self._invalid_trigger(model, trigger)
+            else:
+                event_data.event = self.events[trigger]
+                for source, routes in groups:
+                    event_data.state = source
+                    event_data.source_name = source.full_name
+                    event_data.source_path = list(source.path)
+                    await self.callbacks(self.prepare_event, event_data)
+                    for route in routes:
+                        event_data.transition = route.transition
+                        event_data.result = await self._execute(route, event_data)
+                        if event_data.result:
+                            break
+                    if event_data.result:
+                        break
+        except Exception as error:  # pylint: disable=broad-except
+            event_data.error = error
+            if self.on_exception:
+                await self.callbacks(self.on_exception, event_data)
+            else:
+                raise
+        finally:
+            try:
+                await self.callbacks(self.finalize_event, event_data)
+            except Exception as error:  # pylint: disable=broad-except
+                _LOGGER.error(
+                    "While executing finalize callbacks a %s occurred: %s.",
+                    type(error).__name__,
+                    error,
+                )
+        return bool(event_data.result)
+
+    async def _execute(self, route: Route, event_data: CompiledEventData) -> bool:
+        """Executes a resolved transition, returning whether it took place."""
+        transition = route.transition
+        await self.callbacks(transition.prepare, event_data)
+        if transition.conditions:
+            results = await asyncio.gather(
+                *(
+                    self._check_condition(func, target, event_data)
+                    for func, target in transition.conditions
+                )
+            )
+            if not all(results):
+                return False
+
+        await self.callbacks(self.before_state_change, event_data)
+        await self.callbacks(transition.before, event_data)
+        if route.final is not None:
+            for state in route.exits:
+                await self.callbacks(state.on_exit, event_data)
+            setattr(event_data.model, self.model_attribute, route.final.full_name)
+            event_data.state = route.final
+            for state in route.enters:
+                await self.callbacks(state.on_enter, event_data)
+        await self.callbacks(transition.after, event_data)
+        await self.callbacks(self.after_state_change, event_data)
+        return True
+
+    def _invalid_trigger(self, model: Any, trigger: str) -> bool:
+        """Handles a trigger that has no transition from the model's current state."""
+        state_name = getattr(model, self.model_attribute)
+        message = f"Can't trigger event '{trigger}' from state(s) {state_name}!"
+        if not self.ignore_invalid_triggers:
+            if self.has_trigger(trigger):
+                raise MachineError(message)
+            raise AttributeError(f"Do not know event named '{trigger}'.")
+        _LOGGER.warning(message)
+        return False
+
+    def _add_states(self, states: list, parent: CompiledState | None):
+        """Adds the configured states and their children."""
+        for config in states:
+            if isinstance(config, str):
+                config = {"name": config}
+            elif not isinstance(config, dict):
+                raise ValueError(f"Unsupported state configuration: {config!r}")
+            if config.get("parallel") or config.get("transitions"):
+                raise ValueError(
+                    "Parallel states and nested transitions are not supported by the compiled machine."
+                )
+            path = (parent.path if parent else ()) + (config["name"],)
+            state = CompiledState(path, parent)
+            state.on_enter = tuple(_listify(config.get("on_enter")))
+            state.on_exit = tuple(_listify(config.get("on_exit")))
+            self.states[state.full_name] = state
+            if parent is not None:
+                parent.children.append(state)
+            self._add_states(_listify(config.get("children") or config.get("states")), state)
+            if config.get("initial"):
+                state.initial = self.get_state(
+                    SEPARATOR.join(path + (config["initial"],))
+                )
+
+    def _add_transition(self, config: dict | list | tuple):
+        """Adds a configured transition for each of its source states."""
+        if isinstance(config, (list, tuple)):
+            keys = ("trigger", "source", "dest", "conditions", "unless", "before", "after", "prepare")
+            config = dict(zip(keys, config))
+        trigger = config["trigger"]
+        self.events.setdefault(trigger, CompiledEvent(trigger))
+        source = config["source"]
+        if source == WILDCARD_ALL and config["dest"] == WILDCARD_SAME:
+            # A reflexive wildcard applies to every nested state, not only the top level.
+            sources = list(self.states)
+        elif source == WILDCARD_ALL:
+            sources = [
+                state.full_name for state in self.states.values() if state.parent is None
+            ]
+        else:
+            sources = _listify(source)
+        conditions = tuple(
+            [(func, True) for func in _listify(config.get("conditions"))]
+            + [(func, False) for func in _listify(config.get("unless"))]
+        )
+        for source_name in sources:
+            self.get_state(source_name)
+            dest = config["dest"]
+            transition = CompiledTransition(
+                trigger=trigger,
+                source=source_name,
+                dest=source_name if dest == WILDCARD_SAME else dest,
+                prepare=tuple(_listify(config.get("prepare"))),
+                conditions=conditions,
+                before=tuple(_listify(config.get("before"))),
+                after=tuple(_listify(config.get("after"))),
+            )
+            if transition.dest is not None:
+                self.get_state(transition.dest)
+            self._transitions.setdefault(trigger, {}).setdefault(source_name, []).append(
+                transition
+            )
+
+    def _compile(self):
+        """Resolves every state's triggers into routes with precomputed exits and enters."""
+        for state in self.states.values():
+            triggers: list[str] = []
+            routes: dict[str, list] = {}
+            for source in state.ancestors:
+                for trigger, transitions in self._transitions.items():
+                    source_transitions = transitions.get(source.full_name)
+                    if not source_transitions:
+                        continue
+                    if trigger not in triggers:
+                        triggers.append(trigger)
+                    routes.setdefault(trigger, []).append(
+                        (
+                            source,
+                            tuple(
+                                self._resolve_route(state, transition)
+                                for transition in source_transitions
+                            ),
+                        )
+                    )
+            state.triggers = tuple(triggers)
+            state.routes = {trigger: tuple(groups) for trigger, groups in routes.items()}
+
+    def _resolve_route(self, current: CompiledState, transition: CompiledTransition) -> Route:
+        """Resolves the states exited and entered when a transition runs from a state."""
+        if transition.dest is None:
+            return Route(transition, exits=(), enters=(), final=None)
+        dest = self.get_state(transition.dest)
+        common = 0
+        while (
+            common < len(dest.path)
+            and common < len(current.path)
+            and dest.path[common] == current.path[common]
+        ):
+            common += 1
+        if common == len(dest.path):
+            # A reflexive transition, or a child entering one of its parents.
+            common -= 1
+        exits = tuple(
+            self.states[SEPARATOR.join(current.path[:length])]
+            for length in range(len(current.path), common, -1)
+        )
+        enters = [
+            self.states[SEPARATOR.join(dest.path[:length])]
+            for length in range(common + 1, len(dest.path) + 1)
+        ]
+        final = dest
+        while final.initial is not None:
+            final = final.initial
+            enters.append(final)
+        return Route(transition, exits=exits, enters=tuple(enters), final=final)
@@ -0,0 +1,208 @@
+"""../bot/config_snapshot.py"""
+
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import stat
+import sys
+from typing import Callable
+
+import telethon
+
+import config
+from bot import compiled_state_machine, state_machine
+from bot.handlers import conversation_flow_handlers
+from bot.handlers.conversation_flow_handlers import StateHandler, StatePrompt
+from bot.state_machine import ConversationFlowStateMachine
+from config.state_machine.state_machine_config import StateMachineConfig
+from utils.json_utils import record_loaded_files
+
+SNAPSHOT_FORMAT = 2
+# The modules whose classes are pickled in a snapshot.
+CODE_MODULES = (compiled_state_machine, state_machine, conversation_flow_handlers)
+# The packages the config is built by; any change to their modules rebuilds it.
+CONFIG_PACKAGES = (config,)
+# The libraries whose objects are pickled in a snapshot, such as Telethon's
+# ReplyInlineMarkup in the prompts.
+LIBRARIES = (telethon,)
+
+# The app's directory, not the working directory, holds the default snapshot.
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SNAPSHOT_PATH = os.path.join(APP_DIR, ".state_machine_config.pickle")
+
+
+class CompiledConfig:
+    """A state machine config with its compiled machine and prebuilt prompts."""
+
+    def __init__(self, config: StateMachineConfig):
+        self.config = config
+        self.machine = ConversationFlowStateMachine(config)
+        self.prompts: dict[str, StatePrompt] = StateHandler.build_prompts(config)
+
+    def validate(self, model_class: type):
+        """Raises a ValueError listing the problems of the config."""
+        problems = self.machine.validate(model_class)
+        if problems:
+            raise ValueError(
+                "Invalid state machine config:\n  " + "\n  ".join(problems)
+            )
+
+
+def file_digest(path: str) -> str | None:
+    """Returns the sha256 of a file's content, or None if it cannot be read."""
+    try:
+        with open(path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def package_files(package) -> list[str]:
+    """Returns the Python files of a package and its subpackages, sorted."""
+    paths = []
+    for directory in package.__path__:
+        for root, _, files in os.walk(directory):
+            paths.extend(
+                os.path.join(root, name) for name in files if name.endswith(".py")
+            )
+    return sorted(paths)
+
+
+def unsafe_reason(path: str, file_stat: os.stat_result | None = None) -> str | None:
+    """Tells why a snapshot file or its directory could be written by others.
+
+    The file must belong to this process' user and be writable by no one
+    else; its directory must belong to that user or root and be writable by
+    no one else, unless it is sticky as /tmp is. Returns None when safe.
+    """
+    if not hasattr(os, "getuid"):
+        return None
+    uid = os.getuid()
+    directory = os.stat(os.path.dirname(os.path.abspath(path)))
+    if directory.st_uid not in (uid, 0):
+        return "its directory belongs to another user"
+    if directory.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not (
+        directory.st_mode & stat.S_ISVTX
+    ):
+        return "its directory is writable by other users"
+    if file_stat is not None:
+        if file_stat.st_uid != uid:
+            return "it belongs to another user"
+        if file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            return "it is writable by other users"
+    return None
+
+
+class ConfigSnapshot:
+    """Caches the validated, compiled state machine config in a pickle file.
+
+    A snapshot is keyed by the sha256 of every source it was built from: the
+    JSON files read through `load_json_file` while building the config, the
+    module of the build function, every module of the `config` package and
+    the modules of the pickled classes, and by the Python and Telethon
+    versions. It is used while none of them changed, and rebuilt, validated
+    and rewritten otherwise, so a restart skips parsing, validating and
+    compiling.
+
+    Unpickling runs code, so a snapshot is only read if no other user could
+    have written it (see `unsafe_reason`); it is written with mode 0600, by
+    default in the app's directory rather than the working directory.
+    """
+
+    def __init__(self, path: str = DEFAULT_SNAPSHOT_PATH, logger=None):
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+
+    def load(
+        self, build: Callable[[], StateMachineConfig], model_class: type
+    ) -> CompiledConfig:
+        """Returns the snapshot, or builds and saves a new one if it is stale."""
+        compiled = self._read()
+        if compiled is not None:
+            return compiled
+        with record_loaded_files() as loaded_files:
+            config = build()
+        compiled = CompiledConfig(config)
+        compiled.validate(model_class)
+        self._write(compiled, loaded_files + [inspect.getsourcefile(build) or ""])
+        return compiled
+
+    def _read(self) -> CompiledConfig | None:
+        """Reads the snapshot if it exists and its sources did not change."""
+        try:
+            with open(self.path, "rb") as file:
+                reason = unsafe_reason(self.path, os.fstat(file.fileno()))
+                if reason is not None:
+                    self.logger.warning(
+                        "Ignoring config snapshot %s: %s.", self.path, reason
+                    )
+                    return None
+                manifest = pickle.load(file)
+                if manifest != self._manifest(list(manifest.get("sources", {}))):
+                    self.logger.info("Config snapshot %s is stale.", self.path)
+                    return None
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (
+            OSError,
+            pickle.UnpicklingError,
+            EOFError,
+            AttributeError,
+            ImportError,
+        ) as error:
+            self.logger.warning("Ignoring config snapshot %s: %r", self.path, error)
+            return None
+
+    def _write(self, compiled: CompiledConfig, sources: list[str]):
+        """Writes the snapshot atomically; a failure only costs the next start."""
+        manifest = self._manifest(list(dict.fromkeys(sources)))
+        if None in manifest["sources"].values() or None in manifest["code"].values():
+            self.logger.warning("Not writing config snapshot: unreadable sources.")
+            return
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            reason = unsafe_reason(self.path)
+            if reason is not None:
+                self.logger.warning(
+                    "Not writing config snapshot %s: %s.", self.path, reason
+                )
+                return
+            descriptor = os.open(
+                temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600
+            )
+            with os.fdopen(descriptor, "wb") as file:
+                pickle.dump(manifest, file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(compiled, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path)
+            self.logger.info("Wrote config snapshot %s.", self.path)
+        except OSError as error:
+            self.logger.warning(
+                "Could not write config snapshot %s: %r", self.path, error
+            )
+
+    @staticmethod
+    def _manifest(sources: list[str]) -> dict:
+        """Builds the manifest of the given sources with their current digests."""
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "python": sys.version_info[:2],
+            "sources": {path: file_digest(path) for path in sources},
+            "code": {
+                **{
+                    module.__name__: file_digest(module.__file__ or "")
+                    for module in CODE_MODULES
+                },
+                **{
+                    path: file_digest(path)
+                    for package in CONFIG_PACKAGES
+                    for path in package_files(package)
+                },
+            },
+            "libraries": {
+                library.__name__: getattr(library, "__version__", None)
+                for library in LIBRARIES
+            },
+        }
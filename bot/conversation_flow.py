@@ -1,12 +1,21 @@
 """../bot/conversation_flow.py"""
 
+from typing import Callable
+
 from telethon.events import CallbackQuery, NewMessage
 from telethon.tl.types import KeyboardButtonCallback
-from transitions.extensions.asyncio import AsyncEventData
 
-from bot.handlers.conversation_flow_handlers import ConversationFlowHandlers
+from bot.compiled_state_machine import CompiledEventData
+from bot.config_snapshot import CompiledConfig, ConfigSnapshot
+from bot.handlers.conversation_flow_handlers import (
+    ConversationFlowHandlers,
+    StateHandler,
+    StatePrompt,
+)
 from bot.services.dynamodb_constants import DynamoDBAttributes
-from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.send_scheduler import SendScheduler, send_scheduler
+from bot.services.storage import Storage
+from bot.services.user_leases import UserLeases
 from bot.state_machine import (
     ConversationFlowStateMachine,
     ConversationFlowStateMachineManager,
@@ -20,12 +29,15 @@ class ConversationFlow(ConversationFlowHandlers):
     """A class representing a model for the conversation flow state machine."""
 
     _MACHINE: ConversationFlowStateMachine
+    _PROMPTS: dict[str, StatePrompt]
+    _LEASES: UserLeases | None = None
 
     def __init__(
         self,
         user_id: str,
-        dynamodb_crud_manager: DynamoDBCrudManager,
+        dynamodb_crud_manager: Storage,
         telethon_event: CallbackQuery.Event | NewMessage.Event,
+        scheduler: SendScheduler = send_scheduler,
     ):
         super().__init__(
             config=self._MACHINE.config,
@@ -33,13 +45,44 @@ class ConversationFlow(ConversationFlowHandlers):
             dynamodb_crud_manager=dynamodb_crud_manager,
             telethon_event=telethon_event,
             transition_event=None,
+            prompts=self._PROMPTS,
+            scheduler=scheduler,
         )
-        self.transition_event: AsyncEventData  # Set by the set_transition_event method by the state machine
+        self.user_id = user_id
+        self.transition_event: CompiledEventData  # Set by the set_transition_event method by the state machine
 
     @classmethod
     def config(cls, config: StateMachineConfig):
         """Configures the state machine."""
         cls._MACHINE = ConversationFlowStateMachineManager(config=config).machine
+        cls._PROMPTS = StateHandler.build_prompts(config)
+
+    @classmethod
+    def config_from_snapshot(
+        cls,
+        snapshot: ConfigSnapshot,
+        build: Callable[[], StateMachineConfig],
+    ) -> CompiledConfig:
+        """Configures the state machine from a snapshot, built with `build` if stale."""
+        compiled = snapshot.load(build, model_class=cls)
+        cls.config_from_compiled(compiled)
+        return compiled
+
+    @classmethod
+    def config_from_compiled(cls, compiled: CompiledConfig):
+        """Configures the state machine from a compiled config."""
+        cls._MACHINE = compiled.machine
+        cls._PROMPTS = compiled.prompts
+
+    @classmethod
+    def use_leases(cls, leases: UserLeases | None):
+        """Handles only the users whose lease this replica holds, if leases are given."""
+        cls._LEASES = leases
+
+    @classmethod
+    def leases(cls) -> UserLeases | None:
+        """The user leases the conversations take, if any."""
+        return cls._LEASES
 
     @property
     def _state_machine_config(self):
@@ -48,17 +91,13 @@ class ConversationFlow(ConversationFlowHandlers):
 
     @property
     async def user_state(self):
-        """Get the user state, retrieving it from the database if not already available."""
+        """Get the user state from the user session, falling back to the initial state."""
         user_state = await self._get_user_state_from_db()
         return user_state or self._state_machine_config.initial_state
 
     async def _get_user_state_from_db(self) -> str | None:
-        """Retrieves the user's state from the database."""
-        response = await self.dynamodb_crud_manager.get_attribute(
-            attribute=DynamoDBAttributes.USER_STATE.value,
-            pk=self.dynamodb_user_pk,
-            sk=self.dynamodb_user_sk,
-        )
+        """Retrieves the user's state from the user session snapshot."""
+        response = await self.user_session.get(DynamoDBAttributes.USER_STATE.value)
         return response if isinstance(response, str) else None
 
     async def trigger_start(self):
@@ -77,27 +116,30 @@ class ConversationFlow(ConversationFlowHandlers):
             await self.trigger(triggers[0])  # type: ignore  # pylint: disable=no-member
 
     async def _clear_user_inputs_in_db(self):
-        """Clears the user's inputs in the database."""
+        """Clears the user's inputs in the database.
+
+        The inputs map is reset to an empty map rather than removed, so that
+        later inputs can be written as single map entries.
+        """
+        to_reset = {DynamoDBAttributes.USER_INPUTS.value: {}}
         to_delete = [
-            DynamoDBAttributes.USER_INPUTS.value,
             DynamoDBAttributes.DESTINATION_CHAT.value,
             DynamoDBAttributes.DESTINATION_CHAT_TOPIC.value,
             DynamoDBAttributes.USER_STATE.value,
         ]
-        await self.dynamodb_crud_manager.delete_attributes(
+        await self.dynamodb_crud_manager.update_attributes(
             pk=self.dynamodb_user_pk,
             sk=self.dynamodb_user_sk,
-            attributes=to_delete,
+            attributes=to_reset,
+            remove=to_delete,
         )
+        self.user_session.set(to_reset)
+        self.user_session.remove(to_delete)
 
     async def _get_valid_next_triggers(self) -> list:
         """Returns the valid next triggers from the current state."""
         current_state = await self.user_state
-        return [
-            trigger
-            for trigger in self._MACHINE.get_triggers(current_state)
-            if trigger.startswith("@")
-        ]
+        return self._MACHINE.get_auto_triggers(current_state)
 
     async def setup_conversation(self):
         """Sets up the conversation by adding it to the state machine models."""
@@ -111,8 +153,16 @@ class ConversationFlow(ConversationFlowHandlers):
         self._MACHINE.remove_conversation(self)
 
     async def __aenter__(self):
+        # A user just taken over from another replica is read after its last write.
+        claimed = False
+        if self._LEASES is not None:
+            claimed = await self._LEASES.acquire(self.user_id)
+        await self.user_session.load(consistent=claimed)
         await self.setup_conversation()
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
         await self.cleanup()
+        await self.dynamodb_crud_manager.flush(
+            self.dynamodb_user_pk, self.dynamodb_user_sk
+        )
@@ -6,34 +6,44 @@ from typing import Type
 from telethon import events
 
 from bot.conversation_flow import ConversationFlow
-from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.metrics import metrics
+from bot.services.send_scheduler import SendScheduler, send_scheduler
+from bot.services.storage import Storage
+from bot.services.tracing import tracer
 
 
 def initialize_callback_handler(
     conversation_flow: Type[ConversationFlow],
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
+    scheduler: SendScheduler = send_scheduler,
 ) -> partial:
     """Initializes the callback handler."""
     handler = partial(
         handle_callback_query,
         conversation_flow=conversation_flow,
         dynamodb_crud_manager=dynamodb_crud_manager,
+        scheduler=scheduler,
     )
     return events.register(events.CallbackQuery())(handler)
 
 
 async def handle_callback_query(
     event: events.CallbackQuery.Event,
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
     conversation_flow: Type[ConversationFlow],
+    scheduler: SendScheduler = send_scheduler,
 ):
     """Handles callback query."""
     user_id = str(event.sender_id)
 
-    async with conversation_flow(
-        user_id=user_id,
-        dynamodb_crud_manager=dynamodb_crud_manager,
-        telethon_event=event,
-    ) as conversation:
-        callback_data = event.data.decode("utf-8")
-        await conversation.trigger_callback(callback_data)
+    with metrics.track_handler("callback"), tracer.trace(
+        "callback", user_id=user_id, data=event.data.decode("utf-8")
+    ):
+        async with conversation_flow(
+            user_id=user_id,
+            dynamodb_crud_manager=dynamodb_crud_manager,
+            telethon_event=event,
+            scheduler=scheduler,
+        ) as conversation:
+            callback_data = event.data.decode("utf-8")
+            await conversation.trigger_callback(callback_data)
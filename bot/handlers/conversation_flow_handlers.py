@@ -1,5 +1,8 @@
 """../bot/handlers/conversation_flow_handlers.py"""
 
+import asyncio
+import logging
+import time
 from typing import Any, Dict, List, Tuple
 
 import ulid
@@ -7,18 +10,31 @@ from telethon import TelegramClient
 from telethon.events import CallbackQuery, NewMessage
 from telethon.tl.custom import Button
 from telethon.tl.custom.message import Message
-from telethon.tl.types import KeyboardButtonCallback
-from transitions.extensions.asyncio import AsyncEventData
+from telethon.tl.types import KeyboardButtonCallback, ReplyInlineMarkup
 
+from bot.compiled_state_machine import CompiledEventData
 from bot.services.dynamodb_constants import (
     DynamoDBAttributes,
     DynamoDBFormatter,
     DynamoDBGSI1QuestionStatusValues,
     DynamoDBKeySchema,
 )
-from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.dynamodb_crud_manager import ConditionalCheckFailedError
+from bot.services.metrics import metrics
+from bot.services.reply_routing_index import reply_routing_index
+from bot.services.send_scheduler import SendPriority, SendScheduler, send_scheduler
+from bot.services.storage import Storage
+from bot.services.telegram_cache import dest_message_cache, profile_cache
+from bot.services.tracing import tracer
+from bot.services.user_session import UserSession
+from clients.dynamodb_client import conditions
 from config.state_machine.state_machine_config import StateMachineConfig
 
+_LOGGER = logging.getLogger(__name__)
+
+# Reverts of transitions whose prompt failed, kept until they finish.
+_PENDING_REVERTS: set[asyncio.Task] = set()
+
 StateInlineButtonsData = list[str | list[str]]
 InlineButtons = List[KeyboardButtonCallback]
 
@@ -26,78 +42,117 @@ InlineButtons = List[KeyboardButtonCallback]
 class DynamoDBMixin:
     """Mixin class to handle DynamoDB operations."""
 
-    def __init__(self, dynamodb_crud_manager: DynamoDBCrudManager, user_id: str):
+    def __init__(self, dynamodb_crud_manager: Storage, user_id: str):
         self.dynamodb_crud_manager = dynamodb_crud_manager
         self.dynamodb_user_pk = DynamoDBFormatter.prefix_user_pk(user_id)
         self.dynamodb_user_sk = DynamoDBFormatter.prefix_user_sk(user_id)
-
-    async def update_user_state_in_db(self, state: str):
-        """Updates the user's state in the database."""
-        await self.dynamodb_crud_manager.update_attributes(
+        self.user_session = UserSession(
+            dynamodb_crud_manager=dynamodb_crud_manager,
             pk=self.dynamodb_user_pk,
             sk=self.dynamodb_user_sk,
-            attributes={DynamoDBAttributes.USER_STATE.value: state},
         )
 
+    async def update_user_state_in_db(self, state: str):
+        """Updates the user's state in the database."""
+        await self._update_user_attributes({DynamoDBAttributes.USER_STATE.value: state})
+
     async def store_user_input_in_db(self, state: str, user_input: str):
         """Stores the user's input in the database."""
-        user_inputs = await self.get_user_inputs_from_db()
-        user_inputs[state] = user_input
-        await self.dynamodb_crud_manager.update_attributes(
+        await self.dynamodb_crud_manager.set_map_entry(
+            attribute=DynamoDBAttributes.USER_INPUTS.value,
+            key=state,
+            value=user_input,
             pk=self.dynamodb_user_pk,
             sk=self.dynamodb_user_sk,
-            attributes={DynamoDBAttributes.USER_INPUTS.value: user_inputs},
         )
+        user_inputs = dict(await self.get_user_inputs_from_db())
+        user_inputs[state] = user_input
+        self.user_session.set({DynamoDBAttributes.USER_INPUTS.value: user_inputs})
 
     async def get_user_inputs_from_db(self) -> Dict[str, str]:
-        """Retrieves the user's inputs from the database."""
-        response = await self.dynamodb_crud_manager.get_attribute(
-            attribute=DynamoDBAttributes.USER_INPUTS.value,
-            pk=self.dynamodb_user_pk,
-            sk=self.dynamodb_user_sk,
-        )
+        """Retrieves the user's inputs from the user session."""
+        response = await self.user_session.get(DynamoDBAttributes.USER_INPUTS.value)
         return response if isinstance(response, dict) else {}
 
     async def get_destination_chat(self) -> str:
         """Gets the destination chat for the user."""
-        response = await self.dynamodb_crud_manager.get_attribute(
-            attribute=DynamoDBAttributes.DESTINATION_CHAT.value,
-            pk=self.dynamodb_user_pk,
-            sk=self.dynamodb_user_sk,
+        response = await self.user_session.get(
+            DynamoDBAttributes.DESTINATION_CHAT.value
         )
         return response if isinstance(response, str) else ""
 
     async def get_destination_chat_topic(self) -> str:
         """Gets the destination chat topic for the user."""
-        response = await self.dynamodb_crud_manager.get_attribute(
-            attribute=DynamoDBAttributes.DESTINATION_CHAT_TOPIC.value,
-            pk=self.dynamodb_user_pk,
-            sk=self.dynamodb_user_sk,
+        response = await self.user_session.get(
+            DynamoDBAttributes.DESTINATION_CHAT_TOPIC.value
         )
         return response if isinstance(response, str) else ""
 
     async def store_destination_chat(self, chat_id):
         """Stores the destination chat for the user."""
-        await self.dynamodb_crud_manager.update_attributes(
-            pk=self.dynamodb_user_pk,
-            sk=self.dynamodb_user_sk,
-            attributes={DynamoDBAttributes.DESTINATION_CHAT.value: chat_id},
+        await self._update_user_attributes(
+            {DynamoDBAttributes.DESTINATION_CHAT.value: chat_id}
         )
 
     async def store_destination_chat_topic(self, topic_id):
         """Stores the destination chat topic for the user."""
+        await self._update_user_attributes(
+            {DynamoDBAttributes.DESTINATION_CHAT_TOPIC.value: topic_id}
+        )
+
+    async def _update_user_attributes(self, attributes: Dict[str, Any]):
+        """Writes the user's attributes and records them in the user session."""
         await self.dynamodb_crud_manager.update_attributes(
             pk=self.dynamodb_user_pk,
             sk=self.dynamodb_user_sk,
-            attributes={DynamoDBAttributes.DESTINATION_CHAT_TOPIC.value: topic_id},
+            attributes=attributes,
         )
+        self.user_session.set(attributes)
+
+
+class StatePrompt:
+    """A state's prompt message and its prebuilt inline keyboard markup."""
+
+    __slots__ = ("message", "buttons")
+
+    def __init__(self, message: str, buttons: ReplyInlineMarkup | None):
+        self.message = message
+        self.buttons = buttons
 
 
 class StateHandler:
     """Class to handle state-related operations."""
 
-    def __init__(self, config: StateMachineConfig):
+    def __init__(
+        self,
+        config: StateMachineConfig,
+        prompts: dict[str, StatePrompt] | None = None,
+    ):
         self.config = config
+        self.prompts = prompts if prompts is not None else {}
+
+    @classmethod
+    def build_prompts(cls, config: StateMachineConfig) -> dict[str, StatePrompt]:
+        """Builds the prompt of every state with a message or inline buttons."""
+        state_handler = cls(config)
+        for state in {**config.messages, **config.inline_buttons}:
+            state_handler.get_state_prompt(state)
+        return state_handler.prompts
+
+    def get_state_prompt(self, state: str) -> StatePrompt:
+        """Gets the prompt for the given state, building it on first use."""
+        prompt = self.prompts.get(state)
+        if prompt is None:
+            prompt = StatePrompt(
+                message=self.get_state_message(state),
+                buttons=TelegramClient.build_reply_markup(
+                    self.strings_to_inline_buttons(
+                        self.get_state_inline_buttons(state), rtl=True
+                    )
+                ),  # type: ignore
+            )
+            self.prompts[state] = prompt
+        return prompt
 
     def get_state_message(self, state: str) -> str:
         """Extracts the message for the given state."""
@@ -115,39 +170,78 @@ class StateHandler:
         """Gets the destination chat topic for the given state."""
         return self.config.destinations.get(state, {}).get("topic_id", "")
 
+    @classmethod
+    def strings_to_inline_buttons(
+        cls,
+        strings: StateInlineButtonsData,
+        rtl: bool = False,
+    ) -> InlineButtons | list[InlineButtons]:
+        """Converts a list of strings or a list of lists of strings
+        into a list of Telethon inline buttons."""
+        if rtl:
+            strings = cls._reverse_nested_structure(strings)
+
+        if isinstance(strings[0], list):
+            # List of lists of strings (representing rows)
+            return [
+                [Button.inline(button, button) for button in row] for row in strings
+            ]
+        else:
+            # List of strings (single row of buttons)
+            return [Button.inline(button) for button in strings]
+
+    @staticmethod
+    def _reverse_nested_structure(
+        nested_structure: list[list[str] | str],
+    ) -> list[list[str] | str]:
+        """Reverses the order of elements in each row of a nested structure."""
+        return [row[::-1] if isinstance(row, list) else row for row in nested_structure]
+
 
 class QuestionHandler:
     """A Class to handle question-related operations."""
 
     def __init__(
         self,
-        dynamodb_crud_manager: DynamoDBCrudManager,
+        dynamodb_crud_manager: Storage,
         telethon_event: NewMessage.Event | CallbackQuery.Event,
         user_id: str,
         dynamodb_mixin: DynamoDBMixin,
         state_handler: StateHandler,
+        scheduler: SendScheduler = send_scheduler,
     ):
         self.dynamodb_crud_manager = dynamodb_crud_manager
         self.telethon_event = telethon_event
         self.user_id = user_id
         self.dynamodb_mixin = dynamodb_mixin
         self.state_handler = state_handler
+        self.scheduler = scheduler
         self.telethon_client: TelegramClient = telethon_event.client
 
     async def process_question_submission(
-        self, event: AsyncEventData
+        self, event: CompiledEventData
     ):  # pylint: disable=unused-argument
-        """Processes the user's question submission."""
-        question_item = await self._new_question_in_db()
+        """Processes the user's question submission.
+
+        The question is sent first, so that the item is written once with the
+        GSI2 keys of its destination message.
+        """
+        question_item = await self._new_question_item()
         destination_chat, destination_chat_topic = await self._get_destination()
         question_message_id = await self._send_formatted_question(
             question_item, destination_chat, destination_chat_topic
         )
-        await self._add_question_message_id_to_db(
-            question_sk=question_item[DynamoDBKeySchema.SK.value],
+        self._add_question_message_id_to_item(
+            question_item=question_item,
             dest_question_message_id=question_message_id,
             dest_chat_id=destination_chat,
         )
+        await self._store_question(question_item=question_item)
+        reply_routing_index.put(
+            dest_chat_id=destination_chat,
+            dest_message_id=question_message_id,
+            question=question_item,
+        )
 
     async def _send_formatted_question(
         self,
@@ -163,15 +257,17 @@ class QuestionHandler:
             destination_chat_topic=destination_chat_topic,
         )
 
-    async def _new_question_in_db(self) -> Dict[str, Any]:
-        """Creates a new question in the database."""
+    async def _new_question_item(self) -> Dict[str, Any]:
+        """Builds a new question item from the user's inputs."""
+        message = self.telethon_event.message  # type: ignore
         question_data = self._build_question_data(
-            message=self.telethon_event.message,  # type: ignore
+            message=message,
             user_inputs=await self.dynamodb_mixin.get_user_inputs_from_db(),
+            sender=await profile_cache.get_profile(
+                message.sender_id, message.get_sender
+            ),
         )
-        question_item = self._prepare_question_item(data=question_data)
-        await self._store_question(question_item=question_item)
-        return question_item
+        return self._prepare_question_item(data=question_data)
 
     def _extract_message_info(self) -> tuple[int, int, str, str, str]:
         """Extracts message information."""
@@ -186,18 +282,18 @@ class QuestionHandler:
 
     @staticmethod
     def _build_question_data(
-        message: Message, user_inputs: dict[str, str]
+        message: Message, user_inputs: dict[str, str], sender
     ) -> dict[str, Any]:
         """Builds the question data dictionary."""
         return {
             DynamoDBAttributes.QUESTION_ID.value: message.id,
             DynamoDBAttributes.USER_ID.value: message.sender_id,
             DynamoDBAttributes.USER_USERNAME.value: (
-                f"@{message.sender.username}" if message.sender.username else "لا يوجد"  # type: ignore
+                f"@{sender.username}" if sender.username else "لا يوجد"
             ),
-            DynamoDBAttributes.USER_FIRST_NAME.value: message.sender.first_name,  # type: ignore
-            DynamoDBAttributes.USER_LAST_NAME.value: message.sender.last_name,  # type: ignore
-            DynamoDBAttributes.USER_FULL_NAME.value: f"{message.sender.first_name} {message.sender.last_name or ''}",  # type: ignore
+            DynamoDBAttributes.USER_FIRST_NAME.value: sender.first_name,
+            DynamoDBAttributes.USER_LAST_NAME.value: sender.last_name,
+            DynamoDBAttributes.USER_FULL_NAME.value: f"{sender.first_name} {sender.last_name or ''}",
             DynamoDBAttributes.QUESTION_STATUS.value: DynamoDBGSI1QuestionStatusValues.NON_ANSWERED.value,
             **user_inputs,
         }
@@ -220,34 +316,24 @@ class QuestionHandler:
         }
 
     async def _store_question(self, question_item):
-        """Stores the question item in DynamoDB."""
-        await self.dynamodb_crud_manager.put_item(item=question_item)
-
-    async def _add_question_message_id_to_db(
-        self, question_sk: str, dest_question_message_id: int, dest_chat_id: str
-    ):
-        """Adds the destination question message ID to the user's item in the database."""
-        dest_chat_gsi2_pk = self._get_dest_chat_gsi2_pk(dest_chat_id=dest_chat_id)
-        dest_message_gsi2_pk = self._get_dest_message_gsi2_sk(
-            dest_message_id=str(dest_question_message_id)
-        )
-        await self._add_dest_message_gsi2_sk_to_question_item(
-            question_sk=question_sk,
-            dest_chat_gsi2_pk=dest_chat_gsi2_pk,
-            dest_message_gsi2_sk=dest_message_gsi2_pk,
+        """Stores the new question item in DynamoDB, failing if its key is taken."""
+        await self.dynamodb_crud_manager.put_item(
+            item=question_item,
+            condition=conditions.Attr(DynamoDBKeySchema.PK.value).not_exists(),
         )
 
-    async def _add_dest_message_gsi2_sk_to_question_item(
-        self, question_sk: str, dest_chat_gsi2_pk: str, dest_message_gsi2_sk: str
+    def _add_question_message_id_to_item(
+        self,
+        question_item: Dict[str, Any],
+        dest_question_message_id: int,
+        dest_chat_id: str,
     ):
-        """Adds the destination message GSI2 PK to the question item in the database."""
-        await self.dynamodb_crud_manager.update_attributes(
-            pk=self.dynamodb_mixin.dynamodb_user_pk,
-            sk=question_sk,
-            attributes={
-                DynamoDBKeySchema.GSI2_PK.value: dest_chat_gsi2_pk,
-                DynamoDBKeySchema.GSI2_SK.value: dest_message_gsi2_sk,
-            },
+        """Adds the destination question message's GSI2 keys to the question item."""
+        question_item[DynamoDBKeySchema.GSI2_PK.value] = self._get_dest_chat_gsi2_pk(
+            dest_chat_id=dest_chat_id
+        )
+        question_item[DynamoDBKeySchema.GSI2_SK.value] = self._get_dest_message_gsi2_sk(
+            dest_message_id=str(dest_question_message_id)
         )
 
     @staticmethod
@@ -283,12 +369,16 @@ class QuestionHandler:
         self, question_message: str, destination_chat: str, destination_chat_topic: str
     ) -> int:
         """Sends the question to the destination chat."""
-        sent_message = await self.telethon_client.send_message(
+        sent_message = await self.scheduler.send(
+            int(destination_chat),
+            self.telethon_client.send_message,
             entity=int(destination_chat),
             message=question_message,
             reply_to=int(destination_chat_topic),
             link_preview=False,
+            priority=SendPriority.FAN_OUT,
         )
+        dest_message_cache.remember(destination_chat, sent_message.id, sent_message.text)
         return sent_message.id
 
 
@@ -299,91 +389,105 @@ class ConversationFlowHandlers(DynamoDBMixin):
         self,
         config: StateMachineConfig,
         user_id: str,
-        dynamodb_crud_manager: DynamoDBCrudManager,
+        dynamodb_crud_manager: Storage,
         telethon_event: NewMessage.Event | CallbackQuery.Event,
-        transition_event: AsyncEventData | None = None,
+        transition_event: CompiledEventData | None = None,
+        prompts: dict[str, StatePrompt] | None = None,
+        scheduler: SendScheduler = send_scheduler,
     ):
         super().__init__(dynamodb_crud_manager, user_id)
-        self.state_handler = StateHandler(config)
+        self.state_handler = StateHandler(config, prompts)
+        self.scheduler = scheduler
         self.question_handler = QuestionHandler(
             dynamodb_crud_manager=dynamodb_crud_manager,
             telethon_event=telethon_event,
             user_id=user_id,
             dynamodb_mixin=self,
             state_handler=self.state_handler,
+            scheduler=scheduler,
         )
         self.telethon_event = telethon_event
         self.telethon_client: TelegramClient = telethon_event.client
         self._transition_event = transition_event
         self._dest_state = ""
-        self._dest_state_inline_buttons = []
+        self._dest_prompt = StatePrompt(message="", buttons=None)
+        self._transition_started = 0.0
 
     @property
-    def transition_event(self) -> AsyncEventData:
+    def transition_event(self) -> CompiledEventData:
         """Get the transition event."""
         assert self._transition_event is not None, "Transition event is not set."
         return self._transition_event
 
-    async def prepare_event(self, event: AsyncEventData):
-        """Sets the transition event."""
+    @tracer.traced("state_callback")
+    async def prepare_event(self, event: CompiledEventData):
+        """Sets the transition event and starts timing the transition."""
         self._transition_event = event
+        self._transition_started = time.perf_counter()
 
+    @tracer.traced("state_callback")
     async def before_state_change(
         self, *args
     ):  # pylint: disable=unused-argument
-        """Sets the destination state and inline buttons."""
+        """Sets the destination state and its prebuilt prompt."""
         self._dest_state = self.transition_event.transition.dest
-        self._dest_state_inline_buttons = self._strings_to_inline_buttons(
-            self.state_handler.get_state_inline_buttons(self._dest_state), rtl=True
-        )
+        self._dest_prompt = self.state_handler.get_state_prompt(self._dest_state)
 
+    @tracer.traced("state_callback")
     async def send_prompt_message(
         self, *args
     ):  # pylint: disable=unused-argument
         """Sends a prompt message to the user."""
-        await self._send_message(
-            message=self.state_handler.get_state_message(self._dest_state)
-        )
+        await self._send_message(message=self._dest_prompt.message)
 
+    @tracer.traced("state_callback")
     async def send_prompt_message_with_inline_buttons(
         self, *args
     ):  # pylint: disable=unused-argument
         """Sends a prompt message to the user with inline buttons."""
         await self._send_message(
-            message=self.state_handler.get_state_message(self._dest_state),
-            buttons=self._dest_state_inline_buttons,
+            message=self._dest_prompt.message,
+            buttons=self._dest_prompt.buttons,
         )
 
+    @tracer.traced("state_callback")
     async def edit_prompt_message_with_inline_buttons(
         self, *args
     ):  # pylint: disable=unused-argument
         """Edits the prompt message with inline buttons."""
         await self._edit_message(
-            message=self.state_handler.get_state_message(self._dest_state),
-            buttons=self._dest_state_inline_buttons,
+            message=self._dest_prompt.message,
+            buttons=self._dest_prompt.buttons,
         )
 
+    @tracer.traced("state_callback")
     async def edit_prompt_message(
         self, *args
     ):  # pylint: disable=unused-argument
         """Edits the prompt message with inline buttons."""
-        await self._edit_message(
-            message=self.state_handler.get_state_message(self._dest_state),
-        )
+        await self._edit_message(message=self._dest_prompt.message)
 
+    @tracer.traced("state_callback")
     async def proccess_question_submission(
         self, *args
     ):  # pylint: disable=unused-argument
         """Processes the user's question submission."""
         await self.question_handler.process_question_submission(self.transition_event)
 
+    @tracer.traced("state_callback")
     async def update_user_state_in_db(
         self, *args
     ):  # pylint: disable=unused-argument
-        """Updates the user's state in the database."""
+        """Updates the user's state in the database, ending the transition's timing."""
         state = self.transition_event.model.state  # type: ignore
         await super().update_user_state_in_db(state)
+        metrics.observe_transition(
+            self.transition_event.source_name,  # type: ignore
+            state,
+            time.perf_counter() - self._transition_started,
+        )
 
+    @tracer.traced("state_callback")
     async def store_user_input_in_db(
         self, *args
     ):  # pylint: disable=unused-argument
@@ -392,6 +496,7 @@ class ConversationFlowHandlers(DynamoDBMixin):
         src_state = self.transition_event.transition.source
         await super().store_user_input_in_db(src_state, user_input)
 
+    @tracer.traced("state_callback")
     async def set_destination_chat(
         self, *args
     ):  # pylint: disable=unused-argument
@@ -401,6 +506,7 @@ class ConversationFlowHandlers(DynamoDBMixin):
         )
         await super().store_destination_chat(destination_chat_id)
 
+    @tracer.traced("state_callback")
     async def set_destination_chat_topic(
         self, *args
     ):  # pylint: disable=unused-argument
@@ -411,42 +517,74 @@ class ConversationFlowHandlers(DynamoDBMixin):
         await super().store_destination_chat_topic(destination_chat_topic)
 
     async def _send_message(
-        self, message: str, buttons: InlineButtons | list[InlineButtons] | None = None
+        self, message: str, buttons: ReplyInlineMarkup | None = None
     ):
-        """Sends a message to the user."""
-        await self.telethon_event.respond(message=message, buttons=buttons)
+        """Queues a message to the user without waiting for it to be sent.
+
+        The chat's queue keeps the prompts in order, and flood waits are
+        retried by the scheduler; other failures revert the transition.
+        """
+        self._watch_prompt(
+            self.scheduler.submit(
+                self.telethon_event.chat_id,
+                self.telethon_event.respond,
+                message=message,
+                buttons=buttons,
+            )
+        )
 
     async def _edit_message(
-        self, message: str, buttons: InlineButtons | list[InlineButtons] | None = None
+        self, message: str, buttons: ReplyInlineMarkup | None = None
     ):
-        """Edits the message sent to the user."""
-        await self.telethon_event.edit(message, buttons=buttons)
-
-    def _strings_to_inline_buttons(
-        self,
-        strings: StateInlineButtonsData,
-        rtl: bool = False,
-    ) -> InlineButtons | list[InlineButtons]:
-        """Converts a list of strings or a list of lists of strings
-        into a list of Telethon inline buttons."""
-        if rtl:
-            strings = self._reverse_nested_structure(strings)
-
-        if isinstance(strings[0], list):
-            # List of lists of strings (representing rows)
-            return [
-                [Button.inline(button, button) for button in row] for row in strings
-            ]
-        else:
-            # List of strings (single row of buttons)
-            return [Button.inline(button) for button in strings]
+        """Queues an edit of the message sent to the user, as `_send_message` does."""
+        self._watch_prompt(
+            self.scheduler.submit(
+                self.telethon_event.chat_id,
+                self.telethon_event.edit,
+                message,
+                buttons=buttons,
+            )
+        )
 
-    @staticmethod
-    def _reverse_nested_structure(
-        nested_structure: list[list[str] | str],
-    ) -> list[list[str] | str]:
-        """Reverses the order of elements in each row of a nested structure."""
-        return [row[::-1] if isinstance(row, list) else row for row in nested_structure]
+    def _watch_prompt(self, future: asyncio.Future):
+        """Reverts the transition's stored state if its prompt cannot be sent.
+
+        The state is reverted only while it is still the one the update ended
+        in, which auto transitions may have moved past the prompt's state.
+        """
+        source = self.transition_event.transition.source
+        model = self.transition_event.model
+
+        def on_done(done: asyncio.Future):
+            if done.cancelled() or done.exception() is None:
+                return
+            stored = model.state  # type: ignore
+            _LOGGER.error(
+                "A prompt for user %s failed; reverting from %s to %s.",
+                self.dynamodb_user_pk,
+                stored,
+                source,
+                exc_info=done.exception(),
+            )
+            task = asyncio.ensure_future(self._revert_user_state(source, stored))
+            _PENDING_REVERTS.add(task)
+            task.add_done_callback(_PENDING_REVERTS.discard)
+
+        future.add_done_callback(on_done)
+
+    async def _revert_user_state(self, source: str, stored: str):
+        """Stores the source state again, unless the user has moved on from `stored`."""
+        try:
+            await self.dynamodb_crud_manager.update_attributes(
+                {DynamoDBAttributes.USER_STATE.value: source},
+                self.dynamodb_user_pk,
+                self.dynamodb_user_sk,
+                condition=conditions.Attr(DynamoDBAttributes.USER_STATE.value).eq(
+                    stored
+                ),
+            )
+        except ConditionalCheckFailedError:
+            pass
 
     async def _get_user_input(self) -> str:
         """Retrieves the user's input from the event."""
@@ -1,5 +1,6 @@
 """../bot/handlers/message_handlers.py"""
 
+import logging
 from functools import partial
 from types import SimpleNamespace
 from typing import Type
@@ -14,48 +15,63 @@ from bot.services.dynamodb_constants import (
     DynamoDBGSI1QuestionStatusValues,
     DynamoDBKeySchema,
 )
-from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.metrics import metrics
+from bot.services.reply_routing_index import ReplyRoutingIndex, reply_routing_index
+from bot.services.send_scheduler import SendPriority, SendScheduler, send_scheduler
+from bot.services.stage_graph import SkipStage, StageGraph
+from bot.services.storage import Storage
+from bot.services.telegram_cache import dest_message_cache, profile_cache
+from bot.services.tracing import tracer
+from bot.services.user_leases import UserLeases
+
+_LOGGER = logging.getLogger(__name__)
 
 
 def initialize_text_messege_handler(
     conversation_flow: Type[ConversationFlow],
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
+    scheduler: SendScheduler = send_scheduler,
 ) -> partial:
     """Initializes the text message handler."""
     handler = partial(
         handle_text_message,
         conversation_flow=conversation_flow,
         dynamodb_crud_manager=dynamodb_crud_manager,
+        scheduler=scheduler,
     )
     return events.register(events.NewMessage())(handler)
 
 
 async def handle_text_message(
     event: events.NewMessage.Event,
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
     conversation_flow: Type[ConversationFlow],
+    scheduler: SendScheduler = send_scheduler,
 ):
     """Handle text messages."""
+    profile_cache.remember(event.sender_id, event.sender)
 
     if event.is_reply:
-        dest_question_message = await event.get_reply_message()
         await handle_reply(
             event=event,
-            dest_question_message=dest_question_message,
             answer=event.message,
             dynamodb_crud_manager=dynamodb_crud_manager,
+            scheduler=scheduler,
+            leases=conversation_flow.leases(),
         )
     else:
         if not event.is_private:
             return
 
         user_id = str(event.sender.id)
-        async with conversation_flow(
-            user_id=user_id,
-            dynamodb_crud_manager=dynamodb_crud_manager,
-            telethon_event=event,
-        ) as conversation:
-            await conversation.trigger_next_state()
+        with metrics.track_handler("text"), tracer.trace("text", user_id=user_id):
+            async with conversation_flow(
+                user_id=user_id,
+                dynamodb_crud_manager=dynamodb_crud_manager,
+                telethon_event=event,
+                scheduler=scheduler,
+            ) as conversation:
+                await conversation.trigger_next_state()
 
 
 # async def handle_reply(
@@ -138,51 +154,123 @@ async def handle_text_message(
 
 async def handle_reply(
     event: events.NewMessage.Event,
-    dest_question_message: Message,
     answer: Message,
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
+    routing_index: ReplyRoutingIndex = reply_routing_index,
+    scheduler: SendScheduler = send_scheduler,
+    leases: UserLeases | None = None,
 ):
-    """Handle reply messages."""
-    dest_question_message_id = dest_question_message.id
-    dest_chat_id = dest_question_message.chat_id
+    """Handle reply messages.
 
-    source_chat_gsi1_pk = DynamoDBFormatter.prefix_dest_chat_gsi2_pk(
-        dest_chat_id=str(dest_chat_id),
-    )
-    dest_question_message_gsi2_pk = DynamoDBFormatter.prefix_dest_message_gsi2_sk(
-        dest_message_id=str(dest_question_message_id),
-    )
+    Each answer is stored as its own item next to the question, and the
+    question only gets an atomic status and answer count update, so the cost
+    of an answer does not grow with the number of answers.
 
-    items = await dynamodb_crud_manager.get_items_from_index(
-        DynamoDBKeySchema.INDEX_GSI2_PK_GSI2_SK.value,
-        pk=source_chat_gsi1_pk,
-        sk=dest_question_message_gsi2_pk,
-    )
-    if not items:
-        return
-
-    question = items[0]
-    user_id = question[DynamoDBAttributes.USER_ID.value]
-    question_id = question[DynamoDBAttributes.QUESTION_ID.value]
-    dest_answer = await event.client.send_message(
-        entity=int(user_id),
-        message=answer,
-        reply_to=int(question_id),
-    )
-    question[DynamoDBAttributes.QUESTION_STATUS.value] = (
-        DynamoDBGSI1QuestionStatusValues.ANSWERED.value
-    )
-    question[DynamoDBKeySchema.GSI1_PK.value] = (
-        DynamoDBFormatter.prefix_question_status_gsi1_pk(
-            status=DynamoDBGSI1QuestionStatusValues.ANSWERED.value
+    The steps run as a dependency graph: once the reply is found to answer a
+    question and is claimed, the replied message text and sender profile
+    lookups overlap the delivery to the asker, so other group replies skip
+    them; the status edit follows the text lookup, and both writes run once
+    the answer is delivered.
+
+    With `leases`, every replica gets the reply, and only the one claiming it
+    delivers and stores it.
+    """
+    dest_chat_id = event.chat_id
+    dest_question_message_id = answer.reply_to_msg_id
+
+    async def find_question(_) -> dict:
+        question = await _get_replied_question(
+            dest_chat_id=dest_chat_id,  # type: ignore
+            dest_question_message_id=dest_question_message_id,  # type: ignore
+            dynamodb_crud_manager=dynamodb_crud_manager,
+            routing_index=routing_index,
         )
-    )
+        if question is None:
+            raise SkipStage
+        return question
 
-    sender = await answer.get_sender() or SimpleNamespace(
-        username="مخفي", first_name="مخفي", last_name=""
-    )
+    async def get_dest_question_text(_) -> str | None:
+        return await dest_message_cache.get_text(
+            dest_chat_id, dest_question_message_id, event.get_reply_message  # type: ignore
+        )
+
+    async def get_sender(_):
+        return await profile_cache.get_profile(
+            answer.sender_id, answer.get_sender
+        ) or SimpleNamespace(username="مخفي", first_name="مخفي", last_name="")
+
+    async def claim(results: dict):
+        if leases is None:
+            return
+        claimed = await leases.claim_answer(
+            results["question"][DynamoDBKeySchema.PK.value],
+            answer.chat_id,  # type: ignore
+            answer.id,
+        )
+        if not claimed:
+            raise SkipStage
+
+    async def deliver_answer(results: dict) -> Message:
+        question = results["question"]
+        user_id = question[DynamoDBAttributes.USER_ID.value]
+        question_id = question[DynamoDBAttributes.QUESTION_ID.value]
+        return await scheduler.send(
+            int(user_id),
+            event.client.send_message,
+            entity=int(user_id),
+            message=answer,
+            reply_to=int(question_id),
+            priority=SendPriority.FAN_OUT,
+        )
+
+    async def mark_status(results: dict):
+        dest_question_text = results["dest_question_text"]
+        if dest_question_text is None:
+            return
+        dest_question_text = _mark_answered_text(dest_question_text)
+        dest_message_cache.remember(
+            dest_chat_id, dest_question_message_id, dest_question_text  # type: ignore
+        )
+        scheduler.post(
+            int(dest_chat_id),  # type: ignore
+            event.client.edit_message,
+            entity=int(dest_chat_id),  # type: ignore
+            message=int(dest_question_message_id),  # type: ignore
+            text=dest_question_text,
+            priority=SendPriority.FAN_OUT,
+        )
 
-    answer_data = {
+    async def store_answer(results: dict):
+        answer_data = _build_answer_data(
+            answer=answer, dest_answer=results["deliver"], sender=results["sender"]
+        )
+        await dynamodb_crud_manager.put_item(
+            item=_build_answer_item(question=results["question"], answer_data=answer_data)
+        )
+
+    async def mark_answered(results: dict):
+        await _mark_question_answered(
+            question=results["question"], dynamodb_crud_manager=dynamodb_crud_manager
+        )
+
+    graph = StageGraph("handle_reply", logger=_LOGGER)
+    graph.add("question", find_question)
+    graph.add("claim", claim, "question")
+    graph.add("dest_question_text", get_dest_question_text, "claim")
+    graph.add("sender", get_sender, "claim")
+    graph.add("deliver", deliver_answer, "claim")
+    graph.add("mark_status", mark_status, "claim", "dest_question_text")
+    graph.add("store_answer", store_answer, "deliver", "sender")
+    graph.add("mark_answered", mark_answered, "deliver")
+    with metrics.track_handler("reply"), tracer.trace(
+        "reply", chat_id=dest_chat_id, message_id=dest_question_message_id
+    ):
+        await graph.run()
+
+
+def _build_answer_data(answer: Message, dest_answer: Message, sender) -> dict:
+    """Builds the answer's attributes from the source and delivered messages."""
+    return {
         "Text": answer.text,
         "SrcMsgId": answer.id,
         "DestMsgId": dest_answer.id,
@@ -194,20 +282,77 @@ async def handle_reply(
         "LastName": sender.last_name,  # type: ignore
         "TopicId": answer.reply_to.reply_to_top_id,  # type: ignore
     }
-    if question.get(DynamoDBAttributes.ANSWERS.value) is None:
-        question[DynamoDBAttributes.ANSWERS.value] = [answer_data]
-    else:
-        question[DynamoDBAttributes.ANSWERS.value].append(answer_data)
 
+
+def _mark_answered_text(dest_question_message_text: str) -> str:
+    """Returns the destination question text with one more answered mark."""
     answered_value = DynamoDBGSI1QuestionStatusValues.ANSWERED.value
     non_answered_value = DynamoDBGSI1QuestionStatusValues.NON_ANSWERED.value
-    if answered_value in dest_question_message.text:  # type: ignore
-        dest_question_message_text = dest_question_message.text.replace(answered_value, answered_value * 2, 1)  # type: ignore
-    else:
-        dest_question_message_text = dest_question_message.text.replace(non_answered_value, answered_value)  # type: ignore
-    await event.client.edit_message(
-        entity=int(dest_chat_id),  # type: ignore
-        message=int(dest_question_message_id),
-        text=dest_question_message_text,
+    if answered_value in dest_question_message_text:
+        return dest_question_message_text.replace(answered_value, answered_value * 2, 1)
+    return dest_question_message_text.replace(non_answered_value, answered_value)
+
+
+async def _get_replied_question(
+    dest_chat_id: int,
+    dest_question_message_id: int,
+    dynamodb_crud_manager: Storage,
+    routing_index: ReplyRoutingIndex,
+) -> dict | None:
+    """Gets the question a destination message carries, from the index or GSI2."""
+    question = routing_index.get(dest_chat_id, dest_question_message_id)
+    if question is not None:
+        return question
+
+    source_chat_gsi1_pk = DynamoDBFormatter.prefix_dest_chat_gsi2_pk(
+        dest_chat_id=str(dest_chat_id),
+    )
+    dest_question_message_gsi2_pk = DynamoDBFormatter.prefix_dest_message_gsi2_sk(
+        dest_message_id=str(dest_question_message_id),
+    )
+
+    items = await dynamodb_crud_manager.get_items_from_index(
+        DynamoDBKeySchema.INDEX_GSI2_PK_GSI2_SK.value,
+        pk=source_chat_gsi1_pk,
+        sk=dest_question_message_gsi2_pk,
+    )
+    if not items:
+        return None
+
+    routing_index.put(dest_chat_id, dest_question_message_id, items[0])
+    return items[0]
+
+
+def _build_answer_item(question: dict, answer_data: dict) -> dict:
+    """Builds the answer item, stored under the question's partition."""
+    question_sk = question[DynamoDBKeySchema.SK.value]
+    question_ulid = DynamoDBFormatter.remove_prefix_question_sk(question_sk)
+    return {
+        DynamoDBKeySchema.PK.value: question[DynamoDBKeySchema.PK.value],
+        DynamoDBKeySchema.SK.value: DynamoDBFormatter.prefix_question_answer_sk(
+            answer_id=f"{question_ulid}#{answer_data['DestMsgId']}"
+        ),
+        DynamoDBKeySchema.GSI1_PK.value: DynamoDBFormatter.prefix_answer_dest_msg_id_gsi1_pk(
+            dest_message_id=str(answer_data["DestMsgId"])
+        ),
+        DynamoDBKeySchema.GSI1_SK.value: question[DynamoDBKeySchema.PK.value],
+        DynamoDBAttributes.QUESTION_SK.value: question_sk,
+        **answer_data,
+    }
+
+
+async def _mark_question_answered(
+    question: dict, dynamodb_crud_manager: Storage
+):
+    """Marks the question as answered and counts the answer atomically."""
+    await dynamodb_crud_manager.update_attributes(
+        pk=question[DynamoDBKeySchema.PK.value],
+        sk=question[DynamoDBKeySchema.SK.value],
+        attributes={
+            DynamoDBAttributes.QUESTION_STATUS.value: DynamoDBGSI1QuestionStatusValues.ANSWERED.value,
+            DynamoDBKeySchema.GSI1_PK.value: DynamoDBFormatter.prefix_question_status_gsi1_pk(
+                status=DynamoDBGSI1QuestionStatusValues.ANSWERED.value
+            ),
+        },
+        add={DynamoDBAttributes.ANSWER_COUNT.value: 1},
     )
-    await dynamodb_crud_manager.put_item(item=question)
\ No newline at end of file
@@ -6,26 +6,32 @@ from functools import partial
 from telethon import events
 
 from bot.conversation_flow import ConversationFlow
-from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.metrics import metrics
+from bot.services.send_scheduler import SendScheduler, send_scheduler
+from bot.services.storage import Storage
+from bot.services.tracing import tracer
 
 
 def initialize_start_handler(
     conversation_flow: Type[ConversationFlow],
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
+    scheduler: SendScheduler = send_scheduler,
 ) -> partial:
     """Initializes the start handler."""
     handler = partial(
         handle_start_command,
         conversation_flow=conversation_flow,
         dynamodb_crud_manager=dynamodb_crud_manager,
+        scheduler=scheduler,
     )
     return events.register(events.NewMessage(pattern="/start"))(handler)
 
 
 async def handle_start_command(
     event: events.NewMessage.Event,
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
     conversation_flow: Type[ConversationFlow],
+    scheduler: SendScheduler = send_scheduler,
 ):
     """Handles the /start command event. Sends a welcome message to the chat."""
     if not event.is_private:
@@ -33,11 +39,13 @@ async def handle_start_command(
 
     user_id = str(event.sender.id)
 
-    async with conversation_flow(
-        user_id=user_id,
-        dynamodb_crud_manager=dynamodb_crud_manager,
-        telethon_event=event,
-    ) as conversation:
-        await conversation.trigger_start()
+    with metrics.track_handler("start"), tracer.trace("start", user_id=user_id):
+        async with conversation_flow(
+            user_id=user_id,
+            dynamodb_crud_manager=dynamodb_crud_manager,
+            telethon_event=event,
+            scheduler=scheduler,
+        ) as conversation:
+            await conversation.trigger_start()
 
     raise events.StopPropagation
@@ -0,0 +1,131 @@
+"""../bot/services/consumed_capacity.py"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from typing import Callable
+
+from bot.services.metrics import BotMetrics, current_handler, metrics
+
+CapacityKey = tuple[str, str, str, str]
+
+
+def index_label(index_name: str | None) -> str:
+    """Shortens an index name to its label: `table`, `GSI1` or `GSI2`."""
+    if index_name is None:
+        return "table"
+    return index_name.split("_", 1)[0]
+
+
+class ConsumedCapacityTracker:
+    """Aggregates the capacity DynamoDB reports as consumed by the bot's calls.
+
+    Units are summed per operation, calling handler (see `current_handler`),
+    index (`table`, `GSI1`, `GSI2`) and capacity (`read`, `write`), counted in
+    the metrics, and logged as a summary every `summary_interval` seconds
+    while started, with the rates to compare against the provisioned
+    throughput.
+    """
+
+    def __init__(
+        self,
+        bot_metrics: BotMetrics = metrics,
+        summary_interval: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+        logger=None,
+    ):
+        self.bot_metrics = bot_metrics
+        self.summary_interval = summary_interval
+        self._clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self.totals: Counter[CapacityKey] = Counter()
+        self._window: Counter[CapacityKey] = Counter()
+        self._started = clock()
+        self._window_started = self._started
+        self._task: asyncio.Task | None = None
+
+    def record(self, operation: str, capacity: str, response: dict):
+        """Records the ConsumedCapacity of a response, per table and index."""
+        consumed = response.get("ConsumedCapacity")
+        if not consumed:
+            return
+        handler = current_handler.get()
+        if "Table" in consumed or "GlobalSecondaryIndexes" in consumed:
+            units = {
+                "table": consumed.get("Table", {}).get("CapacityUnits", 0.0),
+                **{
+                    index_label(index_name): index.get("CapacityUnits", 0.0)
+                    for index_name, index in consumed.get(
+                        "GlobalSecondaryIndexes", {}
+                    ).items()
+                },
+            }
+        else:
+            units = {"table": consumed.get("CapacityUnits", 0.0)}
+        for index, value in units.items():
+            if not value:
+                continue
+            key = (operation, handler, index, capacity)
+            self.totals[key] += value
+            self._window[key] += value
+            self.bot_metrics.dynamodb_capacity_units.child(*key).inc(value)
+
+    def summary(self, window: bool = False) -> dict:
+        """Summarizes the units since the start, or since the last window summary."""
+        units, started = self.totals, self._started
+        if window:
+            units, started = self._window, self._window_started
+        seconds = max(self._clock() - started, 1e-9)
+        read = sum(value for key, value in units.items() if key[3] == "read")
+        write = sum(value for key, value in units.items() if key[3] == "write")
+
+        def by(position: int) -> dict[str, dict[str, float]]:
+            grouped: dict[str, dict[str, float]] = {}
+            for key, value in sorted(units.items()):
+                entry = grouped.setdefault(key[position], {"read": 0.0, "write": 0.0})
+                entry[key[3]] += value
+            return grouped
+
+        return {
+            "seconds": round(seconds, 3),
+            "read_units": read,
+            "write_units": write,
+            "read_units_per_s": round(read / seconds, 3),
+            "write_units_per_s": round(write / seconds, 3),
+            "by_operation": by(0),
+            "by_handler": by(1),
+            "by_index": by(2),
+        }
+
+    def log_summary(self):
+        """Logs the units consumed since the last summary and starts a new window."""
+        if self._window:
+            self.logger.info(
+                "DynamoDB consumed capacity: %s", json.dumps(self.summary(window=True))
+            )
+        self._window = Counter()
+        self._window_started = self._clock()
+
+    def start(self):
+        """Starts logging a summary every `summary_interval` seconds."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stops the periodic summaries, logging the last one."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.log_summary()
+
+    async def _run(self):
+        """Logs a summary every `summary_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            self.log_summary()
+
+
+consumed_capacity = ConsumedCapacityTracker()
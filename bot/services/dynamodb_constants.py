@@ -18,7 +18,11 @@ class DynamoDBAttributes(Enum):
     QUESTION_ID = "QuestionId"
     QUESTION_STATUS = "QuestionStatus"
     ANSWERS = "Answers"
+    ANSWER_COUNT = "AnswerCount"
+    QUESTION_SK = "QuestionSK"
     ENTITY_TYPE = "EntityType"
+    LEASE_OWNER = "LeaseOwner"
+    LEASE_EXPIRES_AT = "LeaseExpiresAt"
 
 
 class DynamoDBGSI1QuestionStatusValues(Enum):
@@ -52,6 +56,7 @@ class DynamoDBKeySchemaPrefix(Enum):
     DEST_MESSAGE_GSI2_SK = "DEST_MESSAGE#"
     QUESTION_STATUS_GSI1 = "STATUS#"
     QUESTION_ANSWER_SK = "QUESTION_ANSWER#"
+    ANSWER_CLAIM_SK = "ANSWER_CLAIM#"
     ANSWER_DEST_MSG_ID_GSI1_PK = "ANSWER_DEST_MSG_ID#"
 
 
@@ -73,6 +78,11 @@ class DynamoDBFormatter:
         """Adds a prefix to the question's sort key."""
         return f"{DynamoDBKeySchemaPrefix.QUESTION_SK.value}{question_id}"
 
+    @staticmethod
+    def remove_prefix_question_sk(text: str) -> str:
+        """Removes the prefix from the question's sort key."""
+        return text.replace(DynamoDBKeySchemaPrefix.QUESTION_SK.value, "", 1)
+
     @staticmethod
     def prefix_dest_chat_gsi2_pk(dest_chat_id: str) -> str:
         """Adds a prefix to the destination chat's GSI2 PK."""
@@ -98,6 +108,11 @@ class DynamoDBFormatter:
         """Adds a prefix to the question's answer sort key."""
         return f"{DynamoDBKeySchemaPrefix.QUESTION_ANSWER_SK.value}{answer_id}"
 
+    @staticmethod
+    def prefix_answer_claim_sk(src_chat_id: str, src_msg_id: str) -> str:
+        """Adds a prefix to the sort key of the claim on a source answer message."""
+        return f"{DynamoDBKeySchemaPrefix.ANSWER_CLAIM_SK.value}{src_chat_id}#{src_msg_id}"
+
     @staticmethod
     def prefix_answer_dest_msg_id_gsi1_pk(dest_message_id: str) -> str:
         """Adds a prefix to the answer's destination message ID GSI1 PK."""
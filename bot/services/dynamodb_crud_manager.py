@@ -1,17 +1,48 @@
 """../bot/services/dynamodb.py"""
 
-from boto3.dynamodb.conditions import Key
+from typing import TYPE_CHECKING, Any, AsyncIterator
 
+from botocore.exceptions import ClientError
+
+from bot.services.consumed_capacity import ConsumedCapacityTracker, consumed_capacity
 from bot.services.dynamodb_constants import DynamoDBKeySchema
-from clients.dynamodb_client import DynamoDBClient
+from bot.services.dynamodb_expressions import AttributePath, UpdateExpressionBuilder
+from bot.services.dynamodb_query import (
+    QueryPage,
+    SortKeyCondition,
+    decode_cursor,
+    encode_cursor,
+    index_key_names,
+)
+from bot.services.metrics import metrics
+from bot.services.tracing import tracer
+from clients.dynamodb_client import DynamoDBResource, conditions
+
+if TYPE_CHECKING:
+    from boto3.dynamodb.conditions import ConditionBase
+
+
+class ConditionalCheckFailedError(Exception):
+    """Raised when the condition of a conditional write is not met."""
 
 
 class DynamoDBCrudManager:
-    """A wrapper for interacting with DynamoDB using aioboto3."""
+    """A wrapper for interacting with DynamoDB using aioboto3.
 
-    def __init__(self, dynamodb_client: DynamoDBClient, table_name: str):
+    It implements the Storage protocol; with an InMemoryDynamoDBClient it runs
+    against an in-process table instead of AWS. Every call asks for the
+    consumed capacity per index and records it in `capacity_tracker`.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client: DynamoDBResource,
+        table_name: str,
+        capacity_tracker: ConsumedCapacityTracker = consumed_capacity,
+    ):
         self.table_name = table_name
         self.dynamodb_client = dynamodb_client
+        self.capacity_tracker = capacity_tracker
         self._table = None
 
     @property
@@ -21,18 +52,64 @@ class DynamoDBCrudManager:
             self._table = await self.dynamodb_client.Table(self.table_name)
         return self._table
 
-    async def get_item(self, pk: str, sk: str | None = None) -> dict:
+    @metrics.timed_dynamodb("get_item")
+    @tracer.traced("dynamodb")
+    async def get_item(
+        self, pk: str, sk: str | None = None, consistent: bool = False
+    ) -> dict:
         """Retrieves the user from the DynamoDB table asynchronously."""
         table = await self.table
         response = await table.get_item(
-            Key={DynamoDBKeySchema.PK.value: pk, DynamoDBKeySchema.SK.value: sk}
+            Key={DynamoDBKeySchema.PK.value: pk, DynamoDBKeySchema.SK.value: sk},
+            ConsistentRead=consistent,
+            ReturnConsumedCapacity="INDEXES",
         )
+        self.capacity_tracker.record("get_item", "read", response)
         return response.get("Item", {})
 
-    async def put_item(self, item: dict):
-        """Puts an item in the DynamoDB table asynchronously."""
+    @metrics.timed_dynamodb("put_item")
+    @tracer.traced("dynamodb")
+    async def put_item(self, item: dict, condition: "ConditionBase | None" = None):
+        """Puts an item in the DynamoDB table asynchronously.
+
+        With a `condition`, raises ConditionalCheckFailedError if it is not met.
+        """
         table = await self.table
-        await table.put_item(Item=item)
+        kwargs = {} if condition is None else {"ConditionExpression": condition}
+        try:
+            response = await table.put_item(
+                Item=item, ReturnConsumedCapacity="INDEXES", **kwargs
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise ConditionalCheckFailedError(str(error)) from error
+            raise
+        self.capacity_tracker.record("put_item", "write", response)
+
+    @metrics.timed_dynamodb("get_attributes")
+    @tracer.traced("dynamodb")
+    async def get_attributes(
+        self,
+        pk: str,
+        sk: str,
+        names: list[str],
+        consistent: bool = False,
+    ) -> dict:
+        """Retrieves only the given attributes of an item asynchronously."""
+        assert names, "At least one attribute name must be given."
+        table = await self.table
+        expression_attribute_names = {
+            f"#p{index}": name for index, name in enumerate(names)
+        }
+        response = await table.get_item(
+            Key={DynamoDBKeySchema.PK.value: pk, DynamoDBKeySchema.SK.value: sk},
+            ProjectionExpression=", ".join(expression_attribute_names),
+            ExpressionAttributeNames=expression_attribute_names,
+            ConsistentRead=consistent,
+            ReturnConsumedCapacity="INDEXES",
+        )
+        self.capacity_tracker.record("get_attributes", "read", response)
+        return response.get("Item", {})
 
     async def get_attribute(
         self,
@@ -41,34 +118,87 @@ class DynamoDBCrudManager:
         sk: str,
     ) -> str | dict | list | None:
         """Retrieves an attribute from the DynamoDB table asynchronously."""
-        item = await self.get_item(pk, sk)
+        item = await self.get_attributes(pk, sk, names=[attribute])
         return item.get(attribute)
 
+    @metrics.timed_dynamodb("update_attributes")
+    @tracer.traced("dynamodb")
     async def update_attributes(
         self,
-        attributes: dict,
+        attributes: dict[AttributePath, Any],
         pk: str,
         sk: str,
+        add: dict[AttributePath, Any] | None = None,
+        append: dict[AttributePath, list] | None = None,
+        remove: list[AttributePath] | None = None,
+        condition: "ConditionBase | None" = None,
     ):
-        """Updates an attributes in the DynamoDB table asynchronously."""
-        table = await self.table
-        update_expression = "SET " + ", ".join(
-            [f"{attr} = :{attr}" for attr in attributes]
-        )
-        expression_attribute_values = {
-            f":{attr}": value for attr, value in attributes.items()
-        }
-        response = await table.update_item(
-            Key={
-                DynamoDBKeySchema.PK.value: pk,
-                DynamoDBKeySchema.SK.value: sk,
-            },
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_attribute_values,
-            ReturnValues="UPDATED_NEW",
+        """Updates an attributes in the DynamoDB table asynchronously.
+
+        Attribute paths are either top-level names or tuples of names for nested
+        map entries. `add` increments numbers or adds to sets, `append` extends
+        lists (creating them if missing), and `condition` guards the write.
+        """
+        builder = UpdateExpressionBuilder()
+        for path, value in attributes.items():
+            builder.set(path, value)
+        for path, value in (add or {}).items():
+            builder.add(path, value)
+        for path, values in (append or {}).items():
+            builder.append(path, values)
+        for path in remove or []:
+            builder.remove(path)
+        response = await self._update_item(
+            "update_attributes", pk=pk, sk=sk, condition=condition, **builder.build()
         )
         return response.get("Attributes", {})
 
+    async def set_map_entry(
+        self,
+        attribute: str,
+        key: str,
+        value: Any,
+        pk: str,
+        sk: str,
+    ):
+        """Sets a single entry of a map attribute, creating the map if it is missing."""
+        return await self.set_map_entries(attribute, {key: value}, pk, sk)
+
+    async def set_map_entries(
+        self,
+        attribute: str,
+        entries: dict[str, Any],
+        pk: str,
+        sk: str,
+        condition: "ConditionBase | None" = None,
+    ):
+        """Sets entries of a map attribute, creating the map if it is missing.
+
+        With a `condition`, every write is guarded by it.
+        """
+        nested = {(attribute, key): value for key, value in entries.items()}
+        try:
+            return await self.update_attributes(nested, pk, sk, condition=condition)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ValidationException":
+                raise
+        missing = conditions.Attr(attribute).not_exists()
+        try:
+            return await self.update_attributes(
+                {attribute: dict(entries)},
+                pk,
+                sk,
+                condition=missing if condition is None else missing & condition,
+            )
+        except ConditionalCheckFailedError:
+            # Another writer created the map in the meantime, or the condition failed.
+            return await self.update_attributes(nested, pk, sk, condition=condition)
+
+    async def flush(self, pk: str | None = None, sk: str | None = None):
+        """Writes buffered changes. Writes are not buffered here, so there are none."""
+
+    @metrics.timed_dynamodb("delete_attributes")
+    @tracer.traced("dynamodb")
     async def delete_attributes(
         self,
         attributes: list[str],
@@ -76,25 +206,156 @@ class DynamoDBCrudManager:
         sk: str,
     ):
         """Deletes multiple attributes from the DynamoDB table asynchronously."""
-        table = await self.table
-        remove_expression = ", ".join(attributes)
-        return await table.update_item(
-            Key={
-                DynamoDBKeySchema.PK.value: pk,
-                DynamoDBKeySchema.SK.value: sk,
-            },
-            UpdateExpression=f"REMOVE {remove_expression}",
-            ReturnValues="UPDATED_NEW",
+        builder = UpdateExpressionBuilder()
+        for attribute in attributes:
+            builder.remove(attribute)
+        return await self._update_item(
+            "delete_attributes", pk=pk, sk=sk, **builder.build()
         )
 
-    async def get_items_from_index(self, index_name, pk, sk=None):
-        """Retrieves an item from a DynamoDB index asynchronously."""
+    async def _update_item(
+        self,
+        operation: str,
+        pk: str,
+        sk: str,
+        condition: "ConditionBase | None" = None,
+        **kwargs,
+    ) -> dict:
+        """Runs an update_item call, raising ConditionalCheckFailedError on a failed condition."""
         table = await self.table
-        key_condition = Key(DynamoDBKeySchema.GSI2_PK.value).eq(pk)
+        if condition is not None:
+            kwargs["ConditionExpression"] = condition
+        try:
+            response = await table.update_item(
+                Key={
+                    DynamoDBKeySchema.PK.value: pk,
+                    DynamoDBKeySchema.SK.value: sk,
+                },
+                ReturnValues="UPDATED_NEW",
+                ReturnConsumedCapacity="INDEXES",
+                **kwargs,
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise ConditionalCheckFailedError(str(error)) from error
+            raise
+        self.capacity_tracker.record(operation, "write", response)
+        return response
+
+    async def get_items_from_index(self, index_name, pk, sk=None):
+        """Retrieves the items of an index partition, optionally with a sort key."""
+        return [
+            item
+            async for item in self.query(
+                pk, sk, index_name=index_name, operation="get_items_from_index"
+            )
+        ]
+
+    async def query(
+        self,
+        pk: str,
+        sk: "str | SortKeyCondition | None" = None,
+        index_name: str | None = None,
+        limit: int | None = None,
+        page_size: int | None = None,
+        attributes: list[str] | None = None,
+        reverse: bool = False,
+        cursor: str | None = None,
+        consistent: bool = False,
+        operation: str = "query",
+    ) -> AsyncIterator[dict]:
+        """Yields the items of a table or index partition; see `query_pages`."""
+        async for page in self.query_pages(
+            pk,
+            sk,
+            index_name=index_name,
+            limit=limit,
+            page_size=page_size,
+            attributes=attributes,
+            reverse=reverse,
+            cursor=cursor,
+            consistent=consistent,
+            operation=operation,
+        ):
+            for item in page.items:
+                yield item
+
+    async def query_pages(
+        self,
+        pk: str,
+        sk: "str | SortKeyCondition | None" = None,
+        index_name: str | None = None,
+        limit: int | None = None,
+        page_size: int | None = None,
+        attributes: list[str] | None = None,
+        reverse: bool = False,
+        cursor: str | None = None,
+        consistent: bool = False,
+        operation: str = "query",
+    ) -> AsyncIterator[QueryPage]:
+        """Queries a partition of the table or of an index, one page at a time.
+
+        The key names come from the index name. `sk` is a sort key value or a
+        SortKeyCondition, such as `SortKeyCondition.begins_with("QUESTION#")`.
+        At most `limit` items are returned, in pages of up to `page_size` items
+        (1 MB at most, as DynamoDB pages them); each page is only fetched when
+        the caller asks for it, so stopping early saves the rest. Each page
+        carries the cursor to resume after it, None after the last one;
+        `attributes` projects the items and `reverse` returns them in
+        descending sort key order.
+        """
+        partition_key, sort_key = index_key_names(index_name)
+        kwargs: dict[str, Any] = {
+            "KeyConditionExpression": conditions.Key(partition_key).eq(pk),
+            "ScanIndexForward": not reverse,
+        }
         if sk is not None:
-            key_condition = key_condition & Key(DynamoDBKeySchema.GSI2_SK.value).eq(sk)
+            if not isinstance(sk, SortKeyCondition):
+                sk = SortKeyCondition.eq(sk)
+            kwargs["KeyConditionExpression"] &= sk.bind(sort_key)
+        if index_name is not None:
+            kwargs["IndexName"] = index_name
+        if consistent:
+            kwargs["ConsistentRead"] = True
+        if attributes:
+            names = {f"#p{index}": name for index, name in enumerate(attributes)}
+            kwargs["ProjectionExpression"] = ", ".join(names)
+            kwargs["ExpressionAttributeNames"] = names
+        start_key = decode_cursor(cursor)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_limit = page_size
+            if remaining is not None:
+                page_limit = min(page_size or remaining, remaining)
+            response = await self._query_page(operation, start_key, page_limit, kwargs)
+            items = response.get("Items", [])
+            start_key = response.get("LastEvaluatedKey")
+            if remaining is not None:
+                remaining -= len(items)
+            yield QueryPage(items, encode_cursor(start_key))
+            if start_key is None:
+                return
 
-        response = await table.query(
-            IndexName=index_name, KeyConditionExpression=key_condition
-        )
-        return response.get("Items", [])
+    async def _query_page(
+        self,
+        operation: str,
+        start_key: dict | None,
+        limit: int | None,
+        kwargs: dict[str, Any],
+    ) -> dict:
+        """Runs one query call, from the start key and up to the limit if given.
+
+        It is timed and traced under `operation`, once per page.
+        """
+        table = await self.table
+        page_kwargs = dict(kwargs)
+        if start_key is not None:
+            page_kwargs["ExclusiveStartKey"] = start_key
+        if limit is not None:
+            page_kwargs["Limit"] = limit
+        with metrics.time_dynamodb(operation), tracer.span(operation, "dynamodb"):
+            response = await table.query(
+                ReturnConsumedCapacity="INDEXES", **page_kwargs
+            )
+        self.capacity_tracker.record(operation, "read", response)
+        return response
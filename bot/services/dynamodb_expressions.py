@@ -0,0 +1,85 @@
+"""../bot/services/dynamodb_expressions.py"""
+
+from typing import Any
+
+AttributePath = str | tuple[str, ...]
+
+
+class UpdateExpressionBuilder:
+    """Builds a DynamoDB update expression with placeholder names and values."""
+
+    def __init__(self):
+        self._names: dict[str, str] = {}
+        self._name_placeholders: dict[str, str] = {}
+        self._values: dict[str, Any] = {}
+        self._clauses: dict[str, list[str]] = {"SET": [], "REMOVE": [], "ADD": []}
+
+    def set(self, path: AttributePath, value: Any) -> "UpdateExpressionBuilder":
+        """Sets the attribute at the given path."""
+        self._clauses["SET"].append(f"{self._path(path)} = {self._value(value)}")
+        return self
+
+    def set_if_not_exists(
+        self, path: AttributePath, value: Any
+    ) -> "UpdateExpressionBuilder":
+        """Sets the attribute at the given path only if it does not exist yet."""
+        placeholder = self._path(path)
+        self._clauses["SET"].append(
+            f"{placeholder} = if_not_exists({placeholder}, {self._value(value)})"
+        )
+        return self
+
+    def append(self, path: AttributePath, values: list) -> "UpdateExpressionBuilder":
+        """Appends values to the list at the given path, creating it if missing."""
+        placeholder = self._path(path)
+        self._clauses["SET"].append(
+            f"{placeholder} = list_append("
+            f"if_not_exists({placeholder}, {self._value([])}), {self._value(values)})"
+        )
+        return self
+
+    def add(self, path: AttributePath, value: Any) -> "UpdateExpressionBuilder":
+        """Adds a number to, or a set into, the attribute at the given path."""
+        self._clauses["ADD"].append(f"{self._path(path)} {self._value(value)}")
+        return self
+
+    def remove(self, path: AttributePath) -> "UpdateExpressionBuilder":
+        """Removes the attribute at the given path."""
+        self._clauses["REMOVE"].append(self._path(path))
+        return self
+
+    def build(self) -> dict[str, Any]:
+        """Returns the update_item keyword arguments for the built expression."""
+        update_expression = " ".join(
+            f"{action} {', '.join(clauses)}"
+            for action, clauses in self._clauses.items()
+            if clauses
+        )
+        assert update_expression, "The update expression is empty."
+        kwargs: dict[str, Any] = {
+            "UpdateExpression": update_expression,
+            "ExpressionAttributeNames": dict(self._names),
+        }
+        if self._values:
+            kwargs["ExpressionAttributeValues"] = dict(self._values)
+        return kwargs
+
+    def _path(self, path: AttributePath) -> str:
+        """Returns the placeholder document path for an attribute path."""
+        parts = (path,) if isinstance(path, str) else path
+        return ".".join(self._name(part) for part in parts)
+
+    def _name(self, name: str) -> str:
+        """Returns the placeholder for an attribute name, reusing existing ones."""
+        placeholder = self._name_placeholders.get(name)
+        if placeholder is None:
+            placeholder = f"#a{len(self._names)}"
+            self._names[placeholder] = name
+            self._name_placeholders[name] = placeholder
+        return placeholder
+
+    def _value(self, value: Any) -> str:
+        """Returns a new placeholder for an attribute value."""
+        placeholder = f":u{len(self._values)}"
+        self._values[placeholder] = value
+        return placeholder
@@ -0,0 +1,130 @@
+"""../bot/services/dynamodb_query.py"""
+
+import base64
+import json
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any
+
+from bot.services.dynamodb_constants import DynamoDBKeySchema
+from clients.dynamodb_client import conditions
+
+if TYPE_CHECKING:
+    from boto3.dynamodb.conditions import ConditionBase
+
+INDEX_SUFFIX = "-index"
+
+
+def index_key_names(index_name: str | None) -> tuple[str, str]:
+    """Returns the partition and sort key names of the table or of an index.
+
+    Index names follow the table's `<partition key>-<sort key>-index` scheme,
+    such as `GSI1_PK-GSI1_SK-index`.
+    """
+    if index_name is None:
+        return DynamoDBKeySchema.PK.value, DynamoDBKeySchema.SK.value
+    names = index_name.removesuffix(INDEX_SUFFIX).split("-")
+    if not index_name.endswith(INDEX_SUFFIX) or len(names) != 2 or not all(names):
+        raise ValueError(
+            f"Index {index_name!r} is not named <partition key>-<sort key>-index."
+        )
+    return names[0], names[1]
+
+
+class SortKeyCondition:
+    """A condition on the sort key of a query, bound to the key's name by the query."""
+
+    def __init__(self, operator: str, *values: Any):
+        self.operator = operator
+        self.values = values
+
+    @classmethod
+    def eq(cls, value: Any) -> "SortKeyCondition":
+        """The sort key is equal to the value."""
+        return cls("eq", value)
+
+    @classmethod
+    def begins_with(cls, prefix: str) -> "SortKeyCondition":
+        """The sort key starts with the prefix."""
+        return cls("begins_with", prefix)
+
+    @classmethod
+    def between(cls, low: Any, high: Any) -> "SortKeyCondition":
+        """The sort key is between the values, both included."""
+        return cls("between", low, high)
+
+    @classmethod
+    def lt(cls, value: Any) -> "SortKeyCondition":
+        """The sort key is less than the value."""
+        return cls("lt", value)
+
+    @classmethod
+    def lte(cls, value: Any) -> "SortKeyCondition":
+        """The sort key is less than or equal to the value."""
+        return cls("lte", value)
+
+    @classmethod
+    def gt(cls, value: Any) -> "SortKeyCondition":
+        """The sort key is greater than the value."""
+        return cls("gt", value)
+
+    @classmethod
+    def gte(cls, value: Any) -> "SortKeyCondition":
+        """The sort key is greater than or equal to the value."""
+        return cls("gte", value)
+
+    def bind(self, name: str) -> "ConditionBase":
+        """Returns the key condition on the named sort key."""
+        return getattr(conditions.Key(name), self.operator)(*self.values)
+
+    def __repr__(self) -> str:
+        return f"SortKeyCondition.{self.operator}{self.values!r}"
+
+
+def _decimal_default(value: Any) -> Any:
+    """Encodes the Decimal numbers boto3 returns, as strings to keep them exact."""
+    if isinstance(value, Decimal):
+        return {"N": str(value)}
+    raise TypeError(f"Cannot encode {value!r} in a cursor.")
+
+
+def _decimal_hook(value: dict) -> Any:
+    """Decodes the numbers `_decimal_default` encoded."""
+    if value.keys() == {"N"}:
+        return Decimal(value["N"])
+    return value
+
+
+def encode_cursor(last_evaluated_key: dict | None) -> str | None:
+    """Encodes a LastEvaluatedKey as an opaque cursor string, None at the end."""
+    if not last_evaluated_key:
+        return None
+    data = json.dumps(
+        last_evaluated_key, default=_decimal_default, separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str | None) -> dict | None:
+    """Decodes a cursor back into the ExclusiveStartKey to resume from."""
+    if cursor is None:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor), object_hook=_decimal_hook)
+    except (ValueError, TypeError) as error:
+        raise ValueError(f"Invalid query cursor {cursor!r}.") from error
+
+
+class QueryPage:
+    """One page of query results, with the cursor to resume after it."""
+
+    __slots__ = ("items", "cursor")
+
+    def __init__(self, items: list[dict], cursor: str | None):
+        self.items = items
+        self.cursor = cursor
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __repr__(self) -> str:
+        return f"QueryPage({len(self.items)} items, cursor={self.cursor!r})"
@@ -0,0 +1,551 @@
+"""../bot/services/metrics.py"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable
+
+from telethon.events import StopPropagation
+
+# Seconds; the handlers and DynamoDB calls are mostly in the milliseconds.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Seconds; a call waits in the send queue for up to a FloodWait of minutes.
+SEND_WAIT_BUCKETS = LATENCY_BUCKETS + (30.0, 60.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# The state of each child of each metric, by metric name and label values.
+Snapshot = dict[str, dict[tuple[str, ...], Any]]
+
+# The handler an update is being processed by; tasks it starts inherit it.
+current_handler: ContextVar[str] = ContextVar("current_handler", default="background")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra="") -> str:
+    """Formats a label set in the Prometheus text format."""
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Formats a sample value, writing whole numbers without a fraction."""
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class CounterChild:
+    """The value of a counter for one label set."""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        """Increments the counter."""
+        self.value += amount
+
+
+class GaugeChild:
+    """The value of a gauge for one label set."""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        """Increments the gauge."""
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        """Decrements the gauge."""
+        self.value -= amount
+
+    def set(self, value: float):
+        """Sets the gauge."""
+        self.value = value
+
+
+class HistogramChild:
+    """The bucket counts and sum of a histogram for one label set."""
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Records a value in the first bucket whose bound is at least the value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """A metric family with a child per label set.
+
+    Children are created on first use and kept, so the hot path can look one
+    up once and record into it without building label strings.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._children: dict[tuple[str, ...], Any] = {}
+
+    def child(self, *values: str) -> Any:
+        """Gets the child of a label set, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            assert len(values) == len(self.labels), f"{self.name} takes {self.labels}."
+            child = self._children[values] = self._new_child()
+        return child
+
+    def snapshot(self) -> dict[tuple[str, ...], Any]:
+        """The state of every child, as plain data another process can add up."""
+        return {values: self._state(child) for values, child in self._children.items()}
+
+    def add_states(self, first: Any, second: Any) -> Any:
+        """Adds up two states of a child, as recorded by two processes."""
+        return first + second
+
+    def render(self, states: dict[tuple[str, ...], Any] | None = None) -> list[str]:
+        """Renders the family, or the given states, in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        if states is None:
+            states = self.snapshot()
+        for values, state in sorted(states.items()):
+            lines.extend(self._render_state(values, state))
+        return lines
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def _state(self, child) -> Any:
+        return child.value
+
+    def _render_state(self, values: tuple[str, ...], state) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, values)} "
+            f"{_format_value(state)}"
+        ]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+
+    kind = "gauge"
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+
+class Histogram(Metric):
+    """Observations counted in cumulative buckets, with their sum."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def add_states(self, first: Any, second: Any) -> Any:
+        counts = tuple(a + b for a, b in zip(first[0], second[0]))
+        return counts, first[1] + second[1]
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def _state(self, child) -> Any:
+        return tuple(child.counts), child.sum
+
+    def _render_state(self, values: tuple[str, ...], state) -> list[str]:
+        counts, total = state
+        lines = []
+        cumulative = 0
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            labels = _format_labels(self.labels, values, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metric families exposed by the scrape endpoint."""
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        """Registers a counter."""
+        return self._register(Counter(name, documentation, tuple(labels)))
+
+    def gauge(self, name: str, documentation: str, labels=()) -> Gauge:
+        """Registers a gauge."""
+        return self._register(Gauge(name, documentation, tuple(labels)))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels=(),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Registers a histogram."""
+        return self._register(Histogram(name, documentation, tuple(labels), buckets))
+
+    def snapshot(self) -> Snapshot:
+        """The state of every metric, as plain data another process can add up."""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def combine(
+        self, snapshots: Iterable[Snapshot], kinds: tuple[str, ...] | None = None
+    ) -> Snapshot:
+        """Adds snapshots up child by child, keeping the metrics of the given kinds.
+
+        Metrics this registry does not know are left out.
+        """
+        combined: Snapshot = {}
+        for snapshot in snapshots:
+            for name, states in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or (kinds is not None and metric.kind not in kinds):
+                    continue
+                target = combined.setdefault(name, {})
+                for values, state in states.items():
+                    if values in target:
+                        state = metric.add_states(target[values], state)
+                    target[values] = state
+        return combined
+
+    def render(self, others: Iterable[Snapshot] = ()) -> str:
+        """Renders all families in the Prometheus text format.
+
+        The snapshots of other processes are added to this process' values.
+        """
+        combined = self.combine([self.snapshot(), *others])
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(combined.get(metric.name, {})))
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        assert metric.name not in self._metrics, f"{metric.name} is already registered."
+        self._metrics[metric.name] = metric
+        return metric
+
+
+class HandlerTimer:
+    """Tracks one handler call: in flight while running, then timed and counted."""
+
+    __slots__ = ("_handler", "_in_flight", "_latency", "_errors", "_started", "_token")
+
+    def __init__(
+        self,
+        handler: str,
+        in_flight: GaugeChild,
+        latency: HistogramChild,
+        errors: CounterChild,
+    ):
+        self._handler = handler
+        self._in_flight = in_flight
+        self._latency = latency
+        self._errors = errors
+        self._started = 0.0
+        self._token = None
+
+    def __enter__(self):
+        self._in_flight.value += 1
+        self._token = current_handler.set(self._handler)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._latency.observe(time.perf_counter() - self._started)
+        current_handler.reset(self._token)  # type: ignore
+        self._in_flight.value -= 1
+        if exc_type is not None and not issubclass(exc_type, StopPropagation):
+            self._errors.inc()
+        return False
+
+
+class BotMetrics:
+    """The bot's metrics: handlers, state transitions, DynamoDB and Telegram calls.
+
+    Recording is a few attribute updates on children looked up in a dict, so
+    it stays on under full load; label values come from a small fixed set
+    (handler and operation names, configured states, outcomes).
+    """
+
+    def __init__(self, registry: MetricsRegistry | None = None):
+        self.registry = registry or MetricsRegistry()
+        self.handler_seconds = self.registry.histogram(
+            "bot_handler_seconds", "Duration of update handlers.", ("handler",)
+        )
+        self.handler_errors = self.registry.counter(
+            "bot_handler_errors_total", "Update handlers that raised.", ("handler",)
+        )
+        self.handlers_in_flight = self.registry.gauge(
+            "bot_handlers_in_flight", "Update handlers running now.", ("handler",)
+        )
+        self.transition_seconds = self.registry.histogram(
+            "bot_transition_seconds",
+            "Duration of state transitions, from prepare_event to after_state_change.",
+            ("source", "dest"),
+        )
+        self.dynamodb_seconds = self.registry.histogram(
+            "bot_dynamodb_seconds",
+            "Duration of DynamoDBCrudManager operations.",
+            ("operation",),
+        )
+        self.dynamodb_errors = self.registry.counter(
+            "bot_dynamodb_errors_total",
+            "DynamoDBCrudManager operations that raised.",
+            ("operation",),
+        )
+        self.dynamodb_capacity_units = self.registry.counter(
+            "bot_dynamodb_consumed_capacity_units_total",
+            "Consumed DynamoDB capacity units, per calling handler and index.",
+            ("operation", "handler", "index", "capacity"),
+        )
+        self.telegram_seconds = self.registry.histogram(
+            "bot_telegram_seconds",
+            "Duration of outbound Telegram calls run by the send scheduler.",
+            ("method", "outcome"),
+        )
+        self.telegram_flood_waits = self.registry.counter(
+            "bot_telegram_flood_waits_total", "FloodWait and slow mode errors."
+        ).child()
+        self.telegram_flood_wait_seconds = self.registry.counter(
+            "bot_telegram_flood_wait_seconds_total",
+            "Seconds Telegram asked to wait in FloodWait and slow mode errors.",
+        ).child()
+        self.send_wait_seconds = self.registry.histogram(
+            "bot_send_wait_seconds",
+            "Seconds outbound Telegram calls waited in the send queue.",
+            buckets=SEND_WAIT_BUCKETS,
+        ).child()
+        self.send_queue_depth = self.registry.gauge(
+            "bot_send_queue_depth",
+            "Outbound Telegram calls in the send queue, including the running ones.",
+            ("priority",),
+        )
+        self.send_in_flight = self.registry.gauge(
+            "bot_send_in_flight", "Outbound Telegram calls running now."
+        )
+        self.send_chats_queued = self.registry.gauge(
+            "bot_send_chats_queued", "Chats with outbound Telegram calls queued."
+        )
+        self.send_chat_backlog_max = self.registry.gauge(
+            "bot_send_chat_backlog_max",
+            "Outbound Telegram calls queued in the chat with the most of them.",
+        )
+        self.send_blocked_chats = self.registry.gauge(
+            "bot_send_blocked_chats", "Chats blocked by a FloodWait or slow mode."
+        )
+        self.startup_seconds = self.registry.gauge(
+            "bot_startup_seconds",
+            "Seconds from the process start to the end of each startup phase.",
+            ("phase",),
+        )
+        self.lease_operations = self.registry.counter(
+            "bot_user_lease_operations_total",
+            "User lease claims, renewals and releases, by outcome.",
+            ("operation", "outcome"),
+        )
+        self.leases_held = self.registry.gauge(
+            "bot_user_leases_held", "User leases this replica holds."
+        ).child()
+        self.lease_skipped_updates = self.registry.counter(
+            "bot_user_lease_skipped_updates_total",
+            "Updates skipped because another replica holds the user's lease or the answer.",
+        ).child()
+        self._handler_children: dict[str, tuple] = {}
+        self._sources: list[Callable[[], Iterable[Snapshot]]] = []
+
+    def track_handler(self, handler: str) -> HandlerTimer:
+        """Returns a context manager timing one call of the handler."""
+        children = self._handler_children.get(handler)
+        if children is None:
+            children = self._handler_children[handler] = (
+                self.handlers_in_flight.child(handler),
+                self.handler_seconds.child(handler),
+                self.handler_errors.child(handler),
+            )
+        return HandlerTimer(handler, *children)
+
+    def observe_transition(self, source: str, dest: str, seconds: float):
+        """Records a completed state transition."""
+        self.transition_seconds.child(source, dest).observe(seconds)
+
+    def observe_telegram(self, method: str, outcome: str, seconds: float):
+        """Records an outbound Telegram call."""
+        self.telegram_seconds.child(method, outcome).observe(seconds)
+
+    def flood_wait(self, seconds: float):
+        """Records a FloodWait or slow mode error."""
+        self.telegram_flood_waits.inc()
+        self.telegram_flood_wait_seconds.inc(seconds)
+
+    def timed_dynamodb(self, operation: str) -> Callable:
+        """Decorates a coroutine method to time it as a DynamoDB operation."""
+        latency = self.dynamodb_seconds.child(operation)
+        errors = self.dynamodb_errors.child(operation)
+
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    latency.observe(time.perf_counter() - started)
+
+            return wrapper
+
+        return decorator
+
+    @contextlib.contextmanager
+    def time_dynamodb(self, operation: str):
+        """Times a block as a DynamoDB operation, for operations named at run time."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.dynamodb_errors.child(operation).inc()
+            raise
+        finally:
+            self.dynamodb_seconds.child(operation).observe(time.perf_counter() - started)
+
+    def add_source(self, source: Callable[[], Iterable[Snapshot]]):
+        """Adds the snapshots a source returns, such as the workers', to `render`."""
+        self._sources.append(source)
+
+    def remove_source(self, source: Callable[[], Iterable[Snapshot]]):
+        """Stops adding a source's snapshots."""
+        if source in self._sources:
+            self._sources.remove(source)
+
+    def render(self) -> str:
+        """Renders all metrics, with the sources', in the Prometheus text format."""
+        return self.registry.render(
+            snapshot for source in self._sources for snapshot in source()
+        )
+
+
+class MetricsServer:
+    """A minimal HTTP server answering `GET /metrics` with the metrics."""
+
+    def __init__(
+        self,
+        bot_metrics: BotMetrics,
+        host: str = "127.0.0.1",
+        port: int = 9100,
+        logger=None,
+    ):
+        self.bot_metrics = bot_metrics
+        self.host = host
+        self.port = port
+        self.logger = logger or logging.getLogger(__name__)
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        """Starts listening."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.logger.info(
+            "Serving metrics on http://%s:%s/metrics", self.host, self.port
+        )
+
+    async def close(self):
+        """Stops listening."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answers one request and closes the connection."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (
+                b"\r\n",
+                b"\n",
+                b"",
+            ):
+                pass
+            method, _, target = request_line.decode("latin-1").partition(" ")
+            path = target.split(" ", 1)[0].split("?", 1)[0]
+            if method == "GET" and path == "/metrics":
+                status, body = "200 OK", self.bot_metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as error:
+            self.logger.debug("Metrics request failed: %s", error)
+        finally:
+            writer.close()
+
+
+metrics = BotMetrics()
@@ -0,0 +1,288 @@
+"""../bot/services/remote_events.py"""
+
+import datetime
+from types import SimpleNamespace
+from typing import Any, Protocol
+
+from telethon import events
+
+CLIENT_REF = 0
+
+
+class RemoteCaller(Protocol):
+    """What remote objects call through: the worker's channel to its pool."""
+
+    client: "RemoteClient"
+
+    async def call(self, ref: int, name: str, args: tuple, kwargs: dict) -> Any:
+        """Calls a method of the object behind the reference, in the pool."""
+
+
+def _remote_method(name: str):
+    """Builds a method forwarding its call to the object in the pool."""
+
+    async def method(self, *args, **kwargs):
+        return await self.caller.call(self.ref, name, args, kwargs)
+
+    method.__name__ = name
+    return method
+
+
+def describe_sender(sender) -> tuple | None:
+    """Keeps the fields of a sender the handlers use."""
+    if sender is None:
+        return None
+    return (
+        sender.id,
+        getattr(sender, "username", None),
+        getattr(sender, "first_name", None) or getattr(sender, "title", None),
+        getattr(sender, "last_name", None),
+    )
+
+
+def remote_sender(description: tuple | None) -> SimpleNamespace | None:
+    """Rebuilds a described sender."""
+    if description is None:
+        return None
+    user_id, username, first_name, last_name = description
+    return SimpleNamespace(
+        id=user_id, username=username, first_name=first_name, last_name=last_name
+    )
+
+
+def describe_message(ref: int, message) -> dict:
+    """Describes a Telethon message, or a stand-in, by the fields the handlers use."""
+    reply_to = getattr(message, "reply_to", None)
+    date = getattr(message, "date", None)
+    return {
+        "ref": ref,
+        "chat_id": message.chat_id,
+        "id": message.id,
+        "text": message.text,
+        "sender_id": message.sender_id,
+        "sender": describe_sender(getattr(message, "sender", None)),
+        "date": date.timestamp() if date is not None else None,
+        "out": bool(getattr(message, "out", False)),
+        "reply_to_msg_id": getattr(message, "reply_to_msg_id", None),
+        "reply_to_top_id": getattr(reply_to, "reply_to_top_id", None),
+        "is_private": bool(message.is_private),
+        "is_group": bool(message.is_group),
+        "is_channel": bool(message.is_channel),
+    }
+
+
+def describe_event(ref: int, message_ref: int, event) -> dict:
+    """Describes an incoming NewMessage or CallbackQuery event.
+
+    Calls on a remote callback query go to the event, and those on a remote
+    new message event to its message, under `ref` and `message_ref`.
+    """
+    if isinstance(event, events.CallbackQuery.Event):
+        return {
+            "kind": "callback",
+            "ref": ref,
+            "sender": describe_sender(event.sender),
+            "sender_id": event.sender_id,
+            "chat_id": event.chat_id,
+            "message_id": event.message_id,
+            "data": event.data,
+            "is_private": bool(event.is_private),
+        }
+    return {
+        "kind": "message",
+        "message": describe_message(message_ref, event.message),
+    }
+
+
+class RemoteClient:
+    """Stands in for the TelegramClient of the pool in a worker."""
+
+    ref = CLIENT_REF
+
+    def __init__(self, caller: RemoteCaller):
+        self.caller = caller
+
+    send_message = _remote_method("send_message")
+    edit_message = _remote_method("edit_message")
+    get_messages = _remote_method("get_messages")
+    get_entity = _remote_method("get_entity")
+    get_me = _remote_method("get_me")
+
+
+class RemoteMessage:
+    """A message received by the pool, with the members our handlers use."""
+
+    def __init__(self, caller: RemoteCaller, description: dict):
+        self.caller = caller
+        self.ref: int = description["ref"]
+        self.chat_id: int = description["chat_id"]
+        self.id: int = description["id"]
+        self.text: str = description["text"]
+        self.sender_id: int | None = description["sender_id"]
+        self.sender = remote_sender(description["sender"])
+        self.date = (
+            None
+            if description["date"] is None
+            else datetime.datetime.fromtimestamp(
+                description["date"], datetime.timezone.utc
+            )
+        )
+        self.out: bool = description["out"]
+        self.fwd_from = None
+        self.post = False
+        self.reply_to_msg_id: int | None = description["reply_to_msg_id"]
+        self.reply_to = (
+            SimpleNamespace(
+                reply_to_msg_id=self.reply_to_msg_id,
+                reply_to_top_id=description["reply_to_top_id"],
+            )
+            if self.reply_to_msg_id is not None
+            else None
+        )
+        self.is_private: bool = description["is_private"]
+        self.is_group: bool = description["is_group"]
+        self.is_channel: bool = description["is_channel"]
+
+    @property
+    def client(self) -> RemoteClient:
+        return self.caller.client
+
+    @property
+    def message(self) -> str:
+        """The raw text, as on Telethon messages."""
+        return self.text
+
+    @property
+    def is_reply(self) -> bool:
+        return self.reply_to_msg_id is not None
+
+    async def get_sender(self):
+        if self.sender is not None:
+            return self.sender
+        return await self.caller.call(self.ref, "get_sender", (), {})
+
+    get_reply_message = _remote_method("get_reply_message")
+    respond = _remote_method("respond")
+    reply = _remote_method("reply")
+    edit = _remote_method("edit")
+    delete = _remote_method("delete")
+
+
+class RemoteNewMessageEvent(events.NewMessage.Event):
+    """A NewMessage event received by the pool, carrying a RemoteMessage."""
+
+    def __init__(self, message: RemoteMessage):  # pylint: disable=super-init-not-called
+        self.__dict__["_init"] = False
+        self.__dict__["_client"] = message.client
+        self.original_update = None
+        self.pattern_match = None
+        self.message = message
+        self.__dict__["_init"] = True
+
+    @property
+    def client(self):
+        return self.__dict__["_client"]
+
+    @property
+    def chat_id(self) -> int:
+        return self.message.chat_id
+
+    @property
+    def chat(self):
+        return None
+
+    @property
+    def is_private(self) -> bool:
+        return self.message.is_private
+
+    @property
+    def is_group(self) -> bool:
+        return self.message.is_group
+
+    @property
+    def is_channel(self) -> bool:
+        return self.message.is_channel
+
+
+class RemoteCallbackQueryEvent(events.CallbackQuery.Event):
+    """A CallbackQuery event received by the pool."""
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self, caller: RemoteCaller, description: dict
+    ):
+        self.caller = caller
+        self.ref: int = description["ref"]
+        self._remote_sender = remote_sender(description["sender"])
+        self._remote_sender_id: int = description["sender_id"]
+        self._remote_chat_id: int = description["chat_id"]
+        self._remote_message_id: int = description["message_id"]
+        self._remote_data: bytes = description["data"]
+        self._remote_is_private: bool = description["is_private"]
+        self.original_update = None
+        self.pattern_match = None
+        self.data_match = None
+
+    @property
+    def client(self) -> RemoteClient:
+        return self.caller.client
+
+    @property
+    def sender(self):
+        return self._remote_sender
+
+    @property
+    def sender_id(self) -> int:
+        return self._remote_sender_id
+
+    @property
+    def chat_id(self) -> int:
+        return self._remote_chat_id
+
+    @property
+    def chat(self):
+        return None
+
+    @property
+    def is_private(self) -> bool:
+        return self._remote_is_private
+
+    @property
+    def id(self) -> int:
+        return self._remote_message_id
+
+    @property
+    def message_id(self) -> int:
+        return self._remote_message_id
+
+    @property
+    def data(self) -> bytes:
+        return self._remote_data
+
+    @property
+    def query(self) -> SimpleNamespace:
+        return SimpleNamespace(
+            data=self._remote_data, chat_instance=0, msg_id=self._remote_message_id
+        )
+
+    answer = _remote_method("answer")
+    respond = _remote_method("respond")
+    reply = _remote_method("reply")
+    edit = _remote_method("edit")
+    get_message = _remote_method("get_message")
+
+
+def remote_event(
+    caller: RemoteCaller, description: dict
+) -> RemoteNewMessageEvent | RemoteCallbackQueryEvent:
+    """Rebuilds a described event in a worker."""
+    if description["kind"] == "callback":
+        return RemoteCallbackQueryEvent(caller, description)
+    return RemoteNewMessageEvent(RemoteMessage(caller, description["message"]))
+
+
+def is_remote(value: Any) -> bool:
+    """Whether the value stands in for an object of the pool."""
+    return isinstance(
+        value,
+        (RemoteClient, RemoteMessage, RemoteNewMessageEvent, RemoteCallbackQueryEvent),
+    )
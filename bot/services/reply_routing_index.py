@@ -0,0 +1,89 @@
+"""../bot/services/reply_routing_index.py"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from bot.services.dynamodb_constants import DynamoDBAttributes, DynamoDBKeySchema
+
+RouteKey = tuple[str, str]
+
+# The question attributes a reply needs to be routed back to the asker.
+REPLY_ROUTE_ATTRIBUTES = (
+    DynamoDBKeySchema.PK.value,
+    DynamoDBKeySchema.SK.value,
+    DynamoDBAttributes.USER_ID.value,
+    DynamoDBAttributes.QUESTION_ID.value,
+)
+
+
+class ReplyRoutingIndex:
+    """A bounded LRU index from destination messages to the questions they carry.
+
+    Entries expire `ttl` seconds after they were stored, and the least
+    recently used entry is evicted once `max_size` entries are stored.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: float = 7 * 24 * 60 * 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[RouteKey, tuple[float, dict[str, Any]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        """The share of lookups answered from the index."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, dest_chat_id: int | str, dest_message_id: int | str) -> dict | None:
+        """Gets the question routed from a destination message, if it is indexed."""
+        key = self._key(dest_chat_id, dest_message_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(
+        self, dest_chat_id: int | str, dest_message_id: int | str, question: dict
+    ):
+        """Indexes the question sent as a destination message."""
+        key = self._key(dest_chat_id, dest_message_id)
+        route = {
+            attribute: question[attribute]
+            for attribute in REPLY_ROUTE_ATTRIBUTES
+            if attribute in question
+        }
+        self._entries[key] = (self._clock() + self.ttl, route)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(dest_chat_id: int | str, dest_message_id: int | str) -> RouteKey:
+        """Normalizes the chat and message IDs into an index key."""
+        return str(dest_chat_id), str(dest_message_id)
+
+
+reply_routing_index = ReplyRoutingIndex()
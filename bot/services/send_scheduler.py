@@ -0,0 +1,405 @@
+"""../bot/services/send_scheduler.py"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable
+
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+from bot.services.metrics import Snapshot, metrics
+from bot.services.tracing import NO_SPAN, tracer
+
+WAIT_TIME_WINDOW = 1024
+
+
+class SendPriority(IntEnum):
+    """The priority of an outbound call; lower values are sent first."""
+
+    INTERACTIVE = 0
+    FAN_OUT = 1
+
+
+class TokenBucket:
+    """A token bucket refilled at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Returns the seconds until a token is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Takes a token; `delay` must have returned 0 first."""
+        self.tokens -= 1
+
+
+class SendJob:
+    """An outbound call waiting in its chat's queue."""
+
+    __slots__ = (
+        "call",
+        "method",
+        "priority",
+        "sequence",
+        "queued_at",
+        "future",
+        "span",
+    )
+
+    def __init__(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        method: str,
+        priority: SendPriority,
+        sequence: int,
+        queued_at: float,
+        future: asyncio.Future,
+        span: Any = NO_SPAN,
+    ):
+        self.call = call
+        self.method = method
+        self.span = span
+        self.priority = priority
+        self.sequence = sequence
+        self.queued_at = queued_at
+        self.future = future
+
+
+class ChatQueue:
+    """The ordered outbound calls of one chat and its rate limit."""
+
+    __slots__ = ("jobs", "bucket", "busy", "blocked_until")
+
+    def __init__(self, bucket: TokenBucket):
+        self.jobs: deque[SendJob] = deque()
+        self.bucket = bucket
+        self.busy = False
+        self.blocked_until = 0.0
+
+
+class SendScheduler:
+    """Schedules outbound Telegram calls under per-chat and global rate limits.
+
+    Calls to the same chat run one at a time in submission order. Across chats,
+    the chat whose next call has the best priority goes first, as long as both
+    its bucket and the global bucket have a token. A FloodWait or slow mode
+    error puts the call back at the head of its chat's queue until the wait is
+    over, while the other chats keep being served.
+
+    The default limits follow Telegram's bot limits: about 30 messages per
+    second overall, one per second in a private chat and 20 per minute in a
+    group, with small bursts allowed.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        global_burst: float = 30.0,
+        private_chat_rate: float = 1.0,
+        private_chat_burst: float = 3.0,
+        group_chat_rate: float = 20 / 60,
+        group_chat_burst: float = 3.0,
+        clock: Callable[[], float] = time.monotonic,
+        logger=None,
+    ):
+        self.private_chat_rate = private_chat_rate
+        self.private_chat_burst = private_chat_burst
+        self.group_chat_rate = group_chat_rate
+        self.group_chat_burst = group_chat_burst
+        self._clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self._global_bucket = TokenBucket(global_rate, global_burst, clock())
+        self._chats: dict[int, ChatQueue] = {}
+        self._ready: list[tuple[int, int, int]] = []
+        self._delayed: list[tuple[float, int, int]] = []
+        self._sequence = itertools.count()
+        self._wakeup: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        self._wait_times: deque[float] = deque(maxlen=WAIT_TIME_WINDOW)
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+
+    def set_limits(
+        self,
+        global_rate: float,
+        global_burst: float,
+        private_chat_rate: float,
+        private_chat_burst: float,
+        group_chat_rate: float,
+        group_chat_burst: float,
+    ):
+        """Changes the rate limits, including those of the chats already seen."""
+        now = self._clock()
+        self._global_bucket = TokenBucket(global_rate, global_burst, now)
+        self.private_chat_rate = private_chat_rate
+        self.private_chat_burst = private_chat_burst
+        self.group_chat_rate = group_chat_rate
+        self.group_chat_burst = group_chat_burst
+        for chat_id, chat in self._chats.items():
+            chat.bucket = self._new_chat_bucket(chat_id)
+
+    def submit(
+        self,
+        chat_id: int,
+        function: Callable[..., Awaitable[Any]],
+        *args,
+        priority: SendPriority = SendPriority.INTERACTIVE,
+        **kwargs,
+    ) -> asyncio.Future:
+        """Queues a call to the chat, returning a future for its result."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = ChatQueue(self._new_chat_bucket(chat_id))
+            self._chats[chat_id] = chat
+        method = getattr(function, "__name__", "call")
+        job = SendJob(
+            call=lambda: function(*args, **kwargs),
+            method=method,
+            priority=priority,
+            sequence=next(self._sequence),
+            queued_at=self._clock(),
+            future=loop.create_future(),
+            # Spans the queueing and the call, which may outlive the caller.
+            span=tracer.start_span(
+                method, "telegram", chat_id=chat_id, priority=priority.name
+            ),
+        )
+        chat.jobs.append(job)
+        if len(chat.jobs) == 1 and not chat.busy:
+            if chat.blocked_until > job.queued_at:
+                heapq.heappush(self._delayed, (chat.blocked_until, job.sequence, chat_id))
+            else:
+                heapq.heappush(self._ready, (job.priority, job.sequence, chat_id))
+            self._wakeup.set()  # type: ignore
+        return job.future
+
+    async def send(
+        self,
+        chat_id: int,
+        function: Callable[..., Awaitable[Any]],
+        *args,
+        priority: SendPriority = SendPriority.INTERACTIVE,
+        **kwargs,
+    ) -> Any:
+        """Queues a call to the chat and waits for its result."""
+        return await self.submit(chat_id, function, *args, priority=priority, **kwargs)
+
+    def post(
+        self,
+        chat_id: int,
+        function: Callable[..., Awaitable[Any]],
+        *args,
+        priority: SendPriority = SendPriority.INTERACTIVE,
+        **kwargs,
+    ):
+        """Queues a call to the chat without waiting for it, logging failures."""
+        future = self.submit(chat_id, function, *args, priority=priority, **kwargs)
+        future.add_done_callback(self._log_failure)
+
+    def metrics(self) -> dict[str, Any]:
+        """Returns the queue depth, outcome counters and recent wait times."""
+        depth = {priority.name.lower(): 0 for priority in SendPriority}
+        backlogs = [len(chat.jobs) for chat in self._chats.values() if chat.jobs]
+        for chat in self._chats.values():
+            for job in chat.jobs:
+                depth[job.priority.name.lower()] += 1
+        wait_times = sorted(self._wait_times)
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "chats_queued": len(backlogs),
+            "chat_backlog_max": max(backlogs, default=0),
+            "in_flight": len(self._in_flight),
+            "blocked_chats": sum(
+                1 for chat in self._chats.values() if chat.blocked_until > self._clock()
+            ),
+            "sent": self.sent,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "wait_seconds": {
+                "mean": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+                "p95": wait_times[int(len(wait_times) * 0.95)] if wait_times else 0.0,
+                "max": wait_times[-1] if wait_times else 0.0,
+            },
+        }
+
+    def metric_snapshots(self) -> list[Snapshot]:
+        """The queue gauges as a metrics source, read when the metrics are scraped."""
+        current = self.metrics()
+        return [
+            {
+                metrics.send_queue_depth.name: {
+                    (priority,): depth
+                    for priority, depth in current["queue_depth_by_priority"].items()
+                },
+                metrics.send_in_flight.name: {(): current["in_flight"]},
+                metrics.send_chats_queued.name: {(): current["chats_queued"]},
+                metrics.send_chat_backlog_max.name: {
+                    (): current["chat_backlog_max"]
+                },
+                metrics.send_blocked_chats.name: {(): current["blocked_chats"]},
+            }
+        ]
+
+    async def close(self, timeout: float = 5.0):
+        """Waits up to `timeout` seconds for queued calls, then cancels the rest."""
+        deadline = self._clock() + timeout
+        while self._has_jobs() and self._clock() < deadline:
+            await asyncio.sleep(0.05)
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        for chat in self._chats.values():
+            for job in chat.jobs:
+                job.future.cancel()
+                job.span.end(asyncio.CancelledError())
+        self._chats.clear()
+        self._ready.clear()
+        self._delayed.clear()
+
+    def _has_jobs(self) -> bool:
+        """Whether any call is queued or running."""
+        return any(chat.jobs for chat in self._chats.values())
+
+    def _new_chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Creates the bucket of a chat; negative IDs are groups and channels."""
+        if chat_id < 0:
+            return TokenBucket(self.group_chat_rate, self.group_chat_burst, self._clock())
+        return TokenBucket(self.private_chat_rate, self.private_chat_burst, self._clock())
+
+    async def _run(self):
+        """Dispatches the best ready call whenever the rate limits allow it."""
+        while True:
+            now = self._clock()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._delayed)
+                self._push_ready(chat_id)
+            if not self._ready:
+                self._prune_idle_chats(now)
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()  # type: ignore
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)  # type: ignore
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            priority, sequence, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.busy or not chat.jobs:
+                continue
+            job = chat.jobs[0]
+            if job.future.cancelled():
+                chat.jobs.popleft()
+                job.span.end(asyncio.CancelledError())
+                self._push_ready(chat_id)
+                continue
+            chat_delay = chat.bucket.delay(now)
+            if chat_delay > 0:
+                heapq.heappush(self._delayed, (now + chat_delay, sequence, chat_id))
+                continue
+            global_delay = self._global_bucket.delay(now)
+            if global_delay > 0:
+                heapq.heappush(self._ready, (priority, sequence, chat_id))
+                await asyncio.sleep(global_delay)
+                continue
+            chat.bucket.take()
+            self._global_bucket.take()
+            chat.busy = True
+            self._wait_times.append(now - job.queued_at)
+            metrics.send_wait_seconds.observe(now - job.queued_at)
+            job.span.set(wait_ms=round((now - job.queued_at) * 1e3, 3))
+            task = asyncio.create_task(self._execute(chat_id, chat, job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, chat_id: int, chat: ChatQueue, job: SendJob):
+        """Runs a call, rescheduling it on a flood wait."""
+        started = time.perf_counter()
+        try:
+            result = await job.call()
+        except (FloodWaitError, SlowModeWaitError) as error:
+            metrics.observe_telegram(
+                job.method, "flood_wait", time.perf_counter() - started
+            )
+            metrics.flood_wait(error.seconds)
+            job.span.set(flood_wait_seconds=error.seconds)
+            self.flood_waits += 1
+            chat.blocked_until = self._clock() + error.seconds
+            self.logger.warning(
+                "Flood wait of %s seconds for chat %s, rescheduling.",
+                error.seconds,
+                chat_id,
+            )
+            chat.busy = False
+            heapq.heappush(self._delayed, (chat.blocked_until, job.sequence, chat_id))
+            self._wakeup.set()  # type: ignore
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            metrics.observe_telegram(job.method, "error", time.perf_counter() - started)
+            job.span.end(error)
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            metrics.observe_telegram(job.method, "ok", time.perf_counter() - started)
+            job.span.end()
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        chat.jobs.popleft()
+        chat.busy = False
+        self._push_ready(chat_id)
+        self._wakeup.set()  # type: ignore
+
+    def _prune_idle_chats(self, now: float):
+        """Forgets idle chats whose buckets have refilled, keeping the rest limited."""
+        for chat_id in [
+            chat_id
+            for chat_id, chat in self._chats.items()
+            if not chat.jobs
+            and not chat.busy
+            and chat.blocked_until <= now
+            and chat.bucket.delay(now) == 0
+            and chat.bucket.tokens >= chat.bucket.capacity
+        ]:
+            del self._chats[chat_id]
+
+    def _push_ready(self, chat_id: int):
+        """Marks the chat's next call as ready to be dispatched."""
+        chat = self._chats.get(chat_id)
+        if chat is None or chat.busy or not chat.jobs:
+            return
+        job = chat.jobs[0]
+        heapq.heappush(self._ready, (job.priority, job.sequence, chat_id))
+
+    def _log_failure(self, future: asyncio.Future):
+        """Logs the failure of a call nobody waits for."""
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error("Scheduled call failed", exc_info=future.exception())
+
+
+send_scheduler = SendScheduler()
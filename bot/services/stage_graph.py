@@ -0,0 +1,86 @@
+"""../bot/services/stage_graph.py"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+StageFunction = Callable[[dict[str, Any]], Awaitable[Any]]
+
+
+class SkipStage(Exception):
+    """Raised by a stage to skip itself and every stage depending on it."""
+
+
+class StageGraph:
+    """Runs async stages concurrently, each as soon as its dependencies are done.
+
+    Every stage receives the results of the stages finished so far, keyed by
+    name. If a stage fails, the stages still running are cancelled and the
+    error is raised from `run`. The start offset and duration of every stage
+    are kept in `timings` and logged once the graph is done.
+    """
+
+    def __init__(self, name: str, logger=None):
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self.timings: dict[str, tuple[float, float]] = {}
+        self._stages: dict[str, tuple[StageFunction, tuple[str, ...]]] = {}
+
+    def add(self, name: str, function: StageFunction, *dependencies: str):
+        """Adds a stage running after the given stages."""
+        assert name not in self._stages, f"Stage {name} is already added."
+        for dependency in dependencies:
+            assert dependency in self._stages, f"Unknown dependency {dependency}."
+        self._stages[name] = (function, dependencies)
+
+    async def run(self) -> dict[str, Any]:
+        """Runs all stages, returning the results of those not skipped."""
+        results: dict[str, Any] = {}
+        tasks: dict[str, asyncio.Task] = {}
+        started = time.perf_counter()
+
+        async def run_stage(name: str) -> Any:
+            function, dependencies = self._stages[name]
+            for dependency in dependencies:
+                await tasks[dependency]
+            stage_started = time.perf_counter()
+            try:
+                result = await function(results)
+            finally:
+                self.timings[name] = (
+                    stage_started - started,
+                    time.perf_counter() - stage_started,
+                )
+            results[name] = result
+            return result
+
+        for name in self._stages:
+            tasks[name] = asyncio.create_task(run_stage(name))
+        pending = set(tasks.values())
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_EXCEPTION
+                )
+                for task in done:
+                    error = task.exception()
+                    if error is not None and not isinstance(error, SkipStage):
+                        raise error
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            self._log_timings(time.perf_counter() - started)
+        return results
+
+    def _log_timings(self, total: float):
+        """Logs the start offset and duration of every stage that ran."""
+        self.logger.info(
+            "%s took %.1f ms: %s",
+            self.name,
+            total * 1e3,
+            ", ".join(
+                f"{name} +{offset * 1e3:.1f}/{duration * 1e3:.1f} ms"
+                for name, (offset, duration) in self.timings.items()
+            ),
+        )
@@ -0,0 +1,64 @@
+"""../bot/services/startup.py"""
+
+import functools
+import logging
+import time
+from typing import Callable
+
+from bot.services.metrics import BotMetrics, metrics
+
+
+class StartupTimer:
+    """Times a cold start, phase by phase, up to the first handled update.
+
+    `mark` records the seconds from `started`, the process start as measured
+    at the top of `main`, to the end of a phase, such as the imports or the
+    config. Handlers wrapped with `wrap` mark `first_update` when the first of
+    them returns, then log every phase. The marks are also exported as the
+    `bot_startup_seconds` gauge.
+    """
+
+    def __init__(
+        self,
+        started: float,
+        bot_metrics: BotMetrics = metrics,
+        clock: Callable[[], float] = time.perf_counter,
+        logger=None,
+    ):
+        self.started = started
+        self.bot_metrics = bot_metrics
+        self._clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self.phases: dict[str, float] = {}
+
+    def mark(self, phase: str) -> float:
+        """Records the end of a phase, in seconds since the start."""
+        seconds = self._clock() - self.started
+        self.phases[phase] = seconds
+        self.bot_metrics.startup_seconds.child(phase).set(seconds)
+        return seconds
+
+    def first_update(self):
+        """Marks the first handled update and logs the startup phases."""
+        if "first_update" in self.phases:
+            return
+        self.mark("first_update")
+        self.logger.info(
+            "Startup: %s",
+            ", ".join(
+                f"{phase} {seconds:.3f} s" for phase, seconds in self.phases.items()
+            ),
+        )
+
+    def wrap(self, handler: Callable) -> Callable:
+        """Wraps a handler to mark the first update it handles."""
+
+        @functools.wraps(handler)
+        async def wrapper(event):
+            try:
+                return await handler(event)
+            finally:
+                if "first_update" not in self.phases:
+                    self.first_update()
+
+        return wrapper
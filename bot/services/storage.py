@@ -0,0 +1,119 @@
+"""../bot/services/storage.py"""
+
+from typing import TYPE_CHECKING, Any, AsyncIterator, Protocol
+
+from bot.services.dynamodb_expressions import AttributePath
+from bot.services.dynamodb_query import QueryPage, SortKeyCondition
+
+if TYPE_CHECKING:
+    from boto3.dynamodb.conditions import ConditionBase
+
+
+class Storage(Protocol):
+    """The item storage the bot reads and writes its users and questions through.
+
+    DynamoDBCrudManager implements it, on DynamoDB through DynamoDBClient or in
+    process through InMemoryDynamoDBClient, and WriteBehindBuffer and
+    LeaseFencedStorage wrap any implementation with the same interface.
+    """
+
+    async def get_item(
+        self, pk: str, sk: str | None = None, consistent: bool = False
+    ) -> dict:
+        """Retrieves an item, or an empty dict if it does not exist."""
+
+    async def put_item(self, item: dict, condition: "ConditionBase | None" = None):
+        """Creates or replaces an item, if the condition is met."""
+
+    async def get_attributes(
+        self,
+        pk: str,
+        sk: str,
+        names: list[str],
+        consistent: bool = False,
+    ) -> dict:
+        """Retrieves only the given attributes of an item."""
+
+    async def get_attribute(
+        self,
+        attribute: str,
+        pk: str,
+        sk: str,
+    ) -> str | dict | list | None:
+        """Retrieves a single attribute of an item."""
+
+    async def update_attributes(
+        self,
+        attributes: dict[AttributePath, Any],
+        pk: str,
+        sk: str,
+        add: dict[AttributePath, Any] | None = None,
+        append: dict[AttributePath, list] | None = None,
+        remove: list[AttributePath] | None = None,
+        condition: "ConditionBase | None" = None,
+    ):
+        """Updates attributes of an item, creating it if it does not exist."""
+
+    async def set_map_entry(
+        self,
+        attribute: str,
+        key: str,
+        value: Any,
+        pk: str,
+        sk: str,
+    ):
+        """Sets a single entry of a map attribute, creating the map if it is missing."""
+
+    async def set_map_entries(
+        self,
+        attribute: str,
+        entries: dict[str, Any],
+        pk: str,
+        sk: str,
+        condition: "ConditionBase | None" = None,
+    ):
+        """Sets entries of a map attribute, creating the map if it is missing."""
+
+    async def delete_attributes(
+        self,
+        attributes: list[str],
+        pk: str,
+        sk: str,
+    ):
+        """Deletes attributes of an item."""
+
+    async def get_items_from_index(self, index_name, pk, sk=None) -> list[dict]:
+        """Retrieves the items of an index partition, optionally with a sort key."""
+
+    def query_pages(
+        self,
+        pk: str,
+        sk: "str | SortKeyCondition | None" = None,
+        index_name: str | None = None,
+        limit: int | None = None,
+        page_size: int | None = None,
+        attributes: list[str] | None = None,
+        reverse: bool = False,
+        cursor: str | None = None,
+        consistent: bool = False,
+        operation: str = "query",
+    ) -> AsyncIterator[QueryPage]:
+        """Queries a table or index partition, one page at a time."""
+
+    def query(
+        self,
+        pk: str,
+        sk: "str | SortKeyCondition | None" = None,
+        index_name: str | None = None,
+        limit: int | None = None,
+        page_size: int | None = None,
+        attributes: list[str] | None = None,
+        reverse: bool = False,
+        cursor: str | None = None,
+        consistent: bool = False,
+        operation: str = "query",
+    ) -> AsyncIterator[dict]:
+        """Yields the items of a table or index partition."""
+
+    async def flush(self, pk: str | None = None, sk: str | None = None):
+        """Writes the buffered changes of an item, or of all items."""
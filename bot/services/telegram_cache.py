@@ -0,0 +1,153 @@
+"""../bot/services/telegram_cache.py"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Hashable
+
+Fetch = Callable[[], Awaitable[Any]]
+
+
+class AsyncRefreshingCache:
+    """A bounded LRU cache of values fetched from Telegram.
+
+    Entries older than `refresh_after` seconds are still served, but a fetch
+    is started in the background to refresh them; entries older than `ttl`
+    seconds are fetched again before being served. Concurrent fetches of the
+    same key share one call, and None results are not cached.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1_000,
+        ttl: float = 24 * 60 * 60,
+        refresh_after: float = 60 * 60,
+        clock: Callable[[], float] = time.monotonic,
+        logger=None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self._clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._fetches: dict[Hashable, asyncio.Future] = {}
+        self._refreshes: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, key: Hashable) -> Any:
+        """Gets a cached value that has not expired, without fetching it."""
+        entry = self._entries.get(key)
+        if entry is None or self._clock() - entry[0] >= self.ttl:
+            return None
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        """Caches a value, evicting the least recently used one when full."""
+        if value is None:
+            return
+        self._entries[key] = (self._clock(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: Hashable, fetch: Fetch) -> Any:
+        """Gets a value, fetching it on a miss and refreshing it when it is old."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = self._clock() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                if age >= self.refresh_after and key not in self._fetches:
+                    self._refresh(key, fetch)
+                return entry[1]
+        self.misses += 1
+        return await self._fetch(key, fetch)
+
+    async def _fetch(self, key: Hashable, fetch: Fetch) -> Any:
+        """Fetches and caches a value, sharing the call with concurrent fetches."""
+        pending = self._fetches.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.ensure_future(fetch())
+        self._fetches[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            if self._fetches.get(key) is future:
+                del self._fetches[key]
+        self.put(key, value)
+        return value
+
+    def _refresh(self, key: Hashable, fetch: Fetch):
+        """Refreshes a value in the background, logging failures."""
+
+        async def refresh():
+            try:
+                await self._fetch(key, fetch)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.warning("Failed to refresh %s", key, exc_info=True)
+
+        task = asyncio.create_task(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+
+def to_profile(entity) -> SimpleNamespace | None:
+    """Keeps the profile fields of a Telegram user or chat entity."""
+    if entity is None:
+        return None
+    return SimpleNamespace(
+        username=getattr(entity, "username", None),
+        first_name=getattr(entity, "first_name", None) or getattr(entity, "title", None),
+        last_name=getattr(entity, "last_name", None),
+    )
+
+
+class ProfileCache(AsyncRefreshingCache):
+    """Caches user profiles by user ID, filled from incoming updates."""
+
+    def remember(self, sender_id: int | None, sender):
+        """Caches the sender that came with an update."""
+        if sender_id is not None and sender is not None:
+            self.put(sender_id, to_profile(sender))
+
+    async def get_profile(self, sender_id: int | None, get_sender: Fetch):
+        """Gets a user's profile, resolving the sender only on a miss."""
+
+        async def fetch():
+            return to_profile(await get_sender())
+
+        if sender_id is None:
+            return await fetch()
+        return await self.get(sender_id, fetch)
+
+
+class DestinationMessageCache(AsyncRefreshingCache):
+    """Caches the text of messages sent to destination chats."""
+
+    def remember(self, chat_id: int | str, message_id: int | str, text: str | None):
+        """Caches the text of a sent or edited destination message."""
+        self.put((str(chat_id), str(message_id)), text)
+
+    async def get_text(
+        self, chat_id: int | str, message_id: int | str, get_message: Fetch
+    ) -> str | None:
+        """Gets a destination message's text, fetching the message only on a miss."""
+
+        async def fetch():
+            message = await get_message()
+            return message.text if message is not None else None
+
+        return await self.get((str(chat_id), str(message_id)), fetch)
+
+
+profile_cache = ProfileCache(max_size=10_000)
+dest_message_cache = DestinationMessageCache(max_size=10_000, refresh_after=float("inf"))
@@ -0,0 +1,364 @@
+"""../bot/services/tracing.py"""
+
+import functools
+import json
+import logging
+import random
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Any, Callable, Protocol
+
+
+class TraceSink(Protocol):
+    """Where finished traces are exported to."""
+
+    def export(self, trace: dict):
+        """Exports a finished trace."""
+
+    def close(self):
+        """Releases the sink's resources."""
+
+
+class JsonlSink:
+    """Appends every exported trace to a file as one JSON line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # pylint: disable-next=consider-using-with
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, trace: dict):
+        """Writes the trace as a line and flushes it."""
+        self._file.write(json.dumps(trace, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        """Closes the file."""
+        self._file.close()
+
+
+class RingBufferSink:
+    """Keeps the last `capacity` exported traces in memory."""
+
+    def __init__(self, capacity: int = 1_000):
+        self.traces: deque[dict] = deque(maxlen=capacity)
+
+    def export(self, trace: dict):
+        """Keeps the trace, dropping the oldest one when full."""
+        self.traces.append(trace)
+
+    def close(self):
+        """Nothing to release."""
+
+    def slowest(self, count: int = 10) -> list[dict]:
+        """Returns the slowest kept traces, slowest first."""
+        return sorted(self.traces, key=lambda trace: -trace["total_ms"])[:count]
+
+
+class Trace:
+    """The spans recorded for one update, exported once all of them have ended."""
+
+    __slots__ = (
+        "tracer",
+        "trace_id",
+        "started_at",
+        "started",
+        "ended",
+        "sampled",
+        "spans",
+        "open_spans",
+        "root",
+        "exported",
+    )
+
+    def __init__(self, tracer: "Tracer", sampled: bool):
+        self.tracer = tracer
+        self.trace_id = f"{random.getrandbits(64):016x}"
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.ended = 0.0
+        self.sampled = sampled
+        self.spans: list[Span] = []
+        self.open_spans = 0
+        self.root: Span | None = None
+        self.exported = False
+
+    def to_dict(self) -> dict:
+        """Formats the trace for export, with span times relative to its start.
+
+        `duration_ms` is the time the handler took and `total_ms` the time
+        until its last span ended, such as a message it queued being sent.
+        """
+        root = self.root
+        assert root is not None
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "start": self.started_at,
+            "duration_ms": round(root.duration * 1e3, 3),
+            "total_ms": round((self.ended - self.started) * 1e3, 3),
+            "attributes": root.attributes,
+            "error": root.error,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def span_ended(self):
+        """Exports the trace once the root and every span started in it have ended."""
+        self.open_spans -= 1
+        if self.open_spans == 0 and not self.exported:
+            self.ended = time.perf_counter()
+            self.exported = True
+            self.tracer.finish(self)
+
+
+class Span:
+    """A timed operation in a trace, entered as a context manager or ended explicitly."""
+
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "kind",
+        "started",
+        "duration",
+        "attributes",
+        "error",
+        "_token",
+    )
+
+    def __init__(
+        self,
+        trace: Trace,
+        parent: "Span | None",
+        name: str,
+        kind: str,
+        attributes: dict[str, Any],
+    ):
+        self.trace = trace
+        self.span_id = len(trace.spans)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.attributes = attributes
+        self.error: str | None = None
+        self._token = None
+        trace.spans.append(self)
+        trace.open_spans += 1
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_span.reset(self._token)  # type: ignore
+        self.end(exc_value)
+        return False
+
+    def set(self, **attributes):
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | None = None):
+        """Ends the span, recording the error it ended with, if any."""
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.error = type(error).__name__
+        self.trace.span_ended()
+
+    def to_dict(self) -> dict:
+        """Formats the span for export."""
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "offset_ms": round((self.started - self.trace.started) * 1e3, 3),
+            "duration_ms": round(self.duration * 1e3, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoSpan:
+    """Stands in for a span when nothing is recorded."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **attributes):
+        """Ignores the attributes."""
+
+    def end(self, error: BaseException | None = None):
+        """Does nothing."""
+
+
+NO_SPAN = _NoSpan()
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Records a trace per update, made of spans nested through a context variable.
+
+    Handlers open the root span of an update with `trace`; code running in it,
+    including tasks it starts, opens child spans with `span`, `start_span` or
+    the `traced` decorator, which cost one context variable lookup when the
+    update is not recorded. A trace is exported to the sink once its root and
+    all its spans have ended, so calls queued by a handler and finished after
+    it are included; spans started after the export are dropped.
+
+    Updates are sampled at `sample_rate`. With `slow_threshold` seconds set,
+    every update is recorded and the unsampled ones are still exported when
+    their spans took at least that long to end, so the slowest events are
+    always kept.
+    Without a sink nothing is recorded.
+    """
+
+    def __init__(
+        self,
+        sink: TraceSink | None = None,
+        sample_rate: float = 1.0,
+        slow_threshold: float | None = None,
+        logger=None,
+    ):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.logger = logger or logging.getLogger(__name__)
+        self.exported = 0
+
+    def configure(
+        self,
+        sink: TraceSink | None,
+        sample_rate: float = 1.0,
+        slow_threshold: float | None = None,
+    ):
+        """Replaces the sink and the sampling, closing the previous sink."""
+        if self.sink is not None and self.sink is not sink:
+            self.sink.close()
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    def close(self):
+        """Closes the sink and stops recording."""
+        self.configure(None)
+
+    def trace(self, name: str, **attributes) -> Span | _NoSpan:
+        """Starts the root span of an update, if it is recorded."""
+        if self.sink is None:
+            return NO_SPAN
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        if not sampled and self.slow_threshold is None:
+            return NO_SPAN
+        trace = Trace(self, sampled)
+        trace.root = Span(trace, None, name, "update", attributes)
+        return trace.root
+
+    def span(self, name: str, kind: str, **attributes) -> Span | _NoSpan:
+        """Starts a child of the current span, if the update is recorded."""
+        parent = _current_span.get()
+        if parent is None or parent.trace.exported:
+            return NO_SPAN
+        return Span(parent.trace, parent, name, kind, attributes)
+
+    def start_span(
+        self, name: str, kind: str, parent: Span | None = None, **attributes
+    ) -> Span | _NoSpan:
+        """Starts a span under `parent` or the current span without entering it.
+
+        It must be ended with `end`, typically from another task.
+        """
+        parent = parent or _current_span.get()
+        if parent is None or parent.trace.exported:
+            return NO_SPAN
+        return Span(parent.trace, parent, name, kind, attributes)
+
+    @staticmethod
+    def current_span() -> Span | None:
+        """Returns the span the current code runs in."""
+        return _current_span.get()
+
+    def traced(self, kind: str, name: str | None = None) -> Callable:
+        """Decorates a coroutine function to run it in a child span."""
+
+        def decorator(function):
+            span_name = name or function.__name__
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                parent = _current_span.get()
+                if parent is None or parent.trace.exported:
+                    return await function(*args, **kwargs)
+                with Span(parent.trace, parent, span_name, kind, {}):
+                    return await function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def finish(self, trace: Trace):
+        """Exports a trace that was sampled or was slow enough."""
+        root = trace.root
+        if self.sink is None or root is None:
+            return
+        if not trace.sampled and (
+            self.slow_threshold is None
+            or trace.ended - trace.started < self.slow_threshold
+        ):
+            return
+        try:
+            self.sink.export(trace.to_dict())
+            self.exported += 1
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Failed to export trace %s", trace.trace_id)
+
+
+def critical_path(trace: dict) -> list[tuple[int, dict]]:
+    """Returns the spans the update waited on, with their depth, in start order.
+
+    A span ends once its own work and the spans it started have ended. Walking
+    back from that end, the critical children are the one ending last, then
+    the one ending last before it started, and so on; each is expanded the
+    same way.
+    """
+    children: dict[int | None, list[dict]] = defaultdict(list)
+    for span in trace["spans"]:
+        children[span["parent_id"]].append(span)
+    ends: dict[int, float] = {}
+
+    def end(span: dict) -> float:
+        if span["span_id"] not in ends:
+            ends[span["span_id"]] = max(
+                [span["offset_ms"] + span["duration_ms"]]
+                + [end(child) for child in children[span["span_id"]]]
+            )
+        return ends[span["span_id"]]
+
+    path: list[tuple[int, dict]] = []
+
+    def walk(span: dict, depth: int):
+        path.append((depth, span))
+        cursor = end(span)
+        critical = []
+        for child in sorted(children[span["span_id"]], key=end, reverse=True):
+            if end(child) <= cursor:
+                critical.append(child)
+                cursor = child["offset_ms"]
+        for child in reversed(critical):
+            walk(child, depth + 1)
+
+    for root in children[None]:
+        walk(root, 0)
+    return path
+
+
+tracer = Tracer()
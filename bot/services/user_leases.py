@@ -0,0 +1,394 @@
+"""../bot/services/user_leases.py"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable
+
+from telethon import events
+
+from bot.services.dynamodb_constants import (
+    DynamoDBAttributes,
+    DynamoDBFormatter,
+    DynamoDBKeySchema,
+    DynamoDBKeySchemaPrefix,
+)
+from bot.services.dynamodb_crud_manager import ConditionalCheckFailedError
+from bot.services.dynamodb_expressions import AttributePath
+from bot.services.metrics import BotMetrics, metrics
+from bot.services.storage import Storage
+from clients.dynamodb_client import conditions
+
+if TYPE_CHECKING:
+    from boto3.dynamodb.conditions import ConditionBase
+
+LEASE_OWNER = DynamoDBAttributes.LEASE_OWNER.value
+LEASE_EXPIRES_AT = DynamoDBAttributes.LEASE_EXPIRES_AT.value
+
+
+def default_owner() -> str:
+    """A replica name that is unique across hosts and restarts."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _milliseconds(seconds: float) -> int:
+    """Lease times are stored as epoch milliseconds, which DynamoDB keeps exact."""
+    return int(seconds * 1000)
+
+
+class UserLeasedElsewhere(events.StopPropagation):
+    """Raised for an update of a user whose lease another replica holds.
+
+    As a StopPropagation, it ends the handling of the update without counting
+    as a handler error; the replica holding the lease handles it.
+    """
+
+    def __init__(self, user_id: str, owner: str | None = None):
+        super().__init__(f"User {user_id} is leased by {owner or 'another replica'}.")
+        self.user_id = user_id
+        self.owner = owner
+
+
+class UserLeases:
+    """Leases users to this replica, so that no two replicas handle a user at once.
+
+    A user's lease is two attributes of the user's item, holding the owning
+    replica and the epoch time the lease expires at. `acquire` claims it with
+    a conditional write that only succeeds while it is free, expired or
+    already ours, and raises UserLeasedElsewhere otherwise. While a lease has
+    more than `clock_skew` seconds left, `acquire` is a dict lookup; the
+    background task renews the leases of the users active in the last
+    `idle_timeout` seconds every `renew_interval` seconds and releases the
+    others. A user whose lease another replica holds is only checked again
+    after `retry_interval` seconds.
+
+    `close` releases every lease, so on a deploy the next replica takes the
+    users over at their next update; after a crash, they are taken over once
+    the leases expire, `lease_seconds` at most. A replica that stalls past its
+    leases keeps believing it holds them until its next renewal, so its writes
+    to the user's item go through LeaseFencedStorage, which makes them fail
+    once another replica claimed the user.
+
+    Every replica logs in with the same bot and receives every update, so a
+    replica can drop the updates of users leased elsewhere. Answers in
+    destination chats belong to no user; `claim_answer` lets exactly one
+    replica handle each of them instead.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        owner: str | None = None,
+        lease_seconds: float = 15.0,
+        renew_interval: float = 5.0,
+        idle_timeout: float = 30.0,
+        clock_skew: float = 2.0,
+        retry_interval: float = 1.0,
+        concurrency: int = 16,
+        clock: Callable[[], float] = time.time,
+        bot_metrics: BotMetrics = metrics,
+        logger=None,
+    ):
+        assert (
+            renew_interval + clock_skew < lease_seconds
+        ), "Leases must be renewed before they expire."
+        self.storage = storage
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.renew_interval = renew_interval
+        self.idle_timeout = idle_timeout
+        self.clock_skew = clock_skew
+        self.retry_interval = retry_interval
+        self.concurrency = concurrency
+        self._clock = clock
+        self.bot_metrics = bot_metrics
+        self.logger = logger or logging.getLogger(__name__)
+        self._held: dict[str, float] = {}
+        self._last_used: dict[str, float] = {}
+        self._elsewhere: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._held)
+
+    def holds(self, user_id: str) -> bool:
+        """Whether this replica holds the user's lease for now."""
+        expires_at = self._held.get(user_id)
+        return expires_at is not None and self._clock() + self.clock_skew < expires_at
+
+    async def acquire(self, user_id: str) -> bool:
+        """Makes sure this replica holds the user's lease, or raises UserLeasedElsewhere.
+
+        Returns whether the lease had to be claimed; the user's item may then
+        have been written by another replica, so it should be read consistently.
+        """
+        now = self._clock()
+        expires_at = self._held.get(user_id)
+        if expires_at is not None and now + self.clock_skew < expires_at:
+            self._last_used[user_id] = now
+            return False
+        if self._elsewhere.get(user_id, 0.0) > now:
+            self.bot_metrics.lease_skipped_updates.inc()
+            raise UserLeasedElsewhere(user_id)
+        owner = await self._claim(user_id, renew=False)
+        if owner != self.owner:
+            self._elsewhere[user_id] = self._clock() + self.retry_interval
+            self.bot_metrics.lease_skipped_updates.inc()
+            raise UserLeasedElsewhere(user_id, owner)
+        self._elsewhere.pop(user_id, None)
+        self._last_used[user_id] = now
+        return True
+
+    async def release(self, user_id: str):
+        """Gives up the user's lease, if this replica still holds it."""
+        self._drop(user_id)
+        pk, sk = self._key(user_id)
+        try:
+            await self.storage.update_attributes(
+                {},
+                pk,
+                sk,
+                remove=[LEASE_OWNER, LEASE_EXPIRES_AT],
+                condition=conditions.Attr(LEASE_OWNER).eq(self.owner),
+            )
+        except ConditionalCheckFailedError:
+            self.bot_metrics.lease_operations.child("release", "lost").inc()
+        else:
+            self.bot_metrics.lease_operations.child("release", "released").inc()
+
+    async def claim_answer(self, pk: str, src_chat_id: int, src_msg_id: int) -> bool:
+        """Claims the handling of an answer message, once across all replicas.
+
+        The claim is an item under the question's partition, put only if it
+        does not exist yet. Returns whether this replica got it; an answer
+        whose claimer crashes before delivering it is not handled again.
+        """
+        claim = {
+            DynamoDBKeySchema.PK.value: pk,
+            DynamoDBKeySchema.SK.value: DynamoDBFormatter.prefix_answer_claim_sk(
+                str(src_chat_id), str(src_msg_id)
+            ),
+            LEASE_OWNER: self.owner,
+        }
+        try:
+            await self.storage.put_item(
+                claim,
+                condition=conditions.Attr(DynamoDBKeySchema.PK.value).not_exists(),
+            )
+        except ConditionalCheckFailedError:
+            self.bot_metrics.lease_operations.child("answer", "held").inc()
+            self.bot_metrics.lease_skipped_updates.inc()
+            return False
+        self.bot_metrics.lease_operations.child("answer", "acquired").inc()
+        return True
+
+    async def renew(self):
+        """Renews the leases of recently active users and releases the others."""
+        now = self._clock()
+        self._elsewhere = {
+            user_id: retry_at
+            for user_id, retry_at in self._elsewhere.items()
+            if retry_at > now
+        }
+        idle_since = now - self.idle_timeout
+        active, idle = [], []
+        for user_id in self._held:
+            if self._last_used.get(user_id, 0.0) > idle_since:
+                active.append(user_id)
+            else:
+                idle.append(user_id)
+        await self._for_each("release", self.release, idle)
+        await self._for_each(
+            "renew", lambda user_id: self._claim(user_id, renew=True), active
+        )
+
+    def start(self):
+        """Starts renewing the leases every `renew_interval` seconds."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops renewing, keeping the leases until they expire."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def close(self):
+        """Stops renewing and releases every lease."""
+        await self.stop()
+        await self._for_each("release", self.release, list(self._held))
+        self.logger.info("Released the user leases of %s.", self.owner)
+
+    async def _claim(self, user_id: str, renew: bool) -> str | None:
+        """Claims or renews the lease, returning the replica that holds it after."""
+        operation = "renew" if renew else "claim"
+        now = self._clock()
+        expires_at = now + self.lease_seconds
+        condition = conditions.Attr(LEASE_OWNER).eq(self.owner)
+        if not renew:
+            condition = (
+                condition
+                | conditions.Attr(LEASE_OWNER).not_exists()
+                | conditions.Attr(LEASE_EXPIRES_AT).lt(
+                    _milliseconds(now - self.clock_skew)
+                )
+            )
+        pk, sk = self._key(user_id)
+        try:
+            await self.storage.update_attributes(
+                {
+                    LEASE_OWNER: self.owner,
+                    LEASE_EXPIRES_AT: _milliseconds(expires_at),
+                },
+                pk,
+                sk,
+                condition=condition,
+            )
+        except ConditionalCheckFailedError:
+            self._drop(user_id)
+            if renew:
+                self.bot_metrics.lease_operations.child(operation, "lost").inc()
+                self.logger.warning("Lost the lease of user %s.", user_id)
+                return None
+            self.bot_metrics.lease_operations.child(operation, "held").inc()
+            lease = await self.storage.get_attributes(
+                pk, sk, names=[LEASE_OWNER], consistent=True
+            )
+            return lease.get(LEASE_OWNER)
+        self._held[user_id] = expires_at
+        self.bot_metrics.leases_held.set(len(self._held))
+        self.bot_metrics.lease_operations.child(operation, "acquired").inc()
+        return self.owner
+
+    def _drop(self, user_id: str):
+        """Forgets a lease locally."""
+        self._held.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+        self.bot_metrics.leases_held.set(len(self._held))
+
+    async def _for_each(
+        self,
+        operation: str,
+        function: Callable[[str], Awaitable],
+        user_ids: Iterable[str],
+    ):
+        """Runs a lease operation for each user, `concurrency` at a time."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(user_id: str):
+            async with semaphore:
+                try:
+                    await function(user_id)
+                except Exception:  # pylint: disable=broad-except
+                    self.bot_metrics.lease_operations.child(operation, "error").inc()
+                    self.logger.exception("Lease operation failed for %s", user_id)
+
+        await asyncio.gather(*(run(user_id) for user_id in user_ids))
+
+    async def _run(self):
+        """Renews the leases every `renew_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            await self.renew()
+
+    def fence(self) -> "ConditionBase":
+        """The condition a write to a user's item needs to only land while leased here."""
+        return conditions.Attr(LEASE_OWNER).eq(self.owner)
+
+    @staticmethod
+    def _key(user_id: str) -> tuple[str, str]:
+        """The key of the user's item, which holds the lease."""
+        return (
+            DynamoDBFormatter.prefix_user_pk(user_id),
+            DynamoDBFormatter.prefix_user_sk(user_id),
+        )
+
+
+class LeaseFencedStorage:
+    """Storage that only writes to a user's item while this replica leases the user.
+
+    Writes to user items get the lease's fence added to their condition, so
+    they raise ConditionalCheckFailedError once another replica took the user
+    over; other items and reads are passed through. The leases themselves
+    must use the unfenced storage.
+    """
+
+    def __init__(self, storage: Storage, leases: UserLeases):
+        self.storage = storage
+        self.leases = leases
+
+    def __getattr__(self, name):
+        """Delegate attribute access to the wrapped storage."""
+        return getattr(self.storage, name)
+
+    def _fenced(
+        self, sk: str | None, condition: "ConditionBase | None"
+    ) -> "ConditionBase | None":
+        """Adds the fence to the condition of a write to the given item."""
+        if sk is None or not sk.startswith(DynamoDBKeySchemaPrefix.USER_SK.value):
+            return condition
+        fence = self.leases.fence()
+        return fence if condition is None else condition & fence
+
+    async def put_item(self, item: dict, condition: "ConditionBase | None" = None):
+        """Puts the item, fenced if it is a user's."""
+        sk = item.get(DynamoDBKeySchema.SK.value)
+        return await self.storage.put_item(item, condition=self._fenced(sk, condition))
+
+    async def update_attributes(
+        self,
+        attributes: dict[AttributePath, Any],
+        pk: str,
+        sk: str,
+        add: dict[AttributePath, Any] | None = None,
+        append: dict[AttributePath, list] | None = None,
+        remove: list[AttributePath] | None = None,
+        condition: "ConditionBase | None" = None,
+    ):
+        """Updates the item, fenced if it is a user's."""
+        return await self.storage.update_attributes(
+            attributes,
+            pk,
+            sk,
+            add=add,
+            append=append,
+            remove=remove,
+            condition=self._fenced(sk, condition),
+        )
+
+    async def set_map_entry(
+        self,
+        attribute: str,
+        key: str,
+        value: Any,
+        pk: str,
+        sk: str,
+    ):
+        """Sets a map entry, fenced if the item is a user's."""
+        return await self.set_map_entries(attribute, {key: value}, pk, sk)
+
+    async def set_map_entries(
+        self,
+        attribute: str,
+        entries: dict[str, Any],
+        pk: str,
+        sk: str,
+        condition: "ConditionBase | None" = None,
+    ):
+        """Sets map entries, fenced if the item is a user's."""
+        return await self.storage.set_map_entries(
+            attribute, entries, pk, sk, condition=self._fenced(sk, condition)
+        )
+
+    async def delete_attributes(
+        self,
+        attributes: list[str],
+        pk: str,
+        sk: str,
+    ):
+        """Deletes attributes, fenced if the item is a user's."""
+        return await self.update_attributes({}, pk, sk, remove=list(attributes))
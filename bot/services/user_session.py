@@ -0,0 +1,70 @@
+"""../bot/services/user_session.py"""
+
+from typing import Any, Iterable
+
+from bot.services.dynamodb_constants import DynamoDBAttributes
+from bot.services.storage import Storage
+
+USER_SESSION_ATTRIBUTES = (
+    DynamoDBAttributes.USER_STATE.value,
+    DynamoDBAttributes.USER_INPUTS.value,
+    DynamoDBAttributes.DESTINATION_CHAT.value,
+    DynamoDBAttributes.DESTINATION_CHAT_TOPIC.value,
+)
+
+
+class UserSession:
+    """A per-event snapshot of the user's item, loaded once and served from memory."""
+
+    def __init__(
+        self,
+        dynamodb_crud_manager: Storage,
+        pk: str,
+        sk: str,
+        attributes: tuple[str, ...] = USER_SESSION_ATTRIBUTES,
+    ):
+        self.dynamodb_crud_manager = dynamodb_crud_manager
+        self.pk = pk
+        self.sk = sk
+        self.attributes = attributes
+        self._item: dict[str, Any] | None = None
+        self._dirty: set[str] = set()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the user's item has been loaded from the database."""
+        return self._item is not None
+
+    @property
+    def dirty(self) -> frozenset[str]:
+        """The attributes changed since the snapshot was loaded."""
+        return frozenset(self._dirty)
+
+    async def load(self, consistent: bool = False) -> dict[str, Any]:
+        """Loads the session attributes of the user's item, replacing the snapshot."""
+        self._item = await self.dynamodb_crud_manager.get_attributes(
+            pk=self.pk, sk=self.sk, names=list(self.attributes), consistent=consistent
+        )
+        self._dirty.clear()
+        return self._item
+
+    async def get(self, attribute: str, default: Any = None) -> Any:
+        """Gets an attribute from the snapshot, loading it on first access."""
+        if self._item is None:
+            await self.load()
+        return self._item.get(attribute, default)  # type: ignore
+
+    def set(self, attributes: dict[str, Any]):
+        """Records written attributes in the snapshot and marks them as dirty."""
+        if self._item is None:
+            self._item = {}
+        self._item.update(attributes)
+        self._dirty.update(attributes)
+
+    def remove(self, attributes: Iterable[str]):
+        """Records removed attributes in the snapshot and marks them as dirty."""
+        if self._item is None:
+            self._item = {}
+        for attribute in attributes:
+            self._item.pop(attribute, None)
+            self._dirty.add(attribute)
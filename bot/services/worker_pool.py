@@ -0,0 +1,755 @@
+"""../bot/services/worker_pool.py"""
+
+import asyncio
+import io
+import itertools
+import logging
+import multiprocessing
+import pickle
+import socket
+import struct
+from collections import OrderedDict
+from typing import Any, AsyncContextManager, Awaitable, Callable, Type
+
+from telethon import events
+
+from bot.bot import UserDispatcher
+from bot.config_snapshot import CompiledConfig
+from bot.conversation_flow import ConversationFlow
+from bot.services.metrics import BotMetrics, Snapshot, metrics
+from bot.services.remote_events import (
+    CLIENT_REF,
+    RemoteClient,
+    RemoteMessage,
+    describe_event,
+    describe_message,
+    describe_sender,
+    is_remote,
+    remote_event,
+    remote_sender,
+)
+from bot.services.send_scheduler import SendPriority, SendScheduler, send_scheduler
+from bot.services.storage import Storage
+from bot.services.write_behind_buffer import WriteBehindBuffer
+
+HEADER = struct.Struct("!I")
+
+StorageFactory = Callable[[], AsyncContextManager[Storage]]
+HandlerFactory = Callable[..., Callable]
+
+# Metric kinds that still count once their worker is gone; gauges do not.
+RETAINED_METRIC_KINDS = ("counter", "histogram")
+
+
+class Channel:
+    """Exchanges length-prefixed pickled frames over a stream socket.
+
+    The pickler and unpickler classes of each side swap the Telegram objects
+    in a frame for references to them, see `WorkerPool` and `Worker`.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        pickler: Type[pickle.Pickler],
+        unpickler: Type[pickle.Unpickler],
+        context: Any,
+    ):
+        self.reader = reader
+        self.writer = writer
+        self._pickler = pickler
+        self._unpickler = unpickler
+        self._context = context
+
+    def send(self, *frame):
+        """Queues a frame for writing."""
+        buffer = io.BytesIO()
+        self._pickler(buffer, self._context).dump(frame)
+        data = buffer.getvalue()
+        self.writer.write(HEADER.pack(len(data)) + data)
+
+    async def receive(self) -> tuple | None:
+        """Reads the next frame, or None once the other side has closed."""
+        try:
+            header = await self.reader.readexactly(HEADER.size)
+            data = await self.reader.readexactly(HEADER.unpack(header)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return self._unpickler(io.BytesIO(data), self._context).load()
+
+    async def close(self):
+        """Flushes and closes the socket."""
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class MissingObject:
+    """Stands in for a reference the pool no longer holds."""
+
+    def __init__(self, ref: int):
+        self.ref = ref
+
+    def __repr__(self) -> str:
+        return f"<MissingObject {self.ref}>"
+
+
+class ObjectRegistry:
+    """The Telegram objects of the pool that workers refer to.
+
+    Events are held until their worker is done with them; other objects,
+    such as sent messages returned to a worker, are kept for the last
+    `max_size` references.
+    """
+
+    def __init__(self, client: Any, max_size: int = 10_000):
+        self.client = client
+        self.max_size = max_size
+        self._refs = itertools.count(CLIENT_REF + 1)
+        self._pinned: dict[int, Any] = {}
+        self._recent: OrderedDict[int, Any] = OrderedDict()
+
+    def pin(self, value: Any) -> int:
+        """Holds the object until it is released."""
+        ref = next(self._refs)
+        self._pinned[ref] = value
+        return ref
+
+    def add(self, value: Any) -> int:
+        """Holds the object among the recent ones."""
+        ref = next(self._refs)
+        self._recent[ref] = value
+        while len(self._recent) > self.max_size:
+            self._recent.popitem(last=False)
+        return ref
+
+    def release(self, *refs: int):
+        """Releases pinned objects."""
+        for ref in refs:
+            self._pinned.pop(ref, None)
+
+    def get(self, ref: int) -> Any:
+        """Returns the object behind a reference."""
+        if ref == CLIENT_REF:
+            return self.client
+        value = self._pinned.get(ref)
+        if value is None:
+            value = self._recent.get(ref)
+        return MissingObject(ref) if value is None else value
+
+
+class PoolPickler(pickle.Pickler):
+    """Sends Telegram messages and users from the pool as descriptions."""
+
+    def __init__(self, file, registry: ObjectRegistry):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.registry = registry
+
+    def persistent_id(self, obj):
+        if isinstance(obj, (str, bytes, int, float, tuple, list, dict)) or obj is None:
+            return None
+        if isinstance(obj, events.common.EventCommon):
+            raise TypeError("Events are sent to workers with their own frame.")
+        if hasattr(obj, "get_reply_message"):
+            return ("message", describe_message(self.registry.add(obj), obj))
+        if hasattr(obj, "first_name") and hasattr(obj, "id"):
+            return ("sender", describe_sender(obj))
+        return None
+
+
+class PoolUnpickler(pickle.Unpickler):
+    """Resolves the references in a worker's frame to the pool's objects."""
+
+    def __init__(self, file, registry: ObjectRegistry):
+        super().__init__(file)
+        self.registry = registry
+
+    def persistent_load(self, pid):
+        _, ref = pid
+        return self.registry.get(ref)
+
+
+class Shard:
+    """A worker process of the pool and its channel.
+
+    A shard is alive until its worker disconnects, whether it closed or died.
+    """
+
+    def __init__(self, index: int, process: multiprocessing.process.BaseProcess):
+        self.index = index
+        self.process = process
+        self.channel: Channel | None = None
+        self.ready = asyncio.Event()
+        self.alive = True
+        self.reader: asyncio.Task | None = None
+        self.done: dict[int, tuple[asyncio.Future, tuple[int, ...]]] = {}
+        self.metrics: Snapshot = {}
+
+
+class WorkerPool:
+    """Runs the handlers in worker processes, sharded by sender.
+
+    The process holding the Telegram client registers `handler` alone: it
+    forwards each update as a compact description to the worker that owns
+    its sender (the chat when there is none), so a user's updates are always
+    handled by the same worker, in order. Workers run the ConversationFlow
+    handlers on stand-in events with their own storage, and their outbound
+    calls come back through the channel: scheduled calls go through this
+    process' send scheduler, so the rate limits hold across workers, and the
+    others, such as `get_reply_message`, run directly.
+
+    Replies in group chats are sharded by the message they reply to instead,
+    so that every answer to a question is handled by the same worker, whose
+    caches of the question's route and destination message text stay
+    current. The first answer a worker sees to a question sent by another
+    worker finds it through GSI2.
+
+    Workers are started with `spawn`. `storage_factory` and the handler
+    factories must be importable functions; each worker enters the storage
+    factory for its own connection pool and, with `write_behind`, wraps it in
+    a WriteBehindBuffer. Handler factories get the worker's scheduler as
+    `scheduler`.
+
+    A worker that dies is started again after `respawn_delay` seconds,
+    doubling up to a minute while it keeps failing; until then its updates
+    fail at once. `forward` gives up waiting for an update after `timeout`
+    seconds, so that a stuck worker does not hold up the sender's mailbox.
+
+    Workers send their metrics every `metrics_interval` seconds, and the
+    pool adds them to those of `bot_metrics`, so the scrape endpoint covers
+    every process; the counters and histograms of dead workers are kept.
+    Traces, the profile cache and the user leases stay per process.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        compiled: CompiledConfig,
+        storage_factory: StorageFactory,
+        handler_factories: list[HandlerFactory],
+        client: Any = None,
+        scheduler: SendScheduler = send_scheduler,
+        event_builders: tuple = (events.NewMessage(), events.CallbackQuery()),
+        write_behind: bool = True,
+        timeout: float = 60.0,
+        respawn_delay: float = 1.0,
+        metrics_interval: float = 2.0,
+        bot_metrics: BotMetrics = metrics,
+        logger=None,
+    ):
+        self.workers = workers
+        self.compiled = compiled
+        self.storage_factory = storage_factory
+        self.handler_factories = handler_factories
+        self.registry = ObjectRegistry(client)
+        self.scheduler = scheduler
+        self.write_behind = write_behind
+        self.timeout = timeout
+        self.respawn_delay = respawn_delay
+        self.metrics_interval = metrics_interval
+        self.bot_metrics = bot_metrics
+        self.logger = logger or logging.getLogger(__name__)
+        self.handler = self._build_handler(event_builders)
+        self._shards: list[Shard] = []
+        self._calls: set[asyncio.Task] = set()
+        self._respawns: set[asyncio.Task] = set()
+        self._retired_metrics: Snapshot = {}
+        self._closing = False
+        self.forwarded = 0
+        self.failed = 0
+        self.respawned = 0
+
+    @property
+    def client(self) -> Any:
+        """The Telegram client that the workers' calls to the client go to."""
+        return self.registry.client
+
+    @client.setter
+    def client(self, client: Any):
+        self.registry.client = client
+
+    async def start(self):
+        """Starts the workers and waits until they are ready."""
+        self._closing = False
+        self._shards = [await self._spawn(index) for index in range(self.workers)]
+        await asyncio.gather(*(shard.ready.wait() for shard in self._shards))
+        failed = [shard.index for shard in self._shards if not shard.alive]
+        if failed:
+            await self.close()
+            raise RuntimeError(f"Workers {failed} exited while starting.")
+        self.bot_metrics.add_source(self.metric_snapshots)
+        self.logger.info("Started %s workers.", self.workers)
+
+    async def close(self, timeout: float = 10.0):
+        """Lets the workers finish their updates and stops them."""
+        self._closing = True
+        for task in list(self._respawns):
+            task.cancel()
+        await asyncio.gather(*self._respawns, return_exceptions=True)
+        for shard in self._shards:
+            if shard.alive and shard.channel is not None:
+                shard.channel.send("close")
+        for shard in self._shards:
+            await self._stop(shard, timeout)
+        self._shards.clear()
+        self.bot_metrics.remove_source(self.metric_snapshots)
+
+    def metric_snapshots(self) -> list[Snapshot]:
+        """The last metrics of the live workers and the retained ones of dead workers."""
+        return [self._retired_metrics, *(shard.metrics for shard in self._shards)]
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def forward(self, event) -> str | None:
+        """Hands an update to its worker and waits until it is handled.
+
+        Returns the error the handlers raised in the worker, if any, or why
+        the update could not be handled: its worker is down or timed out.
+        """
+        shard = self._shards[self._shard_key(event) % len(self._shards)]
+        if not shard.alive:
+            self.failed += 1
+            self.logger.warning("Dropping an update for down worker %s.", shard.index)
+            return "worker down"
+        ref = self.registry.pin(event)
+        refs: tuple[int, ...] = (ref,)
+        message_ref = ref
+        if not isinstance(event, events.CallbackQuery.Event):
+            message_ref = self.registry.pin(event.message)
+            refs = (ref, message_ref)
+        future = asyncio.get_running_loop().create_future()
+        shard.done[ref] = (future, refs)
+        shard.channel.send(  # type: ignore
+            "event", ref, describe_event(ref, message_ref, event)
+        )
+        self.forwarded += 1
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            # The event stays pinned until the worker reports it done or exits.
+            self.failed += 1
+            self.logger.warning(
+                "Worker %s did not handle an update within %s seconds.",
+                shard.index,
+                self.timeout,
+            )
+            return "timed out"
+
+    def _build_handler(self, event_builders: tuple) -> Callable:
+        """Builds the handler that forwards the updates of the given builders."""
+
+        async def forward_to_worker(event):
+            await self.forward(event)
+
+        for builder in event_builders:
+            forward_to_worker = events.register(builder)(forward_to_worker)
+        return forward_to_worker
+
+    @staticmethod
+    def _shard_key(event) -> int:
+        """The replied message of a group reply, else the sender, else the chat."""
+        if not isinstance(event, events.CallbackQuery.Event) and not event.is_private:
+            reply_to_msg_id = getattr(event.message, "reply_to_msg_id", None)
+            if reply_to_msg_id is not None:
+                return hash((event.chat_id, reply_to_msg_id))
+        sender_id = getattr(event, "sender_id", None)
+        return hash(sender_id if sender_id is not None else event.chat_id)
+
+    async def _spawn(self, index: int) -> Shard:
+        """Starts a worker process and serves its channel."""
+        parent, child = socket.socketpair()
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_worker,
+            args=(
+                index,
+                child,
+                self.compiled,
+                self.storage_factory,
+                self.handler_factories,
+                self.write_behind,
+                self.metrics_interval,
+            ),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        shard = Shard(index, process)
+        reader, writer = await asyncio.open_connection(sock=parent)
+        shard.channel = Channel(
+            reader, writer, PoolPickler, PoolUnpickler, self.registry
+        )
+        shard.reader = asyncio.create_task(self._read(shard))
+        return shard
+
+    async def _stop(self, shard: Shard, timeout: float):
+        """Waits for a worker to exit, terminating it if it does not."""
+        if shard.reader is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(shard.reader), timeout)
+            except asyncio.TimeoutError:
+                shard.reader.cancel()
+        await asyncio.to_thread(shard.process.join, timeout)
+        if shard.process.is_alive():
+            self.logger.warning("Terminating worker %s.", shard.index)
+            shard.process.terminate()
+        for future, refs in shard.done.values():
+            future.cancel()
+            self.registry.release(*refs)
+        shard.done.clear()
+        if shard.channel is not None:
+            await shard.channel.close()
+
+    def _on_worker_exit(self, shard: Shard):
+        """Fails the updates of a worker that exited, and replaces it if it died."""
+        shard.alive = False
+        shard.ready.set()
+        self._retired_metrics = self.bot_metrics.registry.combine(
+            [self._retired_metrics, shard.metrics], RETAINED_METRIC_KINDS
+        )
+        shard.metrics = {}
+        for future, refs in shard.done.values():
+            if not future.done():
+                future.set_result("worker exited")
+            self.registry.release(*refs)
+        shard.done.clear()
+        if self._closing or shard not in self._shards:
+            return
+        self.logger.error("Worker %s exited; starting it again.", shard.index)
+        task = asyncio.create_task(self._respawn(shard))
+        self._respawns.add(task)
+        task.add_done_callback(self._respawns.discard)
+
+    async def _respawn(self, dead: Shard):
+        """Starts a dead worker again, retrying with a growing delay until it is ready."""
+        await self._stop(dead, timeout=1.0)
+        delay = self.respawn_delay
+        while not self._closing:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+            try:
+                shard = await self._spawn(dead.index)
+            except OSError:
+                self.logger.exception("Could not start worker %s", dead.index)
+                continue
+            await shard.ready.wait()
+            if shard.alive:
+                self._shards[dead.index] = shard
+                self.respawned += 1
+                self.logger.info("Worker %s is back.", dead.index)
+                return
+            await self._stop(shard, timeout=1.0)
+
+    async def _read(self, shard: Shard):
+        """Serves a worker's frames until it disconnects."""
+        assert shard.channel is not None
+        while True:
+            frame = await shard.channel.receive()
+            if frame is None:
+                break
+            kind = frame[0]
+            if kind == "done":
+                _, ref, error = frame
+                future, refs = shard.done.pop(ref, (None, ()))
+                self.registry.release(*refs)
+                if error is not None:
+                    self.failed += 1
+                if future is not None and not future.done():
+                    future.set_result(error)
+            elif kind in ("call", "send"):
+                try:
+                    call = self._start_call(frame)
+                except Exception as error:  # pylint: disable=broad-except
+                    self._reply(shard, frame[1], False, error)
+                    continue
+                task = asyncio.create_task(self._serve_call(shard, frame[1], call))
+                self._calls.add(task)
+                task.add_done_callback(self._calls.discard)
+            elif kind == "metrics":
+                shard.metrics = frame[1]
+            elif kind == "ready":
+                shard.ready.set()
+        self._on_worker_exit(shard)
+
+    def _start_call(self, frame: tuple) -> Awaitable:
+        """Starts a worker's call on the pool's object, in the order of the frames.
+
+        The target is looked up before a later "done" frame can release it, and
+        scheduled calls join their chat's queue in the order the worker sent them.
+        """
+        if frame[0] == "send":
+            _, _, chat_id, ref, name, args, kwargs, priority = frame
+        else:
+            _, _, ref, name, args, kwargs = frame
+        target = self.registry.get(ref)
+        if isinstance(target, MissingObject):
+            raise LookupError(f"The pool no longer holds object {ref}.")
+        function = getattr(target, name)
+        if frame[0] == "send":
+            return self.scheduler.submit(
+                chat_id, function, *args, priority=SendPriority(priority), **kwargs
+            )
+        return function(*args, **kwargs)
+
+    async def _serve_call(self, shard: Shard, call_id: int, call: Awaitable):
+        """Awaits a worker's call and sends back the outcome."""
+        try:
+            result = await call
+        except Exception as error:  # pylint: disable=broad-except
+            self._reply(shard, call_id, False, error)
+        else:
+            self._reply(shard, call_id, True, result)
+
+    def _reply(self, shard: Shard, call_id: int, ok: bool, value: Any):
+        """Sends the outcome of a call, or its error as text if it cannot be pickled."""
+        assert shard.channel is not None
+        try:
+            shard.channel.send("result", call_id, ok, value)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            shard.channel.send(
+                "result", call_id, False, RuntimeError(f"{value!r} ({error})")
+            )
+
+
+class WorkerPickler(pickle.Pickler):
+    """Sends the stand-ins of a worker's frames as references."""
+
+    def __init__(self, file, worker: "Worker"):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.worker = worker
+
+    def persistent_id(self, obj):
+        if is_remote(obj):
+            return ("ref", obj.ref)
+        return None
+
+
+class WorkerUnpickler(pickle.Unpickler):
+    """Rebuilds the messages and users the pool described as stand-ins."""
+
+    def __init__(self, file, worker: "Worker"):
+        super().__init__(file)
+        self.worker = worker
+
+    def persistent_load(self, pid):
+        kind, description = pid
+        if kind == "message":
+            return RemoteMessage(self.worker, description)
+        return remote_sender(description)
+
+
+class ForwardingScheduler(SendScheduler):
+    """The send scheduler of a worker: it hands every call to the pool's scheduler,
+    which applies the rate limits to all workers at once."""
+
+    def __init__(self, worker: "Worker"):
+        super().__init__()
+        self.worker = worker
+
+    def submit(
+        self,
+        chat_id: int,
+        function: Callable[..., Awaitable[Any]],
+        *args,
+        priority: SendPriority = SendPriority.INTERACTIVE,
+        **kwargs,
+    ) -> asyncio.Future:
+        """Hands a call to the pool's scheduler, returning a future for its result."""
+        return self.worker.forward(chat_id, function, args, kwargs, priority)
+
+
+class Worker:
+    """Handles the updates its pool forwards, in a worker process."""
+
+    def __init__(
+        self,
+        index: int,
+        sock: socket.socket,
+        compiled: CompiledConfig,
+        storage_factory: StorageFactory,
+        handler_factories: list[HandlerFactory],
+        conversation_flow: Type[ConversationFlow] = ConversationFlow,
+        write_behind: bool = True,
+        metrics_interval: float = 2.0,
+        bot_metrics: BotMetrics = metrics,
+        logger=None,
+    ):
+        self.index = index
+        self.sock = sock
+        self.storage_factory = storage_factory
+        self.handler_factories = handler_factories
+        self.conversation_flow = conversation_flow
+        self.scheduler = ForwardingScheduler(self)
+        self.write_behind = write_behind
+        self.metrics_interval = metrics_interval
+        self.bot_metrics = bot_metrics
+        self.logger = logger or logging.getLogger(__name__)
+        self.client = RemoteClient(self)
+        self.dispatcher = UserDispatcher()
+        self.channel: Channel | None = None
+        self._registrations: list[tuple[Callable, Any]] = []
+        self._call_ids = itertools.count()
+        self._calls: dict[int, asyncio.Future] = {}
+        self._handling: set[asyncio.Task] = set()
+        conversation_flow.config_from_compiled(compiled)
+
+    async def run(self):
+        """Serves the pool until it asks the worker to close."""
+        reader, writer = await asyncio.open_connection(sock=self.sock)
+        self.channel = Channel(reader, writer, WorkerPickler, WorkerUnpickler, self)
+        async with self.storage_factory() as storage:
+            buffer = None
+            if self.write_behind:
+                storage = buffer = WriteBehindBuffer(storage)
+            handlers = [
+                factory(self.conversation_flow, storage, scheduler=self.scheduler)
+                for factory in self.handler_factories
+            ]
+            self._registrations = [
+                (handler, builder)
+                for handler in handlers
+                for builder in events.list(handler)
+            ]
+            self.channel.send("ready")
+            reporting = asyncio.create_task(self._report_metrics())
+            try:
+                await self._serve()
+            finally:
+                if self._handling:
+                    await asyncio.gather(*self._handling, return_exceptions=True)
+                await self.dispatcher.close()
+                if buffer is not None:
+                    await buffer.close()
+                reporting.cancel()
+                await asyncio.gather(reporting, return_exceptions=True)
+                self.channel.send("metrics", self.bot_metrics.registry.snapshot())
+                await self.channel.close()
+
+    async def call(self, ref: int, name: str, args: tuple, kwargs: dict) -> Any:
+        """Calls a method of an object of the pool and waits for its result."""
+        future = self._new_call()
+        self.channel.send("call", future.call_id, ref, name, args, kwargs)  # type: ignore
+        return await future
+
+    def forward(
+        self, chat_id: int, function: Callable, args: tuple, kwargs: dict, priority
+    ) -> asyncio.Future:
+        """Hands a scheduled call on a stand-in to the pool's scheduler."""
+        target = getattr(function, "__self__", None)
+        if not is_remote(target):
+            raise TypeError(f"Only calls on the pool's objects can be sent: {function}")
+        future = self._new_call()
+        self.channel.send(  # type: ignore
+            "send",
+            future.call_id,
+            chat_id,
+            target.ref,
+            function.__name__,
+            args,
+            kwargs,
+            int(priority),
+        )
+        return future
+
+    async def _report_metrics(self):
+        """Sends the worker's metrics to the pool every `metrics_interval` seconds."""
+        while True:
+            self.channel.send(  # type: ignore
+                "metrics", self.bot_metrics.registry.snapshot()
+            )
+            await asyncio.sleep(self.metrics_interval)
+
+    def _new_call(self) -> asyncio.Future:
+        """Creates the future of a call, resolved by the pool's result frame."""
+        future = asyncio.get_running_loop().create_future()
+        future.call_id = next(self._call_ids)  # type: ignore
+        self._calls[future.call_id] = future  # type: ignore
+        return future
+
+    async def _serve(self):
+        """Dispatches forwarded updates and resolves the results of calls."""
+        assert self.channel is not None
+        while True:
+            frame = await self.channel.receive()
+            if frame is None or frame[0] == "close":
+                return
+            if frame[0] == "event":
+                _, ref, description = frame
+                task = asyncio.create_task(
+                    self._handle(ref, remote_event(self, description))
+                )
+                self._handling.add(task)
+                task.add_done_callback(self._handling.discard)
+            elif frame[0] == "result":
+                _, call_id, ok, value = frame
+                future = self._calls.pop(call_id, None)
+                if future is None or future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    async def _handle(self, ref: int, event):
+        """Runs the matching handlers in the sender's mailbox, then reports back."""
+        error = None
+        try:
+            await self.dispatcher.dispatch(self._run_handlers, event)
+        except Exception as exception:  # pylint: disable=broad-except
+            self.logger.exception("Worker %s failed to handle an update", self.index)
+            error = repr(exception)
+        self.channel.send("done", ref, error)  # type: ignore
+
+    async def _run_handlers(self, event):
+        """Runs the handlers whose builders match, honouring StopPropagation."""
+        for handler, builder in self._registrations:
+            if not isinstance(event, builder.Event):
+                continue
+            await builder.resolve(self.client)
+            matched = builder.filter(event)
+            if asyncio.iscoroutine(matched):
+                matched = await matched
+            if not matched:
+                continue
+            try:
+                await handler(event)
+            except events.StopPropagation:
+                break
+
+
+def run_worker(
+    index: int,
+    sock: socket.socket,
+    compiled: CompiledConfig,
+    storage_factory: StorageFactory,
+    handler_factories: list[HandlerFactory],
+    write_behind: bool = True,
+    metrics_interval: float = 2.0,
+):
+    """The entry point of a worker process."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s worker-{index} %(name)s %(levelname)s %(message)s",
+    )
+    worker = Worker(
+        index,
+        sock,
+        compiled,
+        storage_factory,
+        handler_factories,
+        write_behind=write_behind,
+        metrics_interval=metrics_interval,
+    )
+    asyncio.run(worker.run())
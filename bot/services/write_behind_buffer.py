@@ -0,0 +1,420 @@
+"""../bot/services/write_behind_buffer.py"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+from botocore.exceptions import ClientError
+
+from bot.services.dynamodb_constants import DynamoDBKeySchema
+from bot.services.dynamodb_crud_manager import ConditionalCheckFailedError
+from bot.services.dynamodb_expressions import AttributePath
+from bot.services.dynamodb_query import QueryPage
+from bot.services.storage import Storage
+
+if TYPE_CHECKING:
+    from boto3.dynamodb.conditions import ConditionBase
+
+ItemKey = tuple[str, str]
+Path = tuple[str, ...]
+
+
+def _as_path(path: AttributePath) -> Path:
+    """Normalizes an attribute path to a tuple of names."""
+    return (path,) if isinstance(path, str) else tuple(path)
+
+
+def _is_within(path: Path, ancestor: Path) -> bool:
+    """Whether the path is the ancestor itself or lies inside it."""
+    return path[: len(ancestor)] == ancestor
+
+
+class PendingUpdate:
+    """The merged, not yet written changes to one item.
+
+    Later changes overwrite earlier ones on the same path, and changes inside a
+    map that is itself pending are applied to the pending map value, so that
+    the update never contains overlapping document paths.
+    """
+
+    def __init__(self):
+        self.sets: dict[Path, Any] = {}
+        self.removes: dict[Path, None] = {}
+        self.map_entries: dict[str, dict[str, Any]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.sets or self.removes or self.map_entries)
+
+    def set(self, path: Path, value: Any) -> bool:
+        """Merges a set; returns False if it conflicts with a pending remove."""
+        for length in range(1, len(path)):
+            ancestor = path[:length]
+            if ancestor in self.removes:
+                return False
+            if isinstance(self.sets.get(ancestor), dict):
+                self._set_in_value(ancestor, path[length:], value)
+                return True
+        if len(path) > 1 and path[0] in self.map_entries:
+            return False
+        self._discard_within(path)
+        self.sets[path] = value
+        return True
+
+    def set_map_entry(self, attribute: str, key: str, value: Any) -> bool:
+        """Merges a map entry write whose map may not exist yet."""
+        path = (attribute,)
+        if path in self.removes:
+            del self.removes[path]
+            self.sets[path] = {key: value}
+        elif isinstance(self.sets.get(path), dict):
+            self._set_in_value(path, (key,), value)
+        else:
+            self._discard_within(path + (key,))
+            self.map_entries.setdefault(attribute, {})[key] = value
+        return True
+
+    def remove(self, path: Path) -> bool:
+        """Merges a remove; returns False if it conflicts with a pending map entry."""
+        for length in range(1, len(path)):
+            ancestor = path[:length]
+            if ancestor in self.removes:
+                return True
+            value = self.sets.get(ancestor)
+            if isinstance(value, dict):
+                self._remove_in_value(ancestor, path[length:])
+                return True
+        if len(path) > 1 and path[0] in self.map_entries:
+            return False
+        self._discard_within(path)
+        self.removes[path] = None
+        return True
+
+    def _discard_within(self, path: Path):
+        """Drops pending changes to the path and to everything inside it."""
+        for pending in [p for p in self.sets if _is_within(p, path)]:
+            del self.sets[pending]
+        for pending in [p for p in self.removes if _is_within(p, path)]:
+            del self.removes[pending]
+        if len(path) == 1:
+            self.map_entries.pop(path[0], None)
+        elif len(path) == 2 and path[0] in self.map_entries:
+            self.map_entries[path[0]].pop(path[1], None)
+            if not self.map_entries[path[0]]:
+                del self.map_entries[path[0]]
+
+    def _set_in_value(self, ancestor: Path, rest: Path, value: Any):
+        """Sets a nested entry inside a pending map value, copying on write."""
+        root = dict(self.sets[ancestor])
+        self.sets[ancestor] = root
+        for name in rest[:-1]:
+            child = root.get(name)
+            root[name] = dict(child) if isinstance(child, dict) else {}
+            root = root[name]
+        root[rest[-1]] = value
+
+    def _remove_in_value(self, ancestor: Path, rest: Path):
+        """Removes a nested entry from a pending map value, copying on write."""
+        root = dict(self.sets[ancestor])
+        self.sets[ancestor] = root
+        for name in rest[:-1]:
+            child = root.get(name)
+            if not isinstance(child, dict):
+                return
+            root[name] = dict(child)
+            root = root[name]
+        root.pop(rest[-1], None)
+
+
+class WriteBehindBuffer:
+    """Buffers unconditional attribute writes and coalesces them per item.
+
+    It wraps any Storage and offers the same interface. Sets, map
+    entries and removes are merged into one UpdateItem per item, written when
+    `flush` is called for the item, when `flush_interval` seconds have passed
+    since its first pending change, or when everything is flushed on shutdown.
+    Reads of an item flush it first, and conditional, additive or whole-item
+    writes flush it before running, so callers always see their own writes.
+
+    A failed write, such as a throttled one, keeps its update and the later
+    ones pending ahead of any newer changes; the flush raises, and the item is
+    flushed again after `flush_interval` seconds, doubling up to
+    `max_retry_interval` while it keeps failing. Writes whose condition fails,
+    which only a wrapped LeaseFencedStorage adds, are dropped instead.
+    """
+
+    def __init__(
+        self,
+        dynamodb_crud_manager: Storage,
+        flush_interval: float = 0.5,
+        max_retry_interval: float = 30.0,
+        logger=None,
+    ):
+        self.dynamodb_crud_manager = dynamodb_crud_manager
+        self.flush_interval = flush_interval
+        self.max_retry_interval = max_retry_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._pending: dict[ItemKey, list[PendingUpdate]] = {}
+        self._timers: dict[ItemKey, asyncio.TimerHandle] = {}
+        self._flushes: dict[ItemKey, asyncio.Future] = {}
+        self._retry_intervals: dict[ItemKey, float] = {}
+        self._background: set[asyncio.Task] = set()
+        self.buffered_writes = 0
+        self.flushed_writes = 0
+        self.failed_flushes = 0
+
+    def __getattr__(self, name):
+        """Delegate attribute access to the wrapped CRUD manager."""
+        return getattr(self.dynamodb_crud_manager, name)
+
+    @property
+    def pending_keys(self) -> list[ItemKey]:
+        """The keys of the items with unwritten changes."""
+        return list(self._pending)
+
+    async def get_item(
+        self, pk: str, sk: str | None = None, consistent: bool = False
+    ) -> dict:
+        """Flushes the item, then retrieves it."""
+        if sk is not None:
+            await self.flush(pk, sk)
+        return await self.dynamodb_crud_manager.get_item(pk, sk, consistent=consistent)
+
+    async def get_attributes(
+        self,
+        pk: str,
+        sk: str,
+        names: list[str],
+        consistent: bool = False,
+    ) -> dict:
+        """Flushes the item, then retrieves the given attributes of it."""
+        await self.flush(pk, sk)
+        return await self.dynamodb_crud_manager.get_attributes(
+            pk, sk, names=names, consistent=consistent
+        )
+
+    async def get_attribute(
+        self,
+        attribute: str,
+        pk: str,
+        sk: str,
+    ) -> str | dict | list | None:
+        """Flushes the item, then retrieves an attribute of it."""
+        item = await self.get_attributes(pk, sk, names=[attribute])
+        return item.get(attribute)
+
+    async def get_items_from_index(self, index_name, pk, sk=None):
+        """Flushes all items, then queries the index."""
+        await self.flush()
+        return await self.dynamodb_crud_manager.get_items_from_index(
+            index_name, pk, sk
+        )
+
+    async def query_pages(self, pk: str, *args, **kwargs) -> AsyncIterator[QueryPage]:
+        """Flushes all items, then queries page by page."""
+        await self.flush()
+        async for page in self.dynamodb_crud_manager.query_pages(pk, *args, **kwargs):
+            yield page
+
+    async def query(self, pk: str, *args, **kwargs) -> AsyncIterator[dict]:
+        """Flushes all items, then queries item by item."""
+        await self.flush()
+        async for item in self.dynamodb_crud_manager.query(pk, *args, **kwargs):
+            yield item
+
+    async def put_item(self, item: dict, condition: "ConditionBase | None" = None):
+        """Flushes the item, then puts it."""
+        await self.flush(*self._item_key(item))
+        await self.dynamodb_crud_manager.put_item(item, condition=condition)
+
+    async def update_attributes(
+        self,
+        attributes: dict[AttributePath, Any],
+        pk: str,
+        sk: str,
+        add: dict[AttributePath, Any] | None = None,
+        append: dict[AttributePath, list] | None = None,
+        remove: list[AttributePath] | None = None,
+        condition: "ConditionBase | None" = None,
+    ):
+        """Buffers plain sets and removes; runs other updates after a flush."""
+        if add or append or condition is not None:
+            await self.flush(pk, sk)
+            return await self.dynamodb_crud_manager.update_attributes(
+                attributes, pk, sk, add=add, append=append, remove=remove, condition=condition
+            )
+        for path, value in attributes.items():
+            self._buffer((pk, sk), lambda update, p=_as_path(path), v=value: update.set(p, v))
+        for path in remove or []:
+            self._buffer((pk, sk), lambda update, p=_as_path(path): update.remove(p))
+        return {}
+
+    async def set_map_entry(
+        self,
+        attribute: str,
+        key: str,
+        value: Any,
+        pk: str,
+        sk: str,
+    ):
+        """Buffers a map entry write."""
+        return await self.set_map_entries(attribute, {key: value}, pk, sk)
+
+    async def set_map_entries(
+        self,
+        attribute: str,
+        entries: dict[str, Any],
+        pk: str,
+        sk: str,
+        condition: "ConditionBase | None" = None,
+    ):
+        """Buffers map entry writes; runs conditional ones after a flush."""
+        if condition is not None:
+            await self.flush(pk, sk)
+            return await self.dynamodb_crud_manager.set_map_entries(
+                attribute, entries, pk, sk, condition=condition
+            )
+        for key, value in entries.items():
+            self._buffer(
+                (pk, sk),
+                lambda update, k=key, v=value: update.set_map_entry(attribute, k, v),
+            )
+        return {}
+
+    async def delete_attributes(
+        self,
+        attributes: list[str],
+        pk: str,
+        sk: str,
+    ):
+        """Buffers attribute removals."""
+        return await self.update_attributes({}, pk, sk, remove=list(attributes))
+
+    async def flush(self, pk: str | None = None, sk: str | None = None):
+        """Writes the pending changes of an item, or of all items if no key is given."""
+        if pk is None or sk is None:
+            keys = set(self._pending) | set(self._flushes)
+            await asyncio.gather(*(self.flush(*key) for key in keys))
+            if self._background:
+                await asyncio.gather(*self._background, return_exceptions=True)
+            return
+        key = (pk, sk)
+        if key not in self._pending and key not in self._flushes:
+            return
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        previous = self._flushes.get(key)
+        flush = asyncio.ensure_future(self._flush_after(key, previous))
+        self._flushes[key] = flush
+        try:
+            await flush
+        finally:
+            if self._flushes.get(key) is flush:
+                del self._flushes[key]
+
+    async def close(self):
+        """Flushes everything and stops the flush timers.
+
+        Raises if a write still fails; its changes are then lost.
+        """
+        try:
+            await self.flush()
+        finally:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+
+    def _buffer(self, key: ItemKey, merge):
+        """Merges a change into the item's last pending update, starting a new one on conflict."""
+        updates = self._pending.setdefault(key, [PendingUpdate()])
+        if not merge(updates[-1]):
+            updates.append(PendingUpdate())
+            merge(updates[-1])
+        self.buffered_writes += 1
+        if key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.flush_interval, self._flush_in_background, key
+            )
+
+    def _flush_in_background(self, key: ItemKey):
+        """Flushes an item when its timer fires, logging failures."""
+        self._timers.pop(key, None)
+
+        async def flush():
+            try:
+                await self.flush(*key)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Failed to flush buffered writes for %s", key)
+
+        task = asyncio.create_task(flush())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _flush_after(self, key: ItemKey, previous: asyncio.Future | None):
+        """Writes an item's pending updates once its previous flush has finished."""
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        updates = self._pending.pop(key, [])
+        for index, update in enumerate(updates):
+            if not update:
+                continue
+            try:
+                await self._write(key, update)
+            except ConditionalCheckFailedError:
+                # A write fenced off, such as by a lost user lease, must not land later.
+                self.failed_flushes += 1
+                self._retry_intervals.pop(key, None)
+                self.logger.warning("Dropped fenced off writes for %s", key)
+                raise
+            except Exception:
+                # Rewriting what a partial write already stored is harmless.
+                self._pending[key] = updates[index:] + self._pending.get(key, [])
+                self.failed_flushes += 1
+                self._retry_later(key)
+                raise
+        self._retry_intervals.pop(key, None)
+
+    def _retry_later(self, key: ItemKey):
+        """Flushes an item again after a backoff that doubles while it keeps failing."""
+        interval = self._retry_intervals.get(key, self.flush_interval)
+        self._retry_intervals[key] = min(interval * 2, self.max_retry_interval)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[key] = asyncio.get_running_loop().call_later(
+            interval, self._flush_in_background, key
+        )
+
+    async def _write(self, key: ItemKey, update: PendingUpdate):
+        """Writes one merged update, creating missing maps for buffered map entries."""
+        pk, sk = key
+        attributes: dict[AttributePath, Any] = dict(update.sets)
+        for attribute, entries in update.map_entries.items():
+            for entry, value in entries.items():
+                attributes[(attribute, entry)] = value
+        try:
+            await self.dynamodb_crud_manager.update_attributes(
+                attributes, pk, sk, remove=list(update.removes)
+            )
+            self.flushed_writes += 1
+            return
+        except ClientError as error:
+            if (
+                not update.map_entries
+                or error.response["Error"]["Code"] != "ValidationException"
+            ):
+                raise
+        # One of the maps does not exist yet.
+        if update.sets or update.removes:
+            await self.dynamodb_crud_manager.update_attributes(
+                dict(update.sets), pk, sk, remove=list(update.removes)
+            )
+            self.flushed_writes += 1
+        for attribute, entries in update.map_entries.items():
+            await self.dynamodb_crud_manager.set_map_entries(attribute, entries, pk, sk)
+            self.flushed_writes += 1
+
+    @staticmethod
+    def _item_key(item: dict) -> ItemKey:
+        """Gets the primary key of an item."""
+        return item[DynamoDBKeySchema.PK.value], item[DynamoDBKeySchema.SK.value]
@@ -1,9 +1,10 @@
 """../bot/state_machine.py"""
 
-from transitions.extensions.asyncio import HierarchicalAsyncMachine
-
+from bot.compiled_state_machine import CompiledStateMachine
 from config.state_machine.state_machine_config import StateMachineConfig
 
+AUTO_TRIGGER_PREFIX = "@"
+
 
 class ConversationFlowStateMachine:
     """A class representing a conversation flow state machine."""
@@ -11,9 +12,17 @@ class ConversationFlowStateMachine:
     def __init__(self, config: StateMachineConfig):
         self.config = config
         self.machine = self._create_state_machine()
+        self._auto_triggers = {
+            state: [
+                trigger
+                for trigger in self.machine.get_triggers(state)
+                if trigger.startswith(AUTO_TRIGGER_PREFIX)
+            ]
+            for state in self.machine.states
+        }
 
     def _create_state_machine(self):
-        return HierarchicalAsyncMachine(
+        return CompiledStateMachine(
             model=None,
             states=self.config.states,
             transitions=self.config.transitions,
@@ -33,8 +42,64 @@ class ConversationFlowStateMachine:
         """Removes a conversation from the state machine."""
         self.machine.remove_model(model)
 
+    def get_auto_triggers(self, state: str) -> list[str]:
+        """Gets the auto-advance triggers valid from the given state."""
+        return self._auto_triggers[state]
+
+    def validate(self, model_class: type) -> list[str]:
+        """Lists the problems of the config the compiled machine did not catch.
+
+        Callback names must be methods of the model class, and the states and
+        triggers the config refers to must exist.
+        """
+        machine = self.machine
+        problems = []
+        callbacks = {
+            "machine": machine.prepare_event
+            + machine.before_state_change
+            + machine.after_state_change
+            + machine.finalize_event
+            + machine.on_exception
+        }
+        for name, state in machine.states.items():
+            callbacks[f"state {name}"] = state.on_enter + state.on_exit
+        for trigger, sources in machine._transitions.items():  # pylint: disable=protected-access
+            for source, transitions in sources.items():
+                for transition in transitions:
+                    callbacks[f"transition {trigger} from {source}"] = (
+                        transition.prepare
+                        + tuple(func for func, _ in transition.conditions)
+                        + transition.before
+                        + transition.after
+                    )
+        for where, funcs in callbacks.items():
+            for func in funcs:
+                if isinstance(func, str) and not hasattr(model_class, func):
+                    problems.append(f"{where}: unknown callback '{func}'")
+
+        if self.config.initial_state not in machine.states:
+            problems.append(f"unknown initial state '{self.config.initial_state}'")
+        if self.config.initial_trigger not in machine.events:
+            problems.append(f"unknown initial trigger '{self.config.initial_trigger}'")
+        for section in ("messages", "inline_buttons", "destinations"):
+            for state in getattr(self.config, section):
+                if state not in machine.states:
+                    problems.append(f"{section}: unknown state '{state}'")
+        for state, rows in self.config.inline_buttons.items():
+            for row in rows:
+                for button in row if isinstance(row, list) else [row]:
+                    if button not in machine.events:
+                        problems.append(
+                            f"inline_buttons: button '{button}' of '{state}' "
+                            "triggers no transition"
+                        )
+        return problems
+
     def __getattr__(self, name):
         """Delegate attribute access to the underlying state machine."""
+        if name == "machine":
+            # Not set yet, as while unpickling.
+            raise AttributeError(name)
         return getattr(self.machine, name)
 
 
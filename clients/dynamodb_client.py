@@ -1,9 +1,24 @@
 """../clients/dynamodb_client.py"""
 
-from typing import Any
+import asyncio
+from typing import TYPE_CHECKING, Any, Protocol
 
-import aioboto3
-from aioboto3.session import ResourceCreatorContext
+from utils.import_utils import LazyModule, preload_modules
+
+if TYPE_CHECKING:
+    from aioboto3.session import ResourceCreatorContext
+
+# boto3 takes about a tenth of a second to import, so it is imported when the
+# client is entered rather than with the bot.
+aioboto3 = LazyModule("aioboto3")
+conditions = LazyModule("boto3.dynamodb.conditions")
+
+
+class DynamoDBResource(Protocol):
+    """What DynamoDBCrudManager runs on: DynamoDBClient, or an in-process stand-in."""
+
+    async def Table(self, name: str) -> Any:  # pylint: disable=invalid-name
+        """Returns the table with the given name."""
 
 
 class DynamoDBClient:
@@ -11,17 +26,24 @@ class DynamoDBClient:
 
     def __init__(self, region_name: str):
         self._region_name = region_name
-        self._session = aioboto3.Session(
-            region_name=self._region_name,
-        )
-        self._resource: ResourceCreatorContext
+        self._resource: "ResourceCreatorContext"
 
     def __getattr__(self, name: str) -> Any:
         assert self._resource is not None, "Resource is not initialized."
         return getattr(self._resource, name)
 
+    async def Table(self, name: str) -> Any:  # pylint: disable=invalid-name
+        """Returns the table with the given name."""
+        return await self._resource.Table(name)
+
     async def __aenter__(self):
-        self._resource = await self._session.resource(
+        # Imported in a thread so the event loop keeps serving, for example the
+        # Telegram handshake started alongside.
+        await asyncio.to_thread(preload_modules, aioboto3, conditions)
+        session = aioboto3.Session(
+            region_name=self._region_name,
+        )
+        self._resource = await session.resource(
             "dynamodb",
         ).__aenter__()
         return self
@@ -0,0 +1,608 @@
+"""../clients/fake_telethon_client.py"""
+
+import asyncio
+import datetime
+import inspect
+import itertools
+import logging
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from telethon import events
+from telethon.errors import (
+    FloodWaitError,
+    MessageIdInvalidError,
+    MessageNotModifiedError,
+)
+from telethon.events.common import EventBuilder
+from telethon.tl.types import User
+
+Latency = float | Callable[[str], float]
+
+
+def _peer_id(entity) -> int:
+    """Returns the chat ID of an entity given as an ID, a user or a message."""
+    if isinstance(entity, int):
+        return entity
+    if isinstance(entity, FakeMessage):
+        return entity.chat_id
+    return int(getattr(entity, "id", entity))
+
+
+class OutboundCall:
+    """A recorded call of the bot to Telegram."""
+
+    __slots__ = ("method", "chat_id", "message_id", "text", "kwargs", "at")
+
+    def __init__(
+        self,
+        method: str,
+        chat_id: int,
+        message_id: int | None,
+        text: str | None,
+        kwargs: dict[str, Any],
+        at: float,
+    ):
+        self.method = method
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.kwargs = kwargs
+        self.at = at
+
+    def __repr__(self) -> str:
+        return (
+            f"OutboundCall({self.method}, chat_id={self.chat_id}, "
+            f"message_id={self.message_id}, text={self.text!r})"
+        )
+
+
+class FakeMessage:
+    """A message kept by FakeTelegramClient, with the members our handlers use."""
+
+    def __init__(
+        self,
+        client: "FakeTelegramClient",
+        chat_id: int,
+        message_id: int,
+        text: str,
+        sender: User | None,
+        out: bool,
+        reply_to_msg_id: int | None = None,
+        reply_to_top_id: int | None = None,
+        buttons=None,
+    ):
+        self.client = client
+        self.chat_id = chat_id
+        self.id = message_id
+        self.text = text
+        self.sender = sender
+        self.sender_id = sender.id if sender is not None else None
+        self.out = out
+        self.buttons = buttons
+        self.date = datetime.datetime.now(datetime.timezone.utc)
+        self.fwd_from = None
+        self.post = False
+        self.reply_to_msg_id = reply_to_msg_id
+        self.reply_to = (
+            SimpleNamespace(
+                reply_to_msg_id=reply_to_msg_id, reply_to_top_id=reply_to_top_id
+            )
+            if reply_to_msg_id is not None
+            else None
+        )
+
+    @property
+    def message(self) -> str:
+        """The raw text, as on Telethon messages."""
+        return self.text
+
+    @property
+    def is_reply(self) -> bool:
+        return self.reply_to_msg_id is not None
+
+    @property
+    def is_private(self) -> bool:
+        return self.chat_id > 0
+
+    @property
+    def is_group(self) -> bool:
+        return self.chat_id < 0
+
+    @property
+    def is_channel(self) -> bool:
+        return False
+
+    async def get_sender(self) -> User | None:
+        return self.sender
+
+    async def get_reply_message(self) -> "FakeMessage | None":
+        if self.reply_to_msg_id is None:
+            return None
+        return await self.client.get_messages(self.chat_id, ids=self.reply_to_msg_id)
+
+    async def respond(self, *args, **kwargs) -> "FakeMessage":
+        return await self.client.send_message(self.chat_id, *args, **kwargs)
+
+    async def reply(self, *args, **kwargs) -> "FakeMessage":
+        kwargs["reply_to"] = self.id
+        return await self.client.send_message(self.chat_id, *args, **kwargs)
+
+    async def edit(self, *args, **kwargs) -> "FakeMessage":
+        return await self.client.edit_message(self.chat_id, self.id, *args, **kwargs)
+
+
+class FakeNewMessageEvent(events.NewMessage.Event):
+    """A NewMessage event carrying a FakeMessage."""
+
+    def __init__(self, message: FakeMessage):  # pylint: disable=super-init-not-called
+        self.__dict__["_init"] = False
+        self.__dict__["_client"] = message.client
+        self.original_update = None
+        self.pattern_match = None
+        self.message = message
+        self.__dict__["_init"] = True
+
+    @property
+    def client(self):
+        return self.__dict__["_client"]
+
+    @property
+    def chat_id(self) -> int:
+        return self.message.chat_id
+
+    @property
+    def chat(self):
+        return None
+
+    @property
+    def is_private(self) -> bool:
+        return self.message.is_private
+
+    @property
+    def is_group(self) -> bool:
+        return self.message.is_group
+
+    @property
+    def is_channel(self) -> bool:
+        return self.message.is_channel
+
+
+class FakeCallbackQueryEvent(events.CallbackQuery.Event):
+    """A CallbackQuery event for a button of a message sent by the bot."""
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self,
+        client: "FakeTelegramClient",
+        sender: User,
+        chat_id: int,
+        message_id: int,
+        data: bytes,
+    ):
+        self._fake_client = client
+        self._fake_sender = sender
+        self._fake_chat_id = chat_id
+        self._fake_message_id = message_id
+        self._fake_data = data
+        self.original_update = None
+        self.pattern_match = None
+        self.data_match = None
+        self._answered = False
+
+    @property
+    def client(self):
+        return self._fake_client
+
+    @property
+    def sender(self) -> User:
+        return self._fake_sender
+
+    @property
+    def sender_id(self) -> int:
+        return self._fake_sender.id
+
+    @property
+    def chat_id(self) -> int:
+        return self._fake_chat_id
+
+    @property
+    def chat(self):
+        return None
+
+    @property
+    def is_private(self) -> bool:
+        return self._fake_chat_id > 0
+
+    @property
+    def id(self) -> int:
+        return self._fake_message_id
+
+    @property
+    def message_id(self) -> int:
+        return self._fake_message_id
+
+    @property
+    def data(self) -> bytes:
+        return self._fake_data
+
+    @property
+    def query(self) -> SimpleNamespace:
+        return SimpleNamespace(
+            data=self._fake_data, chat_instance=0, msg_id=self._fake_message_id
+        )
+
+    async def answer(self, *args, **kwargs):
+        if self._answered:
+            return
+        self._answered = True
+        await self._fake_client.answer_callback_query(
+            self._fake_chat_id, *args, **kwargs
+        )
+
+    async def respond(self, *args, **kwargs) -> FakeMessage:
+        return await self._fake_client.send_message(self._fake_chat_id, *args, **kwargs)
+
+    async def reply(self, *args, **kwargs) -> FakeMessage:
+        kwargs["reply_to"] = self._fake_message_id
+        return await self._fake_client.send_message(self._fake_chat_id, *args, **kwargs)
+
+    async def edit(self, *args, **kwargs) -> FakeMessage:
+        return await self._fake_client.edit_message(
+            self._fake_chat_id, self._fake_message_id, *args, **kwargs
+        )
+
+    async def get_message(self) -> FakeMessage | None:
+        return await self._fake_client.get_messages(
+            self._fake_chat_id, ids=self._fake_message_id
+        )
+
+
+class FakeTelegramClient:
+    """An in-process stand-in for TelegramClient.
+
+    It offers the calls our handlers make (`send_message`, `edit_message`,
+    `get_messages`, and `respond`/`edit` on events) and records each of them
+    in `calls`. Every call first sleeps for `latency` seconds (or
+    `latency(method)` seconds), then fails with a FloodWaitError of
+    `flood_wait_seconds` with probability `flood_wait_rate`, drawn from a
+    generator seeded with `seed`. Failed calls are recorded too, with
+    `flood_wait` in their kwargs.
+
+    It is also the event factory: `new_message`, `reply` and `callback_query`
+    build incoming events, and `dispatch` runs them through the handlers added
+    with `add_event_handler`, in order and honouring StopPropagation as
+    Telethon does.
+    """
+
+    def __init__(
+        self,
+        latency: Latency = 0.0,
+        flood_wait_rate: float = 0.0,
+        flood_wait_seconds: int = 1,
+        seed: int | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        logger=None,
+    ):
+        self.latency = latency
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self._random = random.Random(seed)
+        self._clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self.me = User(id=1, bot=True, username="fake_bot", first_name="Bot")
+        self.calls: list[OutboundCall] = []
+        self.messages: dict[tuple[int, int], FakeMessage] = {}
+        self.flood_waits = 0
+        self.handler_errors = 0
+        self.completed_calls: Counter[int] = Counter()
+        self._call_waiters: dict[int, list[tuple[int, asyncio.Future]]] = {}
+        self._message_ids: dict[int, itertools.count] = {}
+        self._last_sent: dict[int, int] = {}
+        self._handlers: list[tuple[Callable, EventBuilder]] = []
+        self._disconnected = asyncio.Event()
+
+    # Connection.
+
+    async def connect(self):
+        self._disconnected.clear()
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def disconnect(self):
+        self._disconnected.set()
+
+    async def run_until_disconnected(self):
+        await self._disconnected.wait()
+
+    async def get_me(self) -> User:
+        return self.me
+
+    # Outbound calls.
+
+    async def send_message(
+        self,
+        entity,
+        message: Any = "",
+        *,
+        reply_to: int | FakeMessage | None = None,
+        buttons=None,
+        **kwargs,
+    ) -> FakeMessage:
+        """Sends a text, or a copy of a message, to a chat."""
+        chat_id = _peer_id(entity)
+        text = message.text if isinstance(message, FakeMessage) else str(message)
+        reply_to_msg_id = reply_to.id if isinstance(reply_to, FakeMessage) else reply_to
+        call = await self._call(
+            "send_message",
+            chat_id,
+            None,
+            text,
+            dict(kwargs, reply_to=reply_to_msg_id, buttons=buttons),
+        )
+        sent = self._new_message(
+            chat_id,
+            text,
+            self.me,
+            out=True,
+            reply_to_msg_id=reply_to_msg_id,
+            buttons=buttons,
+        )
+        call.message_id = sent.id
+        self._last_sent[chat_id] = sent.id
+        self._complete(chat_id)
+        return sent
+
+    async def edit_message(
+        self,
+        entity,
+        message: int | FakeMessage | None = None,
+        text: str | None = None,
+        *,
+        buttons=None,
+        **kwargs,
+    ) -> FakeMessage:
+        """Edits the text or buttons of a message the bot sent."""
+        chat_id = _peer_id(entity)
+        message_id = message.id if isinstance(message, FakeMessage) else message
+        await self._call(
+            "edit_message",
+            chat_id,
+            message_id,
+            text,
+            dict(kwargs, buttons=buttons),
+        )
+        existing = self.messages.get((chat_id, message_id))  # type: ignore
+        if existing is None or not existing.out:
+            raise MessageIdInvalidError(request=None)
+        new_text = existing.text if text is None else text
+        if (new_text, buttons) == (existing.text, existing.buttons):
+            raise MessageNotModifiedError(request=None)
+        existing.text = new_text
+        existing.buttons = buttons
+        self._complete(chat_id)
+        return existing
+
+    async def get_messages(self, entity, ids: int | None = None, **kwargs):
+        """Gets a message by ID, or the recorded messages of a chat."""
+        chat_id = _peer_id(entity)
+        await self._call("get_messages", chat_id, ids, None, kwargs)
+        if ids is not None:
+            return self.messages.get((chat_id, ids))
+        return [message for key, message in self.messages.items() if key[0] == chat_id]
+
+    async def answer_callback_query(self, chat_id: int, *args, **kwargs):
+        """Answers a callback query."""
+        await self._call(
+            "answer_callback_query", chat_id, None, None, dict(kwargs, args=args)
+        )
+
+    async def wait_for_calls(
+        self, chat_id: int, count: int, timeout: float | None = None
+    ) -> bool:
+        """Waits until `count` sends or edits to the chat have completed.
+
+        Returns False if they have not completed within `timeout` seconds.
+        """
+        if self.completed_calls[chat_id] >= count:
+            return True
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._call_waiters.setdefault(chat_id, [])
+        waiters.append((count, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters.remove((count, future))
+            if not waiters:
+                del self._call_waiters[chat_id]
+        return True
+
+    def calls_to(self, chat_id: int, method: str | None = None) -> list[OutboundCall]:
+        """The recorded calls to a chat, optionally of one method."""
+        return [
+            call
+            for call in self.calls
+            if call.chat_id == chat_id and (method is None or call.method == method)
+        ]
+
+    # Incoming updates.
+
+    def new_message(
+        self,
+        sender_id: int,
+        text: str,
+        chat_id: int | None = None,
+        sender: User | None = None,
+    ) -> FakeNewMessageEvent:
+        """Builds a NewMessage event for a message sent by a user to the bot or a group."""
+        sender = sender or self.user(sender_id)
+        message = self._new_message(
+            sender_id if chat_id is None else chat_id, text, sender, out=False
+        )
+        return FakeNewMessageEvent(message)
+
+    def reply(
+        self,
+        sender_id: int,
+        text: str,
+        chat_id: int,
+        reply_to_msg_id: int,
+        reply_to_top_id: int | None = None,
+        sender: User | None = None,
+    ) -> FakeNewMessageEvent:
+        """Builds a NewMessage event for a reply to a message in a chat."""
+        message = self._new_message(
+            chat_id,
+            text,
+            sender or self.user(sender_id),
+            out=False,
+            reply_to_msg_id=reply_to_msg_id,
+            reply_to_top_id=reply_to_top_id,
+        )
+        return FakeNewMessageEvent(message)
+
+    def callback_query(
+        self,
+        sender_id: int,
+        data: str | bytes,
+        message_id: int | None = None,
+        chat_id: int | None = None,
+        sender: User | None = None,
+    ) -> FakeCallbackQueryEvent:
+        """Builds a CallbackQuery event for a button of a message the bot sent.
+
+        The message defaults to the last one the bot sent to the chat.
+        """
+        chat_id = sender_id if chat_id is None else chat_id
+        if message_id is None:
+            message_id = self._last_sent.get(chat_id, 0)
+        return FakeCallbackQueryEvent(
+            self,
+            sender or self.user(sender_id),
+            chat_id,
+            message_id,
+            data.encode() if isinstance(data, str) else data,
+        )
+
+    @staticmethod
+    def user(user_id: int) -> User:
+        """Builds the user entity of a sender."""
+        return User(
+            id=user_id,
+            username=f"user{user_id}",
+            first_name=f"User {user_id}",
+            last_name=None,
+        )
+
+    def add_event_handler(self, callback: Callable, event: EventBuilder):
+        """Adds a handler, as TelegramClient.add_event_handler does."""
+        self._handlers.append((callback, event))
+
+    async def dispatch(self, event) -> int:
+        """Runs the event through the matching handlers, returning how many ran."""
+        ran = 0
+        for callback, builder in self._handlers:
+            if not isinstance(event, builder.Event):
+                continue
+            await builder.resolve(self)
+            matched = builder.filter(event)
+            if inspect.isawaitable(matched):
+                matched = await matched
+            if not matched:
+                continue
+            ran += 1
+            try:
+                await callback(event)
+            except events.StopPropagation:
+                break
+            except Exception:  # pylint: disable=broad-except
+                self.handler_errors += 1
+                self.logger.exception("Unhandled exception on %s", callback)
+        return ran
+
+    async def _call(
+        self,
+        method: str,
+        chat_id: int,
+        message_id: int | None,
+        text: str | None,
+        kwargs: dict[str, Any],
+    ) -> OutboundCall:
+        """Records the call, waits for its latency and maybe raises a flood wait."""
+        call = OutboundCall(method, chat_id, message_id, text, kwargs, self._clock())
+        self.calls.append(call)
+        latency = self.latency(method) if callable(self.latency) else self.latency
+        await asyncio.sleep(latency)
+        if self.flood_wait_rate and self._random.random() < self.flood_wait_rate:
+            self.flood_waits += 1
+            call.kwargs["flood_wait"] = self.flood_wait_seconds
+            raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+        return call
+
+    def _complete(self, chat_id: int):
+        """Counts a completed send or edit, waking the waiters it satisfies."""
+        self.completed_calls[chat_id] += 1
+        for count, future in self._call_waiters.get(chat_id, ()):
+            if count <= self.completed_calls[chat_id] and not future.done():
+                future.set_result(None)
+
+    def _new_message(
+        self,
+        chat_id: int,
+        text: str,
+        sender: User | None,
+        out: bool,
+        reply_to_msg_id: int | None = None,
+        reply_to_top_id: int | None = None,
+        buttons=None,
+    ) -> FakeMessage:
+        """Stores a new message under the next ID of its chat."""
+        message_ids = self._message_ids.get(chat_id)
+        if message_ids is None:
+            message_ids = self._message_ids[chat_id] = itertools.count(1)
+        message = FakeMessage(
+            self,
+            chat_id,
+            next(message_ids),
+            text,
+            sender,
+            out,
+            reply_to_msg_id=reply_to_msg_id,
+            reply_to_top_id=reply_to_top_id,
+            buttons=buttons,
+        )
+        self.messages[(chat_id, message.id)] = message
+        return message
+
+
+class FakeTelethonClient:
+    """A stand-in for TelethonClient backed by a FakeTelegramClient."""
+
+    def __init__(self, telethon_client: FakeTelegramClient | None = None, logger=None):
+        self.telethon_client = telethon_client or FakeTelegramClient()
+        self.logger = logger or logging.getLogger(__name__)
+
+    async def connect(self):
+        """Connect to the fake Telegram API."""
+        await self.telethon_client.connect()
+        self.logger.info("Fake client started!")
+
+    async def setup(self):
+        """Perform setup tasks for the client."""
+        await self.connect()
+
+    async def cleanup(self):
+        """Clean up resources when the client is done."""
+        await self.telethon_client.disconnect()
+
+    async def __aenter__(self):
+        await self.setup()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.cleanup()
@@ -0,0 +1,1065 @@
+"""../clients/in_memory_dynamodb_client.py"""
+
+import asyncio
+import copy
+import math
+import random
+import re
+from collections import Counter
+from decimal import Decimal
+from typing import Any, Callable
+
+from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+from botocore.exceptions import ClientError
+
+# The key schema of the table and its indexes in scripts/create_dynamodb_table.py.
+TABLE_KEY = ("PK", "SK")
+TABLE_INDEXES = {
+    "GSI1_PK-GSI1_SK-index": ("GSI1_PK", "GSI1_SK"),
+    "GSI2_PK-GSI2_SK-index": ("GSI2_PK", "GSI2_SK"),
+}
+
+# The bytes one read capacity unit reads and one write capacity unit writes.
+READ_UNIT_SIZE = 4096
+WRITE_UNIT_SIZE = 1024
+
+Path = tuple[str | int, ...]
+Latency = float | Callable[[str], float]
+
+_TOKEN = re.compile(r"\s*(#\w+|:\w+|[A-Za-z_]\w*|\[\d+\]|[.,()=+\-])\s*")
+_KEYWORDS = ("SET", "REMOVE", "ADD", "DELETE")
+_MISSING = object()
+
+
+def _client_error(operation: str, code: str, message: str) -> ClientError:
+    """Builds the error botocore raises for a failed DynamoDB call."""
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+def _validation_error(operation: str, message: str) -> ClientError:
+    """Builds the error DynamoDB returns for an invalid request."""
+    return _client_error(operation, "ValidationException", message)
+
+
+def _serialize(value: Any) -> Any:
+    """Copies a value the way boto3 sends it, with numbers as Decimal."""
+    if isinstance(value, bool) or value is None or isinstance(value, (str, bytes)):
+        return value
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, dict):
+        return {key: _serialize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_serialize(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return {_serialize(item) for item in value}
+    return copy.deepcopy(value)
+
+
+def _type_of(value: Any) -> str:
+    """Returns the DynamoDB type descriptor of a stored value."""
+    if isinstance(value, bool):
+        return "BOOL"
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        return "S"
+    if isinstance(value, Decimal):
+        return "N"
+    if isinstance(value, bytes):
+        return "B"
+    if isinstance(value, dict):
+        return "M"
+    if isinstance(value, list):
+        return "L"
+    if isinstance(value, set):
+        member = next(iter(value), "")
+        return {"S": "SS", "N": "NS", "B": "BS"}[_type_of(member)]
+    return type(value).__name__
+
+
+def _size_of(value: Any) -> int:
+    """Returns the approximate size DynamoDB bills for a stored value."""
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, Decimal):
+        digits = len(value.normalize().as_tuple().digits)
+        return (digits + 1) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + sum(
+            len(key.encode("utf-8")) + _size_of(item) + 1 for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return 3 + sum(_size_of(item) + 1 for item in value)
+    if isinstance(value, set):
+        return sum(_size_of(item) for item in value)
+    return len(str(value))
+
+
+def item_size(item: dict | None) -> int:
+    """Returns the approximate size of an item: its attribute names and values."""
+    if not item:
+        return 0
+    return sum(
+        len(name.encode("utf-8")) + _size_of(value) for name, value in item.items()
+    )
+
+
+def _units(size: int, unit_size: int) -> int:
+    """Returns the capacity units of a size, at least one."""
+    return max(1, math.ceil(size / unit_size))
+
+
+def _attribute_path(name: str) -> Path:
+    """Splits a boto3 attribute name such as `a.b[1]` into its path elements."""
+    path: list[str | int] = []
+    for part in re.findall(r"[^.\[\]]+|\[\d+\]", name):
+        path.append(int(part[1:-1]) if part.startswith("[") else part)
+    return tuple(path)
+
+
+def _get_path(item: Any, path: Path) -> Any:
+    """Returns the value at the path, or _MISSING."""
+    value = item
+    for element in path:
+        if isinstance(element, int):
+            if not isinstance(value, list) or element >= len(value):
+                return _MISSING
+        elif not isinstance(value, dict) or element not in value:
+            return _MISSING
+        value = value[element]
+    return value
+
+
+def _set_path(item: dict, path: Path, value: Any, operation: str):
+    """Sets the value at the path, whose parent must exist as in DynamoDB."""
+    parent = _get_path(item, path[:-1])
+    element = path[-1]
+    if isinstance(parent, dict) and isinstance(element, str):
+        parent[element] = value
+    elif isinstance(parent, list) and isinstance(element, int):
+        if element < len(parent):
+            parent[element] = value
+        else:
+            parent.append(value)
+    else:
+        raise _validation_error(
+            operation,
+            "The document path provided in the update expression is invalid for update",
+        )
+
+
+def _remove_path(item: dict, path: Path):
+    """Removes the value at the path if it exists."""
+    parent = _get_path(item, path[:-1])
+    element = path[-1]
+    if isinstance(parent, dict) and element in parent:
+        del parent[element]
+    elif (
+        isinstance(parent, list) and isinstance(element, int) and element < len(parent)
+    ):
+        del parent[element]
+
+
+class _Projection(dict):
+    """A partial copy of a map or list built while projecting an item."""
+
+
+def _project(item: dict, paths: list[Path]) -> dict:
+    """Copies only the given paths of an item, compacting projected lists."""
+    projected = _Projection()
+    for path in paths:
+        value = _get_path(item, path)
+        if value is _MISSING:
+            continue
+        node = projected
+        for element in path[:-1]:
+            child = node.get(element)
+            if child is None:
+                child = node[element] = _Projection()
+            elif not isinstance(child, _Projection):
+                break
+            node = child
+        else:
+            node[path[-1]] = copy.deepcopy(value)
+
+    def compact(node: Any, source: Any) -> Any:
+        if not isinstance(node, _Projection):
+            return node
+        if isinstance(source, list):
+            return [compact(node[index], source[index]) for index in sorted(node)]
+        return {key: compact(child, source[key]) for key, child in node.items()}
+
+    return compact(projected, item)
+
+
+class _UpdateExpression:
+    """A parsed update expression, applied to items in place."""
+
+    def __init__(
+        self,
+        expression: str,
+        names: dict[str, str],
+        values: dict[str, Any],
+        operation: str,
+    ):
+        self._names = names
+        self._values = values
+        self._operation = operation
+        self._tokens = _TOKEN.findall(expression)
+        if "".join(self._tokens) != re.sub(r"\s+", "", expression):
+            raise _validation_error(
+                operation, f"Invalid UpdateExpression: {expression}"
+            )
+        self._position = 0
+        self.used_names: set[str] = set()
+        self.used_values: set[str] = set()
+        self.actions: list[tuple[str, Path, Any]] = []
+        self._parse()
+
+    @property
+    def paths(self) -> list[Path]:
+        """The paths the expression changes."""
+        return [path for _, path, _ in self.actions]
+
+    def apply(self, item: dict):
+        """Applies every action, reading operands from the item before the update."""
+        original = copy.deepcopy(item)
+        for action, path, operand in self.actions:
+            if action == "SET":
+                _set_path(
+                    item, path, self._evaluate(operand, original), self._operation
+                )
+            elif action == "REMOVE":
+                _remove_path(item, path)
+            else:
+                self._add_or_delete(item, action, path, operand)
+
+    def _add_or_delete(self, item: dict, action: str, path: Path, value: Any):
+        """Adds a number or set members to, or deletes set members from, the path."""
+        current = _get_path(item, path)
+        if action == "ADD" and isinstance(value, Decimal):
+            if current is _MISSING:
+                current = Decimal(0)
+            if not isinstance(current, Decimal):
+                raise _validation_error(
+                    self._operation,
+                    "An operand in the update expression has an incorrect data type",
+                )
+            _set_path(item, path, current + value, self._operation)
+            return
+        if not isinstance(value, set) or (
+            current is not _MISSING and _type_of(current) != _type_of(value)
+        ):
+            raise _validation_error(
+                self._operation,
+                "An operand in the update expression has an incorrect data type",
+            )
+        if action == "ADD":
+            _set_path(
+                item,
+                path,
+                (current if current is not _MISSING else set()) | value,
+                self._operation,
+            )
+        elif current is not _MISSING:
+            remaining = current - value
+            if remaining:
+                _set_path(item, path, remaining, self._operation)
+            else:
+                _remove_path(item, path)
+
+    def _evaluate(self, operand: tuple, item: dict) -> Any:
+        """Evaluates a SET operand."""
+        kind = operand[0]
+        if kind == "value":
+            return copy.deepcopy(operand[1])
+        if kind == "path":
+            value = _get_path(item, operand[1])
+            if value is _MISSING:
+                raise _validation_error(
+                    self._operation,
+                    "The provided expression refers to an attribute that does not exist in the item",
+                )
+            return copy.deepcopy(value)
+        if kind == "if_not_exists":
+            value = _get_path(item, operand[1])
+            if value is _MISSING:
+                return self._evaluate(operand[2], item)
+            return copy.deepcopy(value)
+        left = self._evaluate(operand[1], item)
+        right = self._evaluate(operand[2], item)
+        if kind == "list_append":
+            if not isinstance(left, list) or not isinstance(right, list):
+                raise _validation_error(
+                    self._operation,
+                    "Incorrect operand type for operator or function; operator or function: list_append",
+                )
+            return left + right
+        if not isinstance(left, Decimal) or not isinstance(right, Decimal):
+            raise _validation_error(
+                self._operation,
+                f"Incorrect operand type for operator or function; operator: {kind}",
+            )
+        return left + right if kind == "+" else left - right
+
+    def _parse(self):
+        """Parses the clauses of the expression into actions."""
+        seen = set()
+        while self._position < len(self._tokens):
+            keyword = self._next().upper()
+            if keyword not in _KEYWORDS or keyword in seen:
+                raise _validation_error(
+                    self._operation, f"Invalid UpdateExpression near {keyword}"
+                )
+            seen.add(keyword)
+            while True:
+                path = self._path()
+                if keyword == "SET":
+                    self._expect("=")
+                    self.actions.append((keyword, path, self._set_operand()))
+                elif keyword == "REMOVE":
+                    self.actions.append((keyword, path, None))
+                else:
+                    self.actions.append((keyword, path, self._value()))
+                if self._peek() != ",":
+                    break
+                self._next()
+
+    def _set_operand(self) -> tuple:
+        """Parses `operand [+|- operand]`."""
+        left = self._operand()
+        if self._peek() in ("+", "-"):
+            return (self._next(), left, self._operand())
+        return left
+
+    def _operand(self) -> tuple:
+        """Parses a value, a path or a function call."""
+        token = self._peek()
+        if token.startswith(":"):
+            return ("value", self._value())
+        if token in ("if_not_exists", "list_append"):
+            self._next()
+            self._expect("(")
+            first = self._path() if token == "if_not_exists" else self._operand()
+            self._expect(",")
+            second = self._operand()
+            self._expect(")")
+            return (token, first, second)
+        return ("path", self._path())
+
+    def _path(self) -> Path:
+        """Parses a document path such as `#a0.#a1[2]`."""
+        path: list[str | int] = [self._name()]
+        while self._peek() == "." or self._peek().startswith("["):
+            token = self._next()
+            if token == ".":
+                path.append(self._name())
+            else:
+                path.append(int(token[1:-1]))
+        return tuple(path)
+
+    def _name(self) -> str:
+        """Parses an attribute name or name placeholder."""
+        token = self._next()
+        if token.startswith("#"):
+            if token not in self._names:
+                raise _validation_error(
+                    self._operation,
+                    f"An expression attribute name used in the document path is not defined; attribute name: {token}",
+                )
+            self.used_names.add(token)
+            return self._names[token]
+        if not re.fullmatch(r"[A-Za-z_]\w*", token) or token.upper() in _KEYWORDS:
+            raise _validation_error(
+                self._operation, f"Invalid UpdateExpression near {token}"
+            )
+        return token
+
+    def _value(self) -> Any:
+        """Parses a value placeholder."""
+        token = self._next()
+        if token not in self._values:
+            raise _validation_error(
+                self._operation,
+                f"An expression attribute value used in expression is not defined; attribute value: {token}",
+            )
+        self.used_values.add(token)
+        return self._values[token]
+
+    def _peek(self) -> str:
+        return (
+            self._tokens[self._position] if self._position < len(self._tokens) else ""
+        )
+
+    def _next(self) -> str:
+        token = self._peek()
+        if not token:
+            raise _validation_error(
+                self._operation, "Invalid UpdateExpression: unexpected end"
+            )
+        self._position += 1
+        return token
+
+    def _expect(self, expected: str):
+        token = self._next()
+        if token != expected:
+            raise _validation_error(
+                self._operation, f"Invalid UpdateExpression near {token}"
+            )
+
+
+def _operand_value(operand: Any, item: dict) -> Any:
+    """Evaluates an attribute, size() or literal operand of a condition."""
+    if isinstance(operand, ConditionBase):
+        expression = operand.get_expression()
+        if expression["operator"] != "size":
+            raise TypeError(f"Unexpected operand {expression['operator']}")
+        value = _operand_value(expression["values"][0], item)
+        if value is _MISSING or isinstance(value, (bool, Decimal)) or value is None:
+            return _MISSING
+        return Decimal(len(value))
+    if isinstance(operand, AttributeBase):
+        return _get_path(item, _attribute_path(operand.name))
+    return _serialize(operand)
+
+
+def _comparable(left: Any, right: Any) -> bool:
+    """Whether two values can be ordered, which DynamoDB allows for S, N and B."""
+    return (
+        left is not _MISSING
+        and right is not _MISSING
+        and _type_of(left) == _type_of(right)
+        and _type_of(left) in ("S", "N", "B")
+    )
+
+
+def evaluate_condition(condition: ConditionBase, item: dict) -> bool:
+    """Evaluates a boto3 condition or key condition against an item."""
+    expression = condition.get_expression()
+    operator = expression["operator"]
+    values = expression["values"]
+    if operator == "AND":
+        return all(evaluate_condition(value, item) for value in values)
+    if operator == "OR":
+        return any(evaluate_condition(value, item) for value in values)
+    if operator == "NOT":
+        return not evaluate_condition(values[0], item)
+    operands = [_operand_value(value, item) for value in values]
+    subject = operands[0]
+    if operator == "attribute_exists":
+        return subject is not _MISSING
+    if operator == "attribute_not_exists":
+        return subject is _MISSING
+    if subject is _MISSING:
+        return operator == "<>"
+    if operator == "=":
+        return subject == operands[1] and _type_of(subject) == _type_of(operands[1])
+    if operator == "<>":
+        return subject != operands[1] or _type_of(subject) != _type_of(operands[1])
+    if operator == "IN":
+        return any(
+            subject == value and _type_of(subject) == _type_of(value)
+            for value in operands[1]
+        )
+    if operator == "attribute_type":
+        return _type_of(subject) == operands[1]
+    if operator == "begins_with":
+        return (
+            isinstance(subject, (str, bytes))
+            and _comparable(subject, operands[1])
+            and subject.startswith(operands[1])
+        )
+    if operator == "contains":
+        if isinstance(subject, (str, bytes)):
+            return _comparable(subject, operands[1]) and operands[1] in subject
+        return isinstance(subject, (set, list)) and operands[1] in subject
+    if operator == "BETWEEN":
+        return (
+            _comparable(subject, operands[1])
+            and _comparable(subject, operands[2])
+            and operands[1] <= subject <= operands[2]
+        )
+    if not _comparable(subject, operands[1]):
+        return False
+    return {
+        "<": subject < operands[1],
+        "<=": subject <= operands[1],
+        ">": subject > operands[1],
+        ">=": subject >= operands[1],
+    }[operator]
+
+
+def _key_values(condition: ConditionBase) -> dict[str, Any]:
+    """Returns the attributes a key condition requires to be equal to a value."""
+    expression = condition.get_expression()
+    if expression["operator"] == "AND":
+        values: dict[str, Any] = {}
+        for value in expression["values"]:
+            values.update(_key_values(value))
+        return values
+    if expression["operator"] == "=" and isinstance(
+        expression["values"][0], AttributeBase
+    ):
+        return {expression["values"][0].name: expression["values"][1]}
+    return {}
+
+
+class InMemoryDynamoDBTable:
+    """An in-process emulation of the bot's DynamoDB table and its two GSIs.
+
+    It accepts the keyword arguments of the aioboto3 Table resource methods
+    and answers like them: numbers come back as Decimal, failed conditions,
+    invalid expressions and throttling raise the same ClientError codes, and
+    the GSIs are sparse, holding only items with both index keys. Every call
+    first sleeps for `latency` seconds (or `latency(operation)` seconds), then
+    fails with ProvisionedThroughputExceededException with probability
+    `throttle_rate`, drawn from a generator seeded with `seed`.
+
+    With ReturnConsumedCapacity, responses carry the capacity DynamoDB would
+    bill, from approximate item sizes: reads in 4 KB units (halved unless
+    consistent), writes in 1 KB units, with GSI writes billed per index.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        latency: Latency = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.name = name
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._items: dict[str, dict[str, dict]] = {}
+        self._indexes: dict[str, dict[str, set[tuple[str, str]]]] = {
+            index_name: {} for index_name in TABLE_INDEXES
+        }
+        self.calls: Counter[str] = Counter()
+        self.throttled: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return sum(len(partition) for partition in self._items.values())
+
+    def peek(self, pk: str) -> list[dict]:
+        """Copies the items of a partition, sorted by SK, without a counted call."""
+        partition = self._items.get(pk, {})
+        return [copy.deepcopy(partition[sk]) for sk in sorted(partition)]
+
+    async def get_item(
+        self,
+        Key: dict,
+        ProjectionExpression: str | None = None,
+        ExpressionAttributeNames: dict[str, str] | None = None,
+        ConsistentRead: bool = False,
+        ReturnConsumedCapacity: str = "NONE",
+    ) -> dict:
+        """Gets an item by its key."""
+        await self._call("GetItem")
+        pk, sk = self._key(Key, "GetItem")
+        projection = self._projection(
+            ProjectionExpression, ExpressionAttributeNames, "GetItem"
+        )
+        item = self._items.get(pk, {}).get(sk)
+        response = self._read_capacity(
+            ReturnConsumedCapacity, None, item_size(item), ConsistentRead
+        )
+        if item is not None:
+            response["Item"] = self._output(item, projection)
+        return response
+
+    async def put_item(
+        self,
+        Item: dict,
+        ConditionExpression: ConditionBase | None = None,
+        ReturnValues: str = "NONE",
+        ReturnConsumedCapacity: str = "NONE",
+    ) -> dict:
+        """Creates or replaces an item."""
+        await self._call("PutItem")
+        item = _serialize(Item)
+        pk, sk = self._key(item, "PutItem")
+        self._validate_index_keys(item, "PutItem")
+        old_item = self._items.get(pk, {}).get(sk)
+        self._check_condition(ConditionExpression, old_item, "PutItem")
+        self._store(pk, sk, item, old_item)
+        response = self._write_capacity(ReturnConsumedCapacity, old_item, item)
+        if ReturnValues == "ALL_OLD" and old_item is not None:
+            response["Attributes"] = copy.deepcopy(old_item)
+        return response
+
+    async def update_item(
+        self,
+        Key: dict,
+        UpdateExpression: str,
+        ExpressionAttributeNames: dict[str, str] | None = None,
+        ExpressionAttributeValues: dict[str, Any] | None = None,
+        ConditionExpression: ConditionBase | None = None,
+        ReturnValues: str = "NONE",
+        ReturnConsumedCapacity: str = "NONE",
+    ) -> dict:
+        """Updates an item, creating it if it does not exist."""
+        await self._call("UpdateItem")
+        pk, sk = self._key(Key, "UpdateItem")
+        names = ExpressionAttributeNames or {}
+        update = _UpdateExpression(
+            UpdateExpression,
+            names,
+            _serialize(ExpressionAttributeValues or {}),
+            "UpdateItem",
+        )
+        if ConditionExpression is None:
+            self._check_unused(
+                "ExpressionAttributeNames", names, update.used_names, "UpdateItem"
+            )
+            self._check_unused(
+                "ExpressionAttributeValues",
+                ExpressionAttributeValues or {},
+                update.used_values,
+                "UpdateItem",
+            )
+        for path in update.paths:
+            if path[0] in TABLE_KEY:
+                raise _validation_error(
+                    "UpdateItem",
+                    f"Cannot update attribute {path[0]}. This attribute is part of the key",
+                )
+        old_item = self._items.get(pk, {}).get(sk)
+        self._check_condition(ConditionExpression, old_item, "UpdateItem")
+        item = copy.deepcopy(old_item) if old_item is not None else {"PK": pk, "SK": sk}
+        update.apply(item)
+        self._validate_index_keys(item, "UpdateItem")
+        self._store(pk, sk, item, old_item)
+        response = self._write_capacity(ReturnConsumedCapacity, old_item, item)
+        if ReturnValues == "ALL_NEW":
+            response["Attributes"] = copy.deepcopy(item)
+        elif ReturnValues == "UPDATED_NEW":
+            response.update(self._attributes(_project(item, update.paths)))
+        elif ReturnValues == "ALL_OLD" and old_item is not None:
+            response["Attributes"] = copy.deepcopy(old_item)
+        elif ReturnValues == "UPDATED_OLD" and old_item is not None:
+            response.update(self._attributes(_project(old_item, update.paths)))
+        return response
+
+    async def delete_item(
+        self,
+        Key: dict,
+        ConditionExpression: ConditionBase | None = None,
+        ReturnValues: str = "NONE",
+        ReturnConsumedCapacity: str = "NONE",
+    ) -> dict:
+        """Deletes an item by its key."""
+        await self._call("DeleteItem")
+        pk, sk = self._key(Key, "DeleteItem")
+        old_item = self._items.get(pk, {}).get(sk)
+        self._check_condition(ConditionExpression, old_item, "DeleteItem")
+        self._store(pk, sk, None, old_item)
+        response = self._write_capacity(ReturnConsumedCapacity, old_item, None)
+        if ReturnValues == "ALL_OLD" and old_item is not None:
+            response["Attributes"] = copy.deepcopy(old_item)
+        return response
+
+    async def query(
+        self,
+        KeyConditionExpression: ConditionBase,
+        IndexName: str | None = None,
+        FilterExpression: ConditionBase | None = None,
+        ProjectionExpression: str | None = None,
+        ExpressionAttributeNames: dict[str, str] | None = None,
+        ExclusiveStartKey: dict | None = None,
+        Limit: int | None = None,
+        ScanIndexForward: bool = True,
+        Select: str = "ALL_ATTRIBUTES",
+        ConsistentRead: bool = False,
+        ReturnConsumedCapacity: str = "NONE",
+    ) -> dict:
+        """Queries the items of one partition of the table or of an index."""
+        await self._call("Query")
+        hash_key, range_key = self._index_key(IndexName, "Query")
+        partition = _key_values(KeyConditionExpression).get(hash_key)
+        if not isinstance(partition, str):
+            raise _validation_error(
+                "Query", f"Query condition missed key schema element: {hash_key}"
+            )
+        if IndexName is None:
+            items = list(self._items.get(partition, {}).values())
+        else:
+            items = [
+                self._items[pk][sk]
+                for pk, sk in self._indexes[IndexName].get(partition, ())
+            ]
+        items = [
+            item for item in items if evaluate_condition(KeyConditionExpression, item)
+        ]
+        items.sort(
+            key=lambda item: self._sort_key(item, range_key),
+            reverse=not ScanIndexForward,
+        )
+        return self._page(
+            items,
+            IndexName,
+            range_key,
+            FilterExpression,
+            ProjectionExpression,
+            ExpressionAttributeNames,
+            ExclusiveStartKey,
+            Limit,
+            ScanIndexForward,
+            Select,
+            ConsistentRead,
+            ReturnConsumedCapacity,
+            "Query",
+        )
+
+    async def scan(
+        self,
+        IndexName: str | None = None,
+        FilterExpression: ConditionBase | None = None,
+        ProjectionExpression: str | None = None,
+        ExpressionAttributeNames: dict[str, str] | None = None,
+        ExclusiveStartKey: dict | None = None,
+        Limit: int | None = None,
+        Select: str = "ALL_ATTRIBUTES",
+        ConsistentRead: bool = False,
+        ReturnConsumedCapacity: str = "NONE",
+    ) -> dict:
+        """Scans every item of the table or of an index."""
+        await self._call("Scan")
+        hash_key, range_key = self._index_key(IndexName, "Scan")
+        if IndexName is None:
+            items = [
+                item
+                for partition in self._items.values()
+                for item in partition.values()
+            ]
+        else:
+            items = [
+                self._items[pk][sk]
+                for keys in self._indexes[IndexName].values()
+                for pk, sk in keys
+            ]
+        items.sort(key=lambda item: (item[hash_key], *self._sort_key(item, range_key)))
+        return self._page(
+            items,
+            IndexName,
+            (hash_key, range_key),
+            FilterExpression,
+            ProjectionExpression,
+            ExpressionAttributeNames,
+            ExclusiveStartKey,
+            Limit,
+            True,
+            Select,
+            ConsistentRead,
+            ReturnConsumedCapacity,
+            "Scan",
+        )
+
+    async def _call(self, operation: str):
+        """Counts the call, waits for its latency and maybe throttles it."""
+        self.calls[operation] += 1
+        latency = self.latency(operation) if callable(self.latency) else self.latency
+        await asyncio.sleep(latency)
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            self.throttled[operation] += 1
+            raise _client_error(
+                operation,
+                "ProvisionedThroughputExceededException",
+                "The level of configured provisioned throughput for the table was exceeded.",
+            )
+
+    @staticmethod
+    def _key(key: dict, operation: str) -> tuple[str, str]:
+        """Returns the PK and SK of a key or item, which must be non-empty strings."""
+        values = []
+        for name in TABLE_KEY:
+            value = key.get(name)
+            if not isinstance(value, str) or not value:
+                raise _validation_error(
+                    operation,
+                    "One or more parameter values were invalid: "
+                    f"Type mismatch or missing value for key {name}",
+                )
+            values.append(value)
+        return values[0], values[1]
+
+    @staticmethod
+    def _validate_index_keys(item: dict, operation: str):
+        """Rejects index key attributes that are not non-empty strings."""
+        for index_name, key_names in TABLE_INDEXES.items():
+            for name in key_names:
+                value = item.get(name, _MISSING)
+                if value is not _MISSING and (not isinstance(value, str) or not value):
+                    raise _validation_error(
+                        operation,
+                        "One or more parameter values were invalid: "
+                        f"Type mismatch for Index Key {name} Expected: S IndexName: {index_name}",
+                    )
+
+    @staticmethod
+    def _index_key(index_name: str | None, operation: str) -> tuple[str, str]:
+        """Returns the hash and range key names of the table or an index."""
+        if index_name is None:
+            return TABLE_KEY
+        if index_name not in TABLE_INDEXES:
+            raise _validation_error(
+                operation, f"The table does not have the specified index: {index_name}"
+            )
+        return TABLE_INDEXES[index_name]
+
+    @staticmethod
+    def _sort_key(item: dict, range_key: str) -> tuple:
+        """Orders items by their range key, then by their table key."""
+        return (item[range_key], item["PK"], item["SK"])
+
+    @staticmethod
+    def _check_condition(
+        condition: ConditionBase | None, item: dict | None, operation: str
+    ):
+        """Raises ConditionalCheckFailedException if the condition does not hold."""
+        if condition is None:
+            return
+        if not isinstance(condition, ConditionBase):
+            raise _validation_error(
+                operation, "Only boto3 condition objects are supported"
+            )
+        if not evaluate_condition(condition, item or {}):
+            raise _client_error(
+                operation,
+                "ConditionalCheckFailedException",
+                "The conditional request failed",
+            )
+
+    @staticmethod
+    def _check_unused(kind: str, given: dict, used: set[str], operation: str):
+        """Rejects expression placeholders that the expressions do not use."""
+        unused = ", ".join(sorted(set(given) - used))
+        if unused:
+            raise _validation_error(
+                operation,
+                f"Value provided in {kind} unused in expressions: keys: {{{unused}}}",
+            )
+
+    @staticmethod
+    def _projection(
+        expression: str | None, names: dict[str, str] | None, operation: str
+    ) -> list[Path] | None:
+        """Parses a projection expression into paths."""
+        if expression is None:
+            return None
+        names = names or {}
+        paths = []
+        for part in expression.split(","):
+            path = []
+            for element in _attribute_path(part.strip()):
+                if isinstance(element, str) and element.startswith("#"):
+                    if element not in names:
+                        raise _validation_error(
+                            operation,
+                            f"An expression attribute name used in the document path is not defined; attribute name: {element}",
+                        )
+                    element = names[element]
+                path.append(element)
+            paths.append(tuple(path))
+        return paths
+
+    @staticmethod
+    def _output(item: dict, projection: list[Path] | None) -> dict:
+        """Copies an item for a response, keeping only the projected paths."""
+        if projection is None:
+            return copy.deepcopy(item)
+        return _project(item, projection)
+
+    @staticmethod
+    def _attributes(attributes: dict) -> dict:
+        """Wraps returned attributes, omitting them when there are none."""
+        return {"Attributes": attributes} if attributes else {}
+
+    def _page(
+        self,
+        items: list[dict],
+        index_name: str | None,
+        order: str | tuple[str, str],
+        filter_expression: ConditionBase | None,
+        projection_expression: str | None,
+        names: dict[str, str] | None,
+        exclusive_start_key: dict | None,
+        limit: int | None,
+        forward: bool,
+        select: str,
+        consistent: bool,
+        return_consumed_capacity: str,
+        operation: str,
+    ) -> dict:
+        """Applies the start key, limit, filter and projection of a query or scan."""
+
+        def position(item: dict) -> tuple:
+            if isinstance(order, tuple):
+                return (item[order[0]], *self._sort_key(item, order[1]))
+            return self._sort_key(item, order)
+
+        if exclusive_start_key is not None:
+            start = position(exclusive_start_key)
+            items = [
+                item
+                for item in items
+                if (position(item) > start if forward else position(item) < start)
+            ]
+        evaluated = items[:limit] if limit is not None else items
+        projection = self._projection(projection_expression, names, operation)
+        matched = [
+            item
+            for item in evaluated
+            if filter_expression is None or evaluate_condition(filter_expression, item)
+        ]
+        response: dict[str, Any] = {
+            "Count": len(matched),
+            "ScannedCount": len(evaluated),
+            **self._read_capacity(
+                return_consumed_capacity,
+                index_name,
+                sum(item_size(item) for item in evaluated),
+                consistent,
+            ),
+        }
+        if select != "COUNT":
+            response["Items"] = [self._output(item, projection) for item in matched]
+        if limit is not None and len(evaluated) == limit and evaluated:
+            last = evaluated[-1]
+            key_names = TABLE_KEY + (TABLE_INDEXES[index_name] if index_name else ())
+            response["LastEvaluatedKey"] = {name: last[name] for name in key_names}
+        return response
+
+    def _read_capacity(
+        self, mode: str, index_name: str | None, size: int, consistent: bool
+    ) -> dict:
+        """Builds the ConsumedCapacity of a read of `size` bytes, if requested."""
+        units = _units(size, READ_UNIT_SIZE) * (1.0 if consistent else 0.5)
+        if index_name is None:
+            return self._consumed_capacity(mode, "ReadCapacityUnits", units, {})
+        return self._consumed_capacity(
+            mode, "ReadCapacityUnits", 0.0, {index_name: units}
+        )
+
+    def _write_capacity(
+        self, mode: str, old_item: dict | None, item: dict | None
+    ) -> dict:
+        """Builds the ConsumedCapacity of replacing `old_item` with `item`, if requested.
+
+        A GSI is written when the item enters, changes in or leaves it; a
+        change of its keys is billed as a delete and a put.
+        """
+        if mode == "NONE":
+            return {}
+        old_size, size = item_size(old_item), item_size(item)
+        index_units = {}
+        for index_name, key_names in TABLE_INDEXES.items():
+            old_keys = self._index_keys(old_item, key_names)
+            keys = self._index_keys(item, key_names)
+            units = 0
+            if old_keys is not None and keys != old_keys:
+                units += _units(old_size, WRITE_UNIT_SIZE)
+            if keys is not None and (keys != old_keys or item != old_item):
+                units += _units(size, WRITE_UNIT_SIZE)
+            if units:
+                index_units[index_name] = float(units)
+        return self._consumed_capacity(
+            mode,
+            "WriteCapacityUnits",
+            float(_units(max(old_size, size), WRITE_UNIT_SIZE)),
+            index_units,
+        )
+
+    def _consumed_capacity(
+        self, mode: str, kind: str, table_units: float, index_units: dict[str, float]
+    ) -> dict:
+        """Formats consumed capacity for ReturnConsumedCapacity TOTAL or INDEXES."""
+        if mode == "NONE":
+            return {}
+        total = table_units + sum(index_units.values())
+        consumed: dict[str, Any] = {
+            "TableName": self.name,
+            "CapacityUnits": total,
+            kind: total,
+        }
+        if mode == "INDEXES":
+            consumed["Table"] = {"CapacityUnits": table_units, kind: table_units}
+            if index_units:
+                consumed["GlobalSecondaryIndexes"] = {
+                    index_name: {"CapacityUnits": units, kind: units}
+                    for index_name, units in index_units.items()
+                }
+        return {"ConsumedCapacity": consumed}
+
+    @staticmethod
+    def _index_keys(item: dict | None, key_names: tuple[str, str]) -> tuple | None:
+        """Returns the index keys of an item, or None if it is not in the index."""
+        if item is None or any(name not in item for name in key_names):
+            return None
+        return tuple(item[name] for name in key_names)
+
+    def _store(self, pk: str, sk: str, item: dict | None, old_item: dict | None):
+        """Replaces an item in the table and the indexes; None deletes it."""
+        for index_name, (hash_key, range_key) in TABLE_INDEXES.items():
+            partitions = self._indexes[index_name]
+            if old_item is not None and hash_key in old_item and range_key in old_item:
+                keys = partitions[old_item[hash_key]]
+                keys.discard((pk, sk))
+                if not keys:
+                    del partitions[old_item[hash_key]]
+            if item is not None and hash_key in item and range_key in item:
+                partitions.setdefault(item[hash_key], set()).add((pk, sk))
+        if item is not None:
+            self._items.setdefault(pk, {})[sk] = item
+        elif old_item is not None:
+            del self._items[pk][sk]
+            if not self._items[pk]:
+                del self._items[pk]
+
+
+class InMemoryDynamoDBClient:
+    """A stand-in for DynamoDBClient that keeps its tables in process.
+
+    Tables are created on first use and shared by every `Table` call with
+    the same name, so a DynamoDBCrudManager built on this client behaves as
+    it does on DynamoDB without any AWS access.
+    """
+
+    def __init__(
+        self,
+        latency: Latency = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.seed = seed
+        self.tables: dict[str, InMemoryDynamoDBTable] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    async def Table(
+        self, name: str
+    ) -> InMemoryDynamoDBTable:  # pylint: disable=invalid-name
+        """Returns the table with the given name, creating it if needed."""
+        table = self.tables.get(name)
+        if table is None:
+            table = InMemoryDynamoDBTable(
+                name,
+                latency=self.latency,
+                throttle_rate=self.throttle_rate,
+                seed=self.seed,
+            )
+            self.tables[name] = table
+        return table
@@ -1,20 +1,51 @@
 """../clients/user_client.py"""
 
 import logging
+from typing import Any, Protocol
+
 from telethon import TelegramClient
 
 
+class TelegramConnection(Protocol):
+    """What TelegramBot runs on: TelethonClient, or a stand-in with the same interface."""
+
+    telethon_client: Any
+
+    async def connect(self):
+        """Connect to the Telegram API."""
+
+    async def cleanup(self):
+        """Clean up resources when the client is done."""
+
+    async def __aenter__(self) -> Any:
+        """Set the client up and return it."""
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Clean the client up."""
+
+
 class TelethonClient:
     """User Account Client for interacting with the Telegram API."""
 
-    def __init__(self, session_file: str, api_id: int, api_hash: str, logger=None):
-        """Initialize the UserClient."""
+    def __init__(
+        self,
+        session_file: str,
+        api_id: int,
+        api_hash: str,
+        flood_sleep_threshold: int = 7 * 24 * 60 * 60,  # 1 week
+        logger=None,
+    ):
+        """Initialize the UserClient.
+
+        Flood waits longer than `flood_sleep_threshold` seconds are raised
+        instead of slept through, so that the caller can reschedule the call.
+        """
         self.telethon_client = TelegramClient(
             session_file,
             api_id,
             api_hash,
             request_retries=-1, # Infinite retries
-            flood_sleep_threshold=7 * 24 * 60 * 60, # 1 week
+            flood_sleep_threshold=flood_sleep_threshold,
         )
         self.logger = logger or logging.getLogger(__name__)
 
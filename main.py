@@ -1,10 +1,19 @@
 """./main.py"""
 
+# pylint: disable=wrong-import-position
+import time
+
+# The process start, as far as the startup phases are concerned.
+STARTED = time.perf_counter()
+
 import asyncio
+import os
+from contextlib import asynccontextmanager
 from typing import Type
 
 from bot.bot import TelegramBot
 
+from bot.config_snapshot import DEFAULT_SNAPSHOT_PATH, CompiledConfig, ConfigSnapshot
 from bot.conversation_flow import ConversationFlow
 
 from bot.handlers.callback_handler import initialize_callback_handler
@@ -12,6 +21,13 @@ from bot.handlers.message_handlers import initialize_text_messege_handler
 from bot.handlers.start_handler import initialize_start_handler
 
 from bot.services.dynamodb_crud_manager import DynamoDBCrudManager
+from bot.services.metrics import MetricsServer, metrics
+from bot.services.startup import StartupTimer
+from bot.services.storage import Storage
+from bot.services.tracing import JsonlSink, tracer
+from bot.services.user_leases import LeaseFencedStorage, UserLeases
+from bot.services.worker_pool import WorkerPool
+from bot.services.write_behind_buffer import WriteBehindBuffer
 from clients.dynamodb_client import DynamoDBClient
 from clients.telethon_client import TelethonClient
 
@@ -21,6 +37,12 @@ from config.logging.config_logging import setup_logging
 from config.state_machine.state_machine_config import create_state_machine_config
 from config.telegram_config import TelegramConfig
 
+HANDLER_FACTORIES = [
+    initialize_start_handler,
+    initialize_callback_handler,
+    initialize_text_messege_handler,
+]
+
 
 async def run_bot(
     bot_client_param: TelethonClient,
@@ -29,41 +51,129 @@ async def run_bot(
     dynamodb_crud_manager: DynamoDBCrudManager,
     logging_config_file: str,
     conversation_flow: Type[ConversationFlow],
+    metrics_server: MetricsServer | None = None,
+    startup: StartupTimer | None = None,
+    leases: UserLeases | None = None,
+    write_behind: bool = True,
 ) -> None:
     """Run the Telegram bot."""
     setup_logging(logging_config_file)
 
-    async with dynamodb_client as dynamodb_client:
-        await _run_bot(
-            bot_client_param=bot_client_param,
-            user_client_param=user_client_param,
-            dynamodb_crud_manager=dynamodb_crud_manager,
-            conversation_flow=conversation_flow,
-        )
+    # The Telegram handshakes wait on the network while the DynamoDB client
+    # imports boto3 in a thread; entering the clients later does not reconnect.
+    connecting = asyncio.gather(
+        bot_client_param.connect(), user_client_param.connect()
+    )
+    try:
+        async with dynamodb_client as dynamodb_client:
+            if startup is not None:
+                startup.mark("dynamodb")
+            await connecting
+            await _run_bot(
+                bot_client_param=bot_client_param,
+                user_client_param=user_client_param,
+                dynamodb_crud_manager=dynamodb_crud_manager,
+                conversation_flow=conversation_flow,
+                metrics_server=metrics_server,
+                startup=startup,
+                leases=leases,
+                write_behind=write_behind,
+            )
+    finally:
+        connecting.cancel()
 
 
 async def _run_bot(
     bot_client_param: TelethonClient,
     user_client_param: TelethonClient,
-    dynamodb_crud_manager: DynamoDBCrudManager,
+    dynamodb_crud_manager: Storage,
     conversation_flow: Type[ConversationFlow],
+    metrics_server: MetricsServer | None = None,
+    startup: StartupTimer | None = None,
+    leases: UserLeases | None = None,
+    write_behind: bool = True,
 ) -> None:
-    handlers = [
-        initialize_start_handler(conversation_flow, dynamodb_crud_manager),
-        initialize_callback_handler(conversation_flow, dynamodb_crud_manager),
-        initialize_text_messege_handler(conversation_flow, dynamodb_crud_manager),
-    ]
+    write_behind_buffer = None
+    storage = dynamodb_crud_manager
+    if leases is not None:
+        # User item writes only land while this replica still leases the user.
+        storage = LeaseFencedStorage(storage, leases)
+    if write_behind:
+        storage = write_behind_buffer = WriteBehindBuffer(storage)
+    handlers = [factory(conversation_flow, storage) for factory in HANDLER_FACTORIES]
     async with TelegramBot(
-        bot_client=bot_client_param, user_client=user_client_param, handlers=handlers
+        bot_client=bot_client_param,
+        user_client=user_client_param,
+        handlers=handlers,
+        write_behind_buffer=write_behind_buffer,
+        metrics_server=metrics_server,
+        startup=startup,
+        leases=leases,
     ):
         pass
 
 
+@asynccontextmanager
+async def worker_storage():
+    """The storage of a worker process, with its own DynamoDB connection pool."""
+    async with DynamoDBClient(
+        region_name=DynamoDBConfig.AWS_REGION_NAME
+    ) as dynamodb_client:
+        yield DynamoDBCrudManager(
+            dynamodb_client=dynamodb_client, table_name=DynamoDBConfig.TABLE_NAME
+        )
+
+
+async def run_bot_with_workers(
+    bot_client_param: TelethonClient,
+    user_client_param: TelethonClient,
+    logging_config_file: str,
+    workers: int,
+    compiled: CompiledConfig,
+    metrics_server: MetricsServer | None = None,
+    startup: StartupTimer | None = None,
+    write_behind: bool = True,
+) -> None:
+    """Run the Telegram bot, handling updates in worker processes."""
+    setup_logging(logging_config_file)
+
+    connecting = asyncio.gather(
+        bot_client_param.connect(), user_client_param.connect()
+    )
+    try:
+        async with WorkerPool(
+            workers,
+            compiled,
+            storage_factory=worker_storage,
+            handler_factories=HANDLER_FACTORIES,
+            client=bot_client_param.telethon_client,
+            write_behind=write_behind,
+        ) as pool:
+            if startup is not None:
+                startup.mark("workers")
+            await connecting
+            async with TelegramBot(
+                bot_client=bot_client_param,
+                user_client=user_client_param,
+                handlers=[pool.handler],
+                metrics_server=metrics_server,
+                startup=startup,
+            ):
+                pass
+    finally:
+        connecting.cancel()
+
+
 if __name__ == "__main__":
+    startup_timer = StartupTimer(STARTED)
+    startup_timer.mark("imports")
+
     bot_client = TelethonClient(
         session_file=FilePathConfig.TELETHON_BOT_SESSION_FILE,
         api_id=int(TelegramConfig.API_ID),
         api_hash=TelegramConfig.API_HASH,
+        # Longer flood waits are rescheduled by the send scheduler.
+        flood_sleep_threshold=5,
     )
     user_client = TelethonClient(
         session_file=FilePathConfig.TELETHON_USER_SESSION_FILE,
@@ -77,16 +187,71 @@ if __name__ == "__main__":
         dynamodb_client=db_client, table_name=DynamoDBConfig.TABLE_NAME
     )
 
-    state_machine_config = create_state_machine_config()
-    ConversationFlow.config(config=state_machine_config)
-
-    asyncio.run(
-        run_bot(
-            bot_client_param=bot_client,
-            user_client_param=user_client,
-            logging_config_file=FilePathConfig.LOGGING_CONFIG_FILE,
-            dynamodb_client=db_client,
-            dynamodb_crud_manager=db_crud_manager,
-            conversation_flow=ConversationFlow,
+    # Traces of sampled and slow updates, for finding slow events offline.
+    if os.environ.get("TRACE_FILE"):
+        tracer.configure(
+            JsonlSink(os.environ["TRACE_FILE"]),
+            sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "0.01")),
+            slow_threshold=float(os.environ.get("TRACE_SLOW_SECONDS", "1.0")),
         )
+
+    # Restarts reuse the compiled config until one of its source files changes.
+    compiled_config = ConversationFlow.config_from_snapshot(
+        ConfigSnapshot(
+            os.environ.get("CONFIG_SNAPSHOT_FILE", DEFAULT_SNAPSHOT_PATH)
+        ),
+        create_state_machine_config,
+    )
+    startup_timer.mark("config")
+
+    # With WRITE_BEHIND=0, handlers write through to DynamoDB without buffering.
+    write_behind_enabled = os.environ.get("WRITE_BEHIND", "1") != "0"
+
+    # With BOT_WORKERS set, updates are handled in that many worker processes,
+    # sharded by sender, each with its own DynamoDB client.
+    worker_count = int(os.environ.get("BOT_WORKERS", "0"))
+
+    # With REPLICA_ID set, replicas share the users through leases in the table,
+    # so several of them can run at once. Leases are held by in-process handlers.
+    user_leases = None
+    if os.environ.get("REPLICA_ID") and worker_count > 0:
+        raise SystemExit("REPLICA_ID cannot be combined with BOT_WORKERS.")
+    if os.environ.get("REPLICA_ID"):
+        user_leases = UserLeases(db_crud_manager, owner=os.environ["REPLICA_ID"])
+        ConversationFlow.use_leases(user_leases)
+
+    # Scraped locally in the Prometheus text format at /metrics.
+    bot_metrics_server = MetricsServer(
+        metrics,
+        host=os.environ.get("METRICS_HOST", "127.0.0.1"),
+        port=int(os.environ.get("METRICS_PORT", "9100")),
     )
+
+    if worker_count > 0:
+        asyncio.run(
+            run_bot_with_workers(
+                bot_client_param=bot_client,
+                user_client_param=user_client,
+                logging_config_file=FilePathConfig.LOGGING_CONFIG_FILE,
+                workers=worker_count,
+                compiled=compiled_config,
+                metrics_server=bot_metrics_server,
+                startup=startup_timer,
+                write_behind=write_behind_enabled,
+            )
+        )
+    else:
+        asyncio.run(
+            run_bot(
+                bot_client_param=bot_client,
+                user_client_param=user_client,
+                logging_config_file=FilePathConfig.LOGGING_CONFIG_FILE,
+                dynamodb_client=db_client,
+                dynamodb_crud_manager=db_crud_manager,
+                conversation_flow=ConversationFlow,
+                metrics_server=bot_metrics_server,
+                startup=startup_timer,
+                leases=user_leases,
+                write_behind=write_behind_enabled,
+            )
+        )
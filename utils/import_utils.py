@@ -0,0 +1,45 @@
+"""../utils/import_utils.py"""
+
+import importlib
+import threading
+from types import ModuleType
+from typing import Any
+
+
+class LazyModule:
+    """A module imported on first attribute access instead of at import time.
+
+    Used for heavy modules that are not needed on the startup path, such as
+    boto3's. `load` imports it explicitly, for example in a worker thread
+    while the event loop waits on the network.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._module: ModuleType | None = None
+        self._lock = threading.Lock()
+
+    def load(self) -> ModuleType:
+        """Imports the module, once."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the module has been imported."""
+        return self._module is not None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.load(), name)
+
+    def __repr__(self) -> str:
+        return f"<LazyModule {self.name!r} {'loaded' if self.loaded else 'not loaded'}>"
+
+
+def preload_modules(*modules: LazyModule):
+    """Imports lazy modules, meant to be run with `asyncio.to_thread`."""
+    for module in modules:
+        module.load()
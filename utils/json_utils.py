@@ -1,9 +1,26 @@
 """../utils/json_utils.py"""
 
 import json
+from contextlib import contextmanager
+from typing import Iterator
+
+_recorders: list[list[str]] = []
 
 
 def load_json_file(file_path) -> dict:
     """Loads a JSON file."""
+    for loaded_files in _recorders:
+        loaded_files.append(str(file_path))
     with open(file_path, "r", encoding="utf-8") as file:
         return json.load(file)
+
+
+@contextmanager
+def record_loaded_files() -> Iterator[list[str]]:
+    """Collects the paths of the JSON files loaded in the block."""
+    loaded_files: list[str] = []
+    _recorders.append(loaded_files)
+    try:
+        yield loaded_files
+    finally:
+        _recorders.remove(loaded_files)